@@ -0,0 +1,238 @@
+"""
+Contains the offline crawl throughput benchmark.
+
+Starts the play store stub (see play_stub) in a process of its own, points PlayFetch
+at it and runs a DISCOVER and then a DETAILS manager over the synthetic graph, each
+until its frontier is drained. Every phase reports apps and requests per second,
+the p50 / p99 request latency and the peak RSS of the benchmark process, e.g.
+
+    python play_benchmark.py --apps 5000 --latency 0.02 --error-rate 0.01 --output benchmark.json
+
+No network access is needed, the stub only listens on the loopback interface.
+"""
+import argparse
+import asyncio
+import json
+import logging as log
+import multiprocessing
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from play_scraper import settings
+
+from play_helper import (
+    DEFAULT_WORKER_COUNT,
+    DEFAULT_CARD_PARSER
+)
+from play_fetch import PlayFetch
+from play_limiter import rate_limiter
+from play_parser import get_parse_pool, shutdown_parse_pool
+from play_manager import InitiatedPlayManager, PlayManager
+from play_stub import run_stub, STUB_HOST
+
+DISCOVER_PHASE = 'DISCOVER'
+DETAILS_PHASE = 'DETAILS'
+PHASES = [DISCOVER_PHASE, DETAILS_PHASE]
+
+class BenchmarkPlayFetch(PlayFetch):
+    """
+    PlayFetch keeping the latency of every request, as the histogram buckets of its metrics are too coarse for a p99.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.latencies = []
+
+    async def send_request(self, *args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return await super().send_request(*args, **kwargs)
+        finally:
+            self.latencies.append(time.perf_counter() - start_time)
+
+def percentile(values, share):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+def peak_rss_mb():
+    # kilobytes on linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def start_stub(graph_options, stub_options):
+    context = multiprocessing.get_context('spawn')
+    connection, child_connection = context.Pipe()
+    process = context.Process(
+        target=run_stub,
+        name='play-stub',
+        args=(child_connection, graph_options, stub_options),
+        daemon=True
+    )
+    process.start()
+    child_connection.close()
+    if not connection.poll(30):
+        process.terminate()
+        raise RuntimeError('STUB_NOT_STARTED')
+    return process, connection.recv()
+
+def point_play_fetch_at(port):
+    base_url = 'http://{}:{}'.format(STUB_HOST, port)
+    settings.BASE_URL = '{}/store/apps'.format(base_url)
+    settings.SEARCH_URL = '{}/store/search'.format(base_url)
+
+def run_phase(phase, work_dir, workers, card_parser, offload_parsing, timeout):
+    """
+    Runs a manager of type `phase` until it completes (or `timeout` seconds) and returns its report.
+    """
+    log.info('*** starting benchmark phase: {} ***'.format(phase))
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    initiated_manager = InitiatedPlayManager(
+        'benchmark',
+        process_type=phase,
+        read_dir=work_dir,
+        opt_path_prefix='{}/benchmark_{}'.format(work_dir, phase.lower()),
+        workers=workers,
+        card_parser=card_parser,
+        offload_parsing=offload_parsing
+    )
+    play = BenchmarkPlayFetch(
+        persist=True,
+        card_parser=card_parser,
+        parse_executor=get_parse_pool() if offload_parsing else None
+    )
+    holder = dict()
+
+    async def stop_on_timeout():
+        await asyncio.sleep(timeout)
+        manager = holder.get('manager')
+        if manager is not None and not manager.is_cancelled():
+            log.warning('### benchmark phase: {} timed out after {}s ###'.format(phase, timeout))
+            await manager.shutdown()
+
+    async def start():
+        await play.open()
+        manager = PlayManager(initiated_manager, play, is_delegated=True)
+        holder['manager'] = manager
+        loop.create_task(stop_on_timeout())
+        if phase == DETAILS_PHASE:
+            await manager.fetch_detailed_info_for_apps()
+        else:
+            await manager.discover_apps()
+
+    start_time = time.perf_counter()
+    loop.create_task(start())
+    # the manager stops the loop once it is shut down
+    loop.run_forever()
+    elapsed = time.perf_counter() - start_time
+    pending_tasks = asyncio.all_tasks(loop)
+    for task in pending_tasks:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*pending_tasks, return_exceptions=True))
+    loop.run_until_complete(play.force_close())
+    loop.close()
+
+    manager = holder.get('manager')
+    endpoints = play.metrics.snapshot()
+    requests = sum(metrics.get('requests') for metrics in endpoints.values())
+    errors = sum(sum(metrics.get('errors').values()) for metrics in endpoints.values())
+    records = manager.records_processed if phase == DETAILS_PHASE else manager.records_found
+    return dict(
+        phase=phase,
+        status=manager.status,
+        records=records,
+        requests=requests,
+        errors=errors,
+        elapsed=round(elapsed, 3),
+        apps_per_second=round(records / elapsed, 2),
+        requests_per_second=round(requests / elapsed, 2),
+        latency_p50_ms=round(percentile(play.latencies, 0.5) * 1000, 2) if play.latencies else None,
+        latency_p99_ms=round(percentile(play.latencies, 0.99) * 1000, 2) if play.latencies else None,
+        peak_rss_mb=peak_rss_mb()
+    )
+
+def run_benchmark(phases=PHASES, apps=5000, similar=20, locality=0.8, cluster_size=250, latency=0.02,
+        jitter=0.5, error_rate=0.0, error_status=500, workers=DEFAULT_WORKER_COUNT,
+        card_parser=DEFAULT_CARD_PARSER, offload_parsing=False, rate=10000.0, timeout=600, seed=0):
+    stub_process, port = start_stub(
+        dict(apps=apps, similar=similar, locality=locality, cluster_size=cluster_size, seed=seed),
+        dict(latency=latency, jitter=jitter, error_rate=error_rate, error_status=error_status, seed=seed)
+    )
+    log.info('*** stub serving on port: {} ***'.format(port))
+    point_play_fetch_at(port)
+    rate_limiter.configure(rate=rate, burst=int(rate))
+    work_dir = tempfile.mkdtemp(prefix='play_benchmark_')
+    try:
+        reports = [
+            run_phase(phase, work_dir, workers, card_parser, offload_parsing, timeout)
+            for phase in phases
+        ]
+    finally:
+        stub_process.terminate()
+        stub_process.join()
+        shutdown_parse_pool()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return dict(
+        options=dict(
+            apps=apps, similar=similar, locality=locality, cluster_size=cluster_size, latency=latency,
+            jitter=jitter, error_rate=error_rate, error_status=error_status, workers=workers,
+            card_parser=card_parser, offload_parsing=offload_parsing, rate=rate, seed=seed
+        ),
+        phases=reports
+    )
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Offline crawl throughput benchmark against a local play store stub')
+    parser.add_argument('--phases', default=','.join(PHASES), help='comma separated phases to run, in order')
+    parser.add_argument('--apps', type=int, default=5000, help='apps in the synthetic graph')
+    parser.add_argument('--similar', type=int, default=20, help='apps per similar page')
+    parser.add_argument('--locality', type=float, default=0.8, help='share of similar apps from the same cluster')
+    parser.add_argument('--cluster-size', type=int, default=250)
+    parser.add_argument('--latency', type=float, default=0.02, help='stub response latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.5, help='latency jitter, as a share of the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of failed stub responses')
+    parser.add_argument('--error-status', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKER_COUNT)
+    parser.add_argument('--card-parser', default=DEFAULT_CARD_PARSER)
+    parser.add_argument('--offload-parsing', action='store_true')
+    parser.add_argument('--rate', type=float, default=10000.0, help='rate limit in requests per second')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds after which a phase is stopped')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write the report to this json file')
+    parser.add_argument('--log-level', default='WARNING')
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    log.basicConfig(level=args.log_level.upper())
+    phases = [phase.strip().upper() for phase in args.phases.split(',') if phase.strip()]
+    unknown_phases = [phase for phase in phases if phase not in PHASES]
+    if unknown_phases:
+        print('unknown phases: {}, must be among {}'.format(unknown_phases, PHASES))
+        sys.exit(2)
+    report = run_benchmark(
+        phases=phases,
+        apps=args.apps,
+        similar=args.similar,
+        locality=args.locality,
+        cluster_size=args.cluster_size,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        workers=args.workers,
+        card_parser=args.card_parser,
+        offload_parsing=args.offload_parsing,
+        rate=args.rate,
+        timeout=args.timeout,
+        seed=args.seed
+    )
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    # a phase which did not drain its frontier fails the run, e.g. in CI
+    sys.exit(0 if all(phase.get('status') == 'COMPLETED' for phase in report.get('phases')) else 1)
@@ -0,0 +1,260 @@
+"""
+Contains the process wide on-disk response cache shared by every PlayFetch instance.
+
+Responses are kept zlib compressed in a sqlite file and looked up by a hash of the
+method, url, params and post body. A response is served from the cache while it is
+younger than the TTL of its endpoint; once stale it is revalidated with the ETag /
+Last-Modified it was served with, and a 304 serves the cached body again. The least
+recently used responses are evicted whenever the cache grows past its size cap.
+The managers' loops never touch the sqlite file themselves: their lookups and
+stores run on a thread owned by the cache (see `ResponseCache.run`).
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from play_helper import (
+    CACHE_ENABLED,
+    CACHE_DIR,
+    CACHE_MAX_SIZE,
+    CACHE_TTLS
+)
+
+log = logging.getLogger(__name__)
+
+CACHE_FILENAME = 'responses.sqlite3'
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS responses (
+        key TEXT PRIMARY KEY NOT NULL,
+        endpoint TEXT NOT NULL,
+        body BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        etag TEXT,
+        last_modified TEXT,
+        stored_at REAL NOT NULL,
+        last_access REAL NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)'
+]
+
+def endpoint_for(url):
+    """
+    Maps a play store url to the endpoint its TTL is looked up by, e.g. `details` or `collection`.
+    """
+    parts = urlsplit(url).path.strip('/').split('/')
+    return 'collection' if 'collection' in parts else parts[-1]
+
+def cache_key(method, url, params=None, data=None):
+    return hashlib.sha256(json.dumps(
+        [method, url, sorted((params or {}).items()), data],
+        sort_keys=True,
+        default=str
+    ).encode('utf-8')).hexdigest()
+
+class CachedResponse():
+    __slots__ = ('key', 'endpoint', 'body', 'etag', 'last_modified', 'stored_at')
+
+    def __init__(self, key, endpoint, body, etag, last_modified, stored_at):
+        self.key = key
+        self.endpoint = endpoint
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = stored_at
+
+    def is_fresh(self, ttl):
+        return time.time() - self.stored_at < ttl
+
+    def conditional_headers(self):
+        headers = dict()
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+class ResponseCache():
+    def __init__(self, enabled=CACHE_ENABLED, cache_dir=CACHE_DIR, max_size=CACHE_MAX_SIZE, ttls=CACHE_TTLS):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._connection = None
+        self._size = None
+        self.enabled = enabled
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.ttls = dict(ttls)
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.stores = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def configure(self, enabled=None, max_size=None, ttls=None):
+        with self._lock:
+            if enabled is not None:
+                self.enabled = enabled
+            if max_size:
+                self.max_size = max_size
+            if ttls:
+                self.ttls.update(ttls)
+            if self._connection is not None:
+                self._evict()
+
+    def _connect(self):
+        if self._connection is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._connection = sqlite3.connect(
+                os.path.join(self.cache_dir, CACHE_FILENAME),
+                isolation_level=None,
+                check_same_thread=False
+            )
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                self._connection.execute(statement)
+            self._size = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        return self._connection
+
+    def _evict(self):
+        if self._size <= self.max_size:
+            return
+        # evict down to 90% of the cap so that eviction does not run on every store
+        target = self.max_size * 0.9
+        evicted_keys = []
+        for key, size in self._connection.execute('SELECT key, size FROM responses ORDER BY last_access'):
+            if self._size <= target:
+                break
+            evicted_keys.append((key,))
+            self._size -= size
+        self._connection.executemany('DELETE FROM responses WHERE key = ?', evicted_keys)
+        self.evictions += len(evicted_keys)
+        log.info('*** evicted [{}] responses from cache ***'.format(len(evicted_keys)))
+
+    def _get_executor(self):
+        # created on first use, so that processes never querying the cache do not get it;
+        # a single thread, as every call holds the lock anyway
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='response-cache')
+            return self._executor
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Awaits the cache method `func` run on the cache's thread, so that the calling
+        loop neither blocks on sqlite and zlib nor waits for the lock held by other loops.
+        """
+        return await asyncio.get_event_loop().run_in_executor(
+            self._get_executor(),
+            functools.partial(func, *args, **kwargs)
+        )
+
+    def ttl_for(self, endpoint):
+        return self.ttls.get(endpoint, 0)
+
+    def is_cached(self, endpoint):
+        return self.enabled and self.ttl_for(endpoint) > 0
+
+    def lookup(self, key, endpoint):
+        """
+        Returns the cached response for `key` (fresh or stale) or None; None as well when the endpoint is not cached.
+        """
+        if not self.is_cached(endpoint):
+            return None
+        with self._lock:
+            try:
+                connection = self._connect()
+                row = connection.execute(
+                    'SELECT body, etag, last_modified, stored_at FROM responses WHERE key = ?',
+                    (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                connection.execute('UPDATE responses SET last_access = ? WHERE key = ?', (time.time(), key))
+            except sqlite3.Error:
+                self.errors += 1
+                log.exception('@@@ failed to look up response: {} in cache @@@'.format(key))
+                return None
+        body, etag, last_modified, stored_at = row
+        return CachedResponse(key, endpoint, zlib.decompress(body).decode('utf-8'), etag, last_modified, stored_at)
+
+    def record_hit(self):
+        self.hits += 1
+
+    def record_miss(self, endpoint):
+        if self.is_cached(endpoint):
+            self.misses += 1
+
+    def revalidate(self, response):
+        """
+        Marks a stale response as fresh again after a 304 Not Modified.
+        """
+        self.revalidated += 1
+        with self._lock:
+            try:
+                now = time.time()
+                self._connect().execute(
+                    'UPDATE responses SET stored_at = ?, last_access = ? WHERE key = ?',
+                    (now, now, response.key)
+                )
+            except sqlite3.Error:
+                self.errors += 1
+                log.exception('@@@ failed to revalidate response: {} in cache @@@'.format(response.key))
+
+    def store(self, key, endpoint, body, etag=None, last_modified=None):
+        if not self.is_cached(endpoint):
+            return
+        compressed_body = zlib.compress(body.encode('utf-8'))
+        with self._lock:
+            try:
+                connection = self._connect()
+                previous = connection.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+                now = time.time()
+                connection.execute(
+                    'INSERT OR REPLACE INTO responses '
+                    '(key, endpoint, body, size, etag, last_modified, stored_at, last_access) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (key, endpoint, compressed_body, len(compressed_body), etag, last_modified, now, now)
+                )
+                self._size += len(compressed_body) - (previous[0] if previous else 0)
+                self.stores += 1
+                self._evict()
+            except sqlite3.Error:
+                self.errors += 1
+                log.exception('@@@ failed to store response: {} in cache @@@'.format(key))
+
+    def clear(self):
+        with self._lock:
+            self._connect().execute('DELETE FROM responses')
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            entries = self._connect().execute('SELECT COUNT(*) FROM responses').fetchone()[0] if self.enabled else None
+            lookups = self.hits + self.misses
+            return dict(
+                enabled=self.enabled,
+                max_size=self.max_size,
+                size=self._size,
+                entries=entries,
+                ttls=self.ttls,
+                hits=self.hits,
+                misses=self.misses,
+                hit_ratio=round(self.hits / lookups, 4) if lookups else None,
+                revalidated=self.revalidated,
+                stores=self.stores,
+                evictions=self.evictions,
+                errors=self.errors
+            )
+
+response_cache = ResponseCache()
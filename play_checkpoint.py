@@ -0,0 +1,63 @@
+"""
+Contains the append only checkpoint writer used for flushing manager records.
+"""
+import json
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+CHECKPOINT_EXTENSION = '.jsonl'
+
+def checkpoint_path_for(opt_path):
+    return '{}{}'.format(os.path.splitext(opt_path)[0], CHECKPOINT_EXTENSION)
+
+def iter_checkpoint_records(file_path):
+    with open(file_path) as checkpoint_file:
+        for line_no, line in enumerate(checkpoint_file):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # a crash while appending leaves at most the last line truncated
+                log.warning('### skipping corrupt line: {} in checkpoint: {} ###'.format(line_no, file_path))
+
+class JsonlCheckpointWriter():
+    """
+    Appends one json record per line; every write is fsync'ed before returning
+    so that records reported as written survive a crash of the server.
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.records_written = 0
+        self.flushes = 0
+
+    def _append_with_retry(self, lines, retry=2):
+        if retry <= 0:
+            return False
+        try:
+            with open(self.file_path, 'a') as checkpoint_file:
+                checkpoint_file.writelines(lines)
+                checkpoint_file.flush()
+                os.fsync(checkpoint_file.fileno())
+        except:
+            log.exception('@@@ failed to append to checkpoint: {} @@@'.format(self.file_path))
+            return self._append_with_retry(lines, retry=retry-1)
+        else:
+            return True
+
+    def write(self, records):
+        if not records:
+            return True
+        lines = ['{}\n'.format(json.dumps(record)) for record in records]
+        is_written = self._append_with_retry(lines)
+        if is_written:
+            self.records_written += len(lines)
+            self.flushes += 1
+            log.info('*** appended [{}] records to checkpoint: {} ***'.format(len(lines), self.file_path))
+        return is_written
+
+    def close(self):
+        pass
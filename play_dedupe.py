@@ -0,0 +1,243 @@
+"""
+Contains the visited sets used by the managers for deduplicating app ids.
+
+`exact` keeps the ids themselves, `compact` keeps 64 bit hashes of the ids in an
+array backed open addressing table (exact up to hash collisions, ~12 bytes per id),
+and `bloom` keeps a Bloom filter sized for a capacity and false positive rate
+(a false positive means an app is wrongly treated as already seen).
+"""
+import base64
+import json
+import math
+import logging
+from array import array
+from hashlib import blake2b
+
+from play_helper import (
+    DEDUPE_CAPACITY,
+    DEDUPE_ERROR_RATE
+)
+
+log = logging.getLogger(__name__)
+
+EXACT_DEDUPE = 'exact'
+COMPACT_DEDUPE = 'compact'
+BLOOM_DEDUPE = 'bloom'
+
+ID_LINE = 'V'
+HASH_LINE = 'H'
+BLOOM_HEADER_LINE = 'BLOOM'
+BLOOM_BITS_LINE = 'B'
+
+BLOOM_CHUNK_SIZE = 1 << 20
+COMPACT_INITIAL_SIZE = 1 << 16
+COMPACT_MAX_LOAD = 0.7
+MASK_64 = (1 << 64) - 1
+
+def hash_app_id(app_id):
+    """
+    Stable 64 bit hash of an app id; unlike hash() it survives restarts, so it can be snapshotted.
+    """
+    return int.from_bytes(blake2b(app_id.encode('utf-8'), digest_size=8).digest(), 'little')
+
+class ExactVisitedSet():
+    kind = EXACT_DEDUPE
+
+    def __init__(self, **kwargs):
+        self._ids = set()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, app_id):
+        return app_id in self._ids
+
+    def add(self, app_id):
+        if app_id in self._ids:
+            return False
+        self._ids.add(app_id)
+        return True
+
+    def ids(self):
+        return list(self._ids)
+
+    def snapshot_lines(self):
+        for app_id in self._ids:
+            yield ID_LINE, app_id
+
+    def load_line(self, line_type, value):
+        if line_type == ID_LINE:
+            self._ids.add(value)
+            return True
+        return False
+
+class CompactVisitedSet():
+    kind = COMPACT_DEDUPE
+
+    def __init__(self, **kwargs):
+        self._table = array('Q', bytes(8 * COMPACT_INITIAL_SIZE))
+        self._mask = COMPACT_INITIAL_SIZE - 1
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, app_id):
+        return self._contains_hash(hash_app_id(app_id) or 1)
+
+    def _contains_hash(self, value):
+        slot = value & self._mask
+        while True:
+            current = self._table[slot]
+            if current == value:
+                return True
+            if current == 0:
+                return False
+            slot = (slot + 1) & self._mask
+
+    def _grow(self):
+        old_table = self._table
+        self._table = array('Q', bytes(16 * len(old_table)))
+        self._mask = len(self._table) - 1
+        self._count = 0
+        for value in old_table:
+            if value:
+                self.add_hash(value)
+
+    def add_hash(self, value):
+        # 0 marks an empty slot, the (1 in 2^64) zero hash is folded into 1
+        value = value or 1
+        slot = value & self._mask
+        while True:
+            current = self._table[slot]
+            if current == value:
+                return False
+            if current == 0:
+                break
+            slot = (slot + 1) & self._mask
+        self._table[slot] = value
+        self._count += 1
+        if self._count > COMPACT_MAX_LOAD * len(self._table):
+            self._grow()
+        return True
+
+    def add(self, app_id):
+        return self.add_hash(hash_app_id(app_id))
+
+    def ids(self):
+        return None
+
+    def snapshot_lines(self):
+        for value in self._table:
+            if value:
+                yield HASH_LINE, '{:x}'.format(value)
+
+    def load_line(self, line_type, value):
+        if line_type == HASH_LINE:
+            self.add_hash(int(value, 16))
+        elif line_type == ID_LINE:
+            self.add(value)
+        else:
+            return False
+        return True
+
+class BloomVisitedSet():
+    kind = BLOOM_DEDUPE
+
+    def __init__(self, capacity=DEDUPE_CAPACITY, error_rate=DEDUPE_ERROR_RATE, **kwargs):
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self._size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self._hash_count = max(1, int(round(self._size / capacity * math.log(2))))
+        self._bits = bytearray((self._size + 7) // 8)
+        self._count = 0
+        self._is_over_capacity = False
+        self._pending_bits = None
+
+    def __len__(self):
+        return self._count
+
+    def _positions(self, value):
+        # double hashing: splitmix64 of the id hash provides the (odd) second hash
+        second = (value + 0x9E3779B97F4A7C15) & MASK_64
+        second = ((second ^ (second >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+        second = ((second ^ (second >> 27)) * 0x94D049BB133111EB) & MASK_64
+        second = (second ^ (second >> 31)) | 1
+        return [(value + idx * second) % self._size for idx in range(self._hash_count)]
+
+    def _contains_hash(self, value):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+    def __contains__(self, app_id):
+        return self._contains_hash(hash_app_id(app_id))
+
+    def add_hash(self, value):
+        is_new = False
+        for position in self._positions(value):
+            byte_idx, bit = position >> 3, 1 << (position & 7)
+            if not self._bits[byte_idx] & bit:
+                self._bits[byte_idx] |= bit
+                is_new = True
+        if is_new:
+            self._count += 1
+            if self._count > self._capacity and not self._is_over_capacity:
+                self._is_over_capacity = True
+                log.warning('### bloom filter exceeded its capacity of {}, false positives will grow ###'.format(
+                    self._capacity
+                ))
+        return is_new
+
+    def add(self, app_id):
+        return self.add_hash(hash_app_id(app_id))
+
+    def ids(self):
+        return None
+
+    def snapshot_lines(self):
+        yield BLOOM_HEADER_LINE, json.dumps(dict(
+            capacity=self._capacity,
+            error_rate=self._error_rate,
+            count=self._count
+        ))
+        for offset in range(0, len(self._bits), BLOOM_CHUNK_SIZE):
+            yield BLOOM_BITS_LINE, base64.b64encode(self._bits[offset:offset + BLOOM_CHUNK_SIZE]).decode('ascii')
+
+    def load_line(self, line_type, value):
+        if line_type == BLOOM_HEADER_LINE:
+            params = json.loads(value)
+            if params.get('capacity') == self._capacity and params.get('error_rate') == self._error_rate:
+                self._pending_bits = bytearray()
+                self._count = params.get('count', 0)
+            else:
+                log.error('@@@ bloom snapshot with capacity: {} and error_rate: {} does not match the filter @@@'.format(
+                    params.get('capacity'),
+                    params.get('error_rate')
+                ))
+        elif line_type == BLOOM_BITS_LINE:
+            if self._pending_bits is not None:
+                self._pending_bits.extend(base64.b64decode(value))
+                if len(self._pending_bits) == len(self._bits):
+                    self._bits = self._pending_bits
+                    self._pending_bits = None
+        elif line_type == HASH_LINE:
+            self.add_hash(int(value, 16))
+        elif line_type == ID_LINE:
+            self.add(value)
+        else:
+            return False
+        return True
+
+VISITED_SETS = {
+    EXACT_DEDUPE: ExactVisitedSet,
+    COMPACT_DEDUPE: CompactVisitedSet,
+    BLOOM_DEDUPE: BloomVisitedSet
+}
+
+def create_visited_set(kind=EXACT_DEDUPE, capacity=DEDUPE_CAPACITY, error_rate=DEDUPE_ERROR_RATE):
+    visited_set = VISITED_SETS.get(kind)
+    if visited_set is None:
+        raise ValueError('INVALID_DEDUPE: {kind}. Must be one of {kinds}'.format(
+            kind=kind,
+            kinds=list(VISITED_SETS.keys())
+        ))
+    return visited_set(capacity=capacity, error_rate=error_rate)
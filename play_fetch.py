@@ -1,37 +1,90 @@
 from aiohttp import (
+    AsyncResolver,
     ClientTimeout,
     ClientSession,
-    ClientResponseError
+    ClientResponseError,
+    TCPConnector
 )
 from play_scraper import (
     utils,
     lists,
     settings
 )
-from urllib.parse import quote_plus
-from bs4 import BeautifulSoup, SoupStrainer
-from pydash import omit as omit_
-import logging as log
+from urllib.parse import quote_plus, urlsplit
+from concurrent.futures import BrokenExecutor
+import asyncio
+import time
+import logging
 
-UNWANTED_KEYS = [
-    'description_html',
-    'screenshots',
-    'video'
-]
+from play_helper import (
+    CONNECTION_LIMIT,
+    CONNECTION_LIMIT_PER_HOST,
+    KEEPALIVE_TIMEOUT,
+    DNS_CACHE_TTL,
+    THROTTLE_STATUSES,
+    DEFAULT_CARD_PARSER,
+    MAX_COLLECTION_START
+)
+from play_limiter import rate_limiter
+from play_cache import response_cache, cache_key, endpoint_for
+from play_metrics import PlayMetrics
+from play_profile import (
+    StageTimer,
+    RATE_LIMIT_STAGE,
+    NETWORK_STAGE,
+    PARSE_STAGE,
+    PRUNE_STAGE,
+    PARSE_POOL_STAGE
+)
+from play_parser import (
+    parse_details,
+    parse_card_list,
+    run_timed
+)
+
+log = logging.getLogger(__name__)
 
 MAX_PAGE_SIZE_FOR_SEARCH = len(settings.PAGE_TOKENS) - 1
 
-def prune_data(data):
-    if isinstance(data, dict):
-        return omit_(data, *UNWANTED_KEYS)
-    elif isinstance(data, list):
-        return list(map(prune_data, data))
-    else:
-        return data
+PERMANENT_ERROR = 'PERMANENT'
+THROTTLED_ERROR = 'THROTTLED'
+SERVER_ERROR = 'SERVER'
+PARSE_ERROR = 'PARSE'
+NETWORK_ERROR = 'NETWORK'
+UNKNOWN_ERROR = 'UNKNOWN'
+
+class PlayFetchError(ValueError):
+    """
+    Base of the errors raised by PlayFetch; `error_class` drives the retry policy.
+    Subclasses ValueError so existing callers keep working.
+    """
+    error_class = UNKNOWN_ERROR
+
+class InvalidRequestError(PlayFetchError):
+    error_class = PERMANENT_ERROR
+
+class ThrottledError(PlayFetchError):
+    error_class = THROTTLED_ERROR
+
+class ServerError(PlayFetchError):
+    error_class = SERVER_ERROR
+
+class ParseError(PlayFetchError):
+    error_class = PARSE_ERROR
+
+def response_error(error, message):
+    if error.status in THROTTLE_STATUSES:
+        return ThrottledError(message)
+    elif error.status >= 500:
+        return ServerError(message)
+    return InvalidRequestError(message)
 
 class PlayFetch():
 
-    def __init__(self, persist=False, headers=utils.default_headers(), timeout=30, hl='en', gl='us'):
+    def __init__(self, persist=False, headers=utils.default_headers(), timeout=30, hl='en', gl='us',
+            connection_limit=CONNECTION_LIMIT, connection_limit_per_host=CONNECTION_LIMIT_PER_HOST,
+            keepalive_timeout=KEEPALIVE_TIMEOUT, dns_cache_ttl=DNS_CACHE_TTL,
+            card_parser=DEFAULT_CARD_PARSER, parse_executor=None):
         log.info('*** inside PlayFetch.__init__ ***')
         self._headers = headers
         self._timeout = ClientTimeout(total=timeout)
@@ -40,10 +93,34 @@ class PlayFetch():
             gl=gl
         )
         self._persist = persist
+        self._card_parser = card_parser
+        self._parse_executor = parse_executor
+        self._connector_args = dict(
+            limit=connection_limit,
+            limit_per_host=connection_limit_per_host,
+            keepalive_timeout=keepalive_timeout,
+            use_dns_cache=True,
+            ttl_dns_cache=dns_cache_ttl
+        )
+        self._session = None
+        self.rate_limit_wait = 0.0
+        self.metrics = PlayMetrics()
+        self.timer = StageTimer()
 
     async def __aenter__(self):
         log.info('*** inside PlayFetch.__aenter__ ***')
+        return await self.open()
+
+    async def open(self):
+        """
+        Creates the underlying session; the resolver must be built on the loop that uses it.
+        """
+        connector = TCPConnector(
+            resolver=AsyncResolver(),
+            **self._connector_args
+        )
         self._session = ClientSession(
+            connector=connector,
             headers=self._headers,
             timeout=self._timeout
         )
@@ -74,85 +151,168 @@ class PlayFetch():
             allow_redirects=allow_redirects
         )
 
-        async with self._session.request(**req_args) as response:
-            response.raise_for_status()
-            return await response.text()
+        endpoint = endpoint_for(url)
+        key = cache_key(method, url, params, req_args['data'])
+        is_cached = response_cache.is_cached(endpoint)
+        cached = await response_cache.run(response_cache.lookup, key, endpoint) if is_cached else None
+        if cached is not None:
+            if cached.is_fresh(response_cache.ttl_for(endpoint)):
+                response_cache.record_hit()
+                self.metrics.record_cached(endpoint)
+                return cached.body
+            req_args['headers'] = cached.conditional_headers()
+
+        host = urlsplit(url).netloc
+        rate_limit_start = self.timer.start()
+        self.rate_limit_wait += await rate_limiter.acquire(host)
+        self.timer.stop(RATE_LIMIT_STAGE, rate_limit_start)
+        # timed after the rate limiter, failed requests included
+        start_time, size = time.perf_counter(), 0
+        try:
+            async with self._session.request(**req_args) as response:
+                rate_limiter.record_response(host, response.status, response.headers.get('Retry-After'))
+                if response.status == 304 and cached is not None:
+                    response_cache.record_hit()
+                    await response_cache.run(response_cache.revalidate, cached)
+                    return cached.body
+                response.raise_for_status()
+                raw_body = await response.read()
+                size = len(raw_body)
+                body = raw_body.decode(response.get_encoding())
+        finally:
+            latency = time.perf_counter() - start_time
+            self.metrics.record_request(endpoint, latency, size)
+            if self.timer.enabled:
+                self.timer.record(NETWORK_STAGE, latency)
+        response_cache.record_miss(endpoint)
+        if is_cached:
+            await response_cache.run(
+                response_cache.store,
+                key,
+                endpoint,
+                body,
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified')
+            )
+        return body
     
     async def details(self, app_id):
         url = utils.build_url('details', app_id)
         try:
             response = await self.send_request('GET', url, params=self._params)
-            soup = BeautifulSoup(response, 'lxml')
         except ClientResponseError as e:
-            raise ValueError('INVALID_APPLICATION_ID: {app}. {error}'.format(
+            raise response_error(e, 'INVALID_APPLICATION_ID: {app}. {error}'.format(
+                app=app_id,
+                error=e
+            ))
+        try:
+            return await self._parse('details', parse_details, response, app_id, url)
+        except BrokenExecutor:
+            raise
+        except Exception as e:
+            raise ParseError('UNPARSEABLE_DETAILS: {app}. {error!r}'.format(
                 app=app_id,
                 error=e
             ))
-        app_json = utils.parse_app_details(soup)
-        app_json.update({
-            'app_id': app_id,
-            'url': url
-        })
-        return prune_data(app_json)
-
-    async def collection(self, coln_id, catg_id=None, results=None, page=None):
+
+    async def _parse(self, endpoint, parse_function, *args):
+        if self.timer.enabled:
+            return await self._timed_parse(endpoint, parse_function, *args)
+        start_time = time.perf_counter()
+        try:
+            if self._parse_executor is None:
+                return parse_function(*args)
+            return await asyncio.get_event_loop().run_in_executor(
+                self._parse_executor,
+                parse_function,
+                *args
+            )
+        finally:
+            self.metrics.record_parse(endpoint, time.perf_counter() - start_time)
+
+    async def _timed_parse(self, endpoint, parse_function, *args):
+        """
+        Same as `_parse`, timing parsing and pruning apart, along with the round trip to the parse pool.
+        """
+        start_time = time.perf_counter()
+        try:
+            if self._parse_executor is None:
+                data, parse_time, prune_time = run_timed(parse_function, *args)
+            else:
+                data, parse_time, prune_time = await asyncio.get_event_loop().run_in_executor(
+                    self._parse_executor,
+                    run_timed,
+                    parse_function,
+                    *args
+                )
+        finally:
+            elapsed = time.perf_counter() - start_time
+            self.metrics.record_parse(endpoint, elapsed)
+        self.timer.record(PARSE_STAGE, parse_time)
+        self.timer.record(PRUNE_STAGE, prune_time)
+        if self._parse_executor is not None:
+            self.timer.record(PARSE_POOL_STAGE, elapsed - parse_time - prune_time)
+        return data
+
+    async def _parse_cards(self, response, source, endpoint, parser=None):
+        try:
+            return await self._parse(endpoint, parse_card_list, response, parser or self._card_parser)
+        except BrokenExecutor:
+            raise
+        except Exception as e:
+            raise ParseError('UNPARSEABLE_CARDS: {source}. {error!r}'.format(
+                source=source,
+                error=e
+            ))
+
+    async def collection(self, coln_id, catg_id=None, results=None, page=None, parser=None):
         coln_name = coln_id if coln_id.startswith('promotion') else lists.COLLECTIONS.get(coln_id)
         if coln_name is None:
-            raise ValueError('INVALID_COLLECTION_ID: {coln}'.format(
+            raise InvalidRequestError('INVALID_COLLECTION_ID: {coln}'.format(
                 coln=coln_id
             ))
 
         catg_name = '' if catg_id is None else lists.CATEGORIES.get(catg_id)
         if catg_name is None:
-            raise ValueError('INVALID_CATEGORY_ID: {catg}'.format(
+            raise InvalidRequestError('INVALID_CATEGORY_ID: {catg}'.format(
                 catg=catg_id
             ))
         results = settings.NUM_RESULTS if results is None else results
         if results > 120:
-            raise ValueError('Number of results cannot be more than 120.')
+            raise InvalidRequestError('Number of results cannot be more than 120.')
 
         page = 0 if page is None else page
-        if page * results > 500:
-            raise ValueError('Start (page * results) cannot be greater than 500.')
+        if page * results > MAX_COLLECTION_START:
+            raise InvalidRequestError('Start (page * results) cannot be greater than {}.'.format(MAX_COLLECTION_START))
 
         url = utils.build_collection_url(catg_name, coln_name)
         data = utils.generate_post_data(results, page)
         try:
             response = await self.send_request('POST', url, data, params=self._params)
-            soup = BeautifulSoup(response, 'lxml')
         except ClientResponseError as e:
-            raise ValueError('INVALID_COLLECTION_OR_CATEGORY_ID: {coln}; {catg} {error}'.format(
+            raise response_error(e, 'INVALID_COLLECTION_OR_CATEGORY_ID: {coln}; {catg} {error}'.format(
                 coln=coln_id,
                 catg=catg_id,
                 error=e
             ))
-        apps = list(map(
-            utils.parse_card_info, 
-            soup.select('div[data-uitype="500"]')
-        ))
         # TODO: soup parsing failing for certain scenarios
         # $ref: Exception #1 @ observed_error.log
-        return prune_data(apps)
+        return await self._parse_cards(response, '{}/{}/{}'.format(coln_id, catg_id, page), 'collection', parser=parser)
 
-    async def similar(self, app_id):
+    async def similar(self, app_id, parser=None):
         url = utils.build_url('similar', app_id)
         try:
             response = await self.send_request('GET', url, params=self._params, allow_redirects=True)
-            soup = BeautifulSoup(response, 'lxml')
         except ClientResponseError as e:
-            raise ValueError('INVALID_APPLICATION_ID: {app}. {error}'.format(
+            raise response_error(e, 'INVALID_APPLICATION_ID: {app}. {error}'.format(
                 app=app_id,
                 error=e
             ))
-        apps = list(map(
-            utils.parse_card_info, 
-            soup.select('div[data-uitype="500"]')
-        ))
-        return prune_data(apps)
+        return await self._parse_cards(response, app_id, 'similar', parser=parser)
 
-    async def search(self, token, results=None, page=0):
+    async def search(self, token, results=None, page=0, parser=None):
         if page > MAX_PAGE_SIZE_FOR_SEARCH:
-            raise ValueError('Page value [{page}] must be between 0 and {page_limit}'.format(
+            raise InvalidRequestError('Page value [{page}] must be between 0 and {page_limit}'.format(
                 page=page,
                 page_limit=MAX_PAGE_SIZE_FOR_SEARCH
             ))
@@ -165,14 +325,9 @@ class PlayFetch():
         data = utils.generate_post_data(0, 0, pagtok=settings.PAGE_TOKENS[page])
         try:
             response = await self.send_request('POST', url, data, params=params)
-            soup = BeautifulSoup(response, 'lxml')
         except ClientResponseError as e:
-            raise ValueError('INVALID_TOKEN: {app}. {error}'.format(
+            raise response_error(e, 'INVALID_TOKEN: {token}. {error}'.format(
                 token=token,
                 error=e
             ))
-        apps = list(map(
-            utils.parse_card_info, 
-            soup.select('div[data-uitype="500"]')
-        ))
-        return prune_data(apps)
\ No newline at end of file
+        return await self._parse_cards(response, token, 'search', parser=parser)
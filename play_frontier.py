@@ -0,0 +1,249 @@
+"""
+Contains the crawl frontier used by the managers for scheduling pending fetches.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import tempfile
+from collections import deque
+
+from play_helper import (
+    MAX_FRONTIER_SIZE,
+    DEPTH_DISCOUNT
+)
+
+log = logging.getLogger(__name__)
+
+COLLECTION_ENTRY = 'COLLECTION'
+SIMILAR_ENTRY = 'SIMILAR'
+DETAILS_ENTRY = 'DETAILS'
+
+FIFO_FRONTIER = 'fifo'
+PRIORITY_FRONTIER = 'priority'
+
+def similar_entry(app_id, depth=0, parent_yield=1.0):
+    return (SIMILAR_ENTRY, app_id, depth, parent_yield)
+
+def entry_priority(entry):
+    """
+    Lower comes first: seeds and details before any similar entry, then similar
+    entries by the yield of their parent discounted by their depth.
+    Similar entries of older snapshots (without depth and yield) count as seed apps.
+    """
+    if entry[0] != SIMILAR_ENTRY:
+        return (0, entry[-1] if entry[0] == COLLECTION_ENTRY else 0)
+    depth, parent_yield = entry[2:4] if len(entry) >= 4 else (0, 1.0)
+    return (1, -parent_yield * DEPTH_DISCOUNT ** depth)
+
+class PlayFrontier():
+    """
+    FIFO of pending crawl entries consumed by a fixed number of workers.
+
+    Entries are plain tuples such as `('SIMILAR', app_id, depth, parent_yield)` or
+    `('COLLECTION', coln, catg, page)`, which keeps a pending fetch down to
+    a few dozen bytes instead of a scheduled coroutine.
+
+    `put` applies backpressure once `max_size` entries are pending, whereas
+    `put_nowait` always enqueues; workers use the latter since a worker
+    blocked on its own queue can never drain it. Only `max_size` entries are
+    kept in memory though: the ones queued beyond are spilled to a temporary
+    file as json lines and read back in order as the workers drain the frontier,
+    so discovery never holds more than `max_size` pending entries in memory.
+    """
+    def __init__(self, max_size=MAX_FRONTIER_SIZE):
+        self._entries = deque()
+        self._active = dict()
+        self._max_size = max_size
+        self._unfinished = 0
+        self._spill_file = None
+        self._spill_offset = 0
+        self._spilled = 0
+        self._closed = False
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._drained = asyncio.Event()
+        self._drained.set()
+
+    def __len__(self):
+        return len(self._entries) + self._spilled
+
+    @property
+    def in_progress(self):
+        return self._unfinished - len(self)
+
+    @property
+    def spilled(self):
+        return self._spilled
+
+    def _push(self, entry):
+        self._entries.append(entry)
+
+    def _pop(self):
+        return self._entries.popleft()
+
+    def _pending(self):
+        return list(self._entries)
+
+    def is_closed(self):
+        return self._closed
+
+    def _spill(self, entry):
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile(mode='w+b', prefix='play_frontier_', suffix='.jsonl')
+            log.info('*** frontier full with [%s] entries, spilling to disk ***', len(self._entries))
+        self._spill_file.seek(0, 2)
+        self._spill_file.write('{}\n'.format(json.dumps(entry)).encode('utf-8'))
+        self._spilled += 1
+
+    def _read_spilled(self, count):
+        self._spill_file.seek(self._spill_offset)
+        entries = []
+        for _ in range(count):
+            line = self._spill_file.readline()
+            if not line:
+                break
+            entries.append(tuple(json.loads(line)))
+        return entries, self._spill_file.tell()
+
+    def _refill(self):
+        entries, self._spill_offset = self._read_spilled(min(self._spilled, self._max_size - len(self._entries)))
+        for entry in entries:
+            self._push(entry)
+        self._spilled -= len(entries)
+        if not self._spilled:
+            # a new file rather than a truncated one, as snapshot readers may still be reading this one
+            self._drop_spilled()
+
+    def _drop_spilled(self):
+        if self._spill_file is not None:
+            self._spill_file.close()
+        self._spill_file = None
+        self._spill_offset = 0
+        self._spilled = 0
+
+    def _append(self, entry):
+        # once spilling, later entries queue up behind the spilled ones
+        if self._spilled or len(self._entries) >= self._max_size:
+            self._spill(entry)
+        else:
+            self._push(entry)
+        self._unfinished += 1
+        self._drained.clear()
+        self._not_empty.set()
+        if len(self) >= self._max_size:
+            self._not_full.clear()
+
+    def put_nowait(self, entry):
+        if not self._closed:
+            self._append(entry)
+
+    async def put(self, entry):
+        while not self._closed and len(self) >= self._max_size:
+            log.debug('*** frontier full with [%s] entries, awaiting capacity ***', len(self._entries))
+            await self._not_full.wait()
+        self.put_nowait(entry)
+
+    async def get(self):
+        while not self._entries:
+            if self._closed:
+                return None
+            if self._spilled:
+                self._refill()
+                continue
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        entry = self._pop()
+        self._active[entry] = self._active.get(entry, 0) + 1
+        # refilled by half the capacity at a time, instead of an entry at a time
+        if self._spilled and len(self._entries) < self._max_size // 2:
+            self._refill()
+        if len(self) < self._max_size:
+            self._not_full.set()
+        return entry
+
+    def task_done(self, entry=None):
+        active_count = self._active.pop(entry, 0) - 1
+        if active_count > 0:
+            self._active[entry] = active_count
+        self._unfinished -= 1
+        if self._unfinished <= 0:
+            self._unfinished = 0
+            self._drained.set()
+
+    async def join(self):
+        await self._drained.wait()
+
+    def snapshot_reader(self):
+        """
+        Returns a function reading the entries `snapshot` returns now, which can run on any thread:
+        the entries in memory are copied right away, the spilled ones are read later through a
+        descriptor of its own over the bytes spilled so far, which are never rewritten.
+        """
+        entries = list(self._active.keys()) + self._pending()
+        if not self._spilled:
+            return lambda: entries
+        start, end = self._spill_offset, self._spill_file.seek(0, 2)
+        spill_fd = os.dup(self._spill_file.fileno())
+
+        def read():
+            try:
+                spilled_lines = os.pread(spill_fd, end - start, start).splitlines()
+            finally:
+                os.close(spill_fd)
+            return entries + [tuple(json.loads(line)) for line in spilled_lines if line]
+        return read
+
+    def snapshot(self):
+        """
+        Entries still pending, including the ones being worked on, as resuming must redo those.
+        """
+        return self.snapshot_reader()()
+
+    def clear(self):
+        self._entries.clear()
+        self._active.clear()
+        self._drop_spilled()
+
+    def close(self):
+        self._closed = True
+        self._not_empty.set()
+        self._not_full.set()
+        self._drained.set()
+
+class PriorityFrontier(PlayFrontier):
+    """
+    Same as the PlayFrontier, except that workers get the entry with the best `entry_priority` first.
+    Spilled entries only compete on priority once read back into memory.
+    """
+    def __init__(self, max_size=MAX_FRONTIER_SIZE):
+        super().__init__(max_size=max_size)
+        self._entries = []
+        self._order = itertools.count()
+
+    def _push(self, entry):
+        # the counter keeps entries of equal priority in insertion order and never compares entries
+        heapq.heappush(self._entries, (entry_priority(entry), next(self._order), entry))
+
+    def _pop(self):
+        return heapq.heappop(self._entries)[-1]
+
+    def _pending(self):
+        return [entry for _, _, entry in sorted(self._entries)]
+
+FRONTIERS = {
+    FIFO_FRONTIER: PlayFrontier,
+    PRIORITY_FRONTIER: PriorityFrontier
+}
+
+def create_frontier(kind=FIFO_FRONTIER, max_size=MAX_FRONTIER_SIZE):
+    frontier = FRONTIERS.get(kind)
+    if frontier is None:
+        raise ValueError('INVALID_FRONTIER: {kind}. Must be one of {kinds}'.format(
+            kind=kind,
+            kinds=list(FRONTIERS.keys())
+        ))
+    return frontier(max_size=max_size)
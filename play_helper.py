@@ -1,10 +1,17 @@
 """
 Contains contants and helper methods for the server and client operations.
 """
+import os
 
 def parseInt(num, default=0):
     return default if not num or not num.isdigit() else int(num)
 
+def parseFloat(num, default=0.0):
+    try:
+        return default if not num else float(num)
+    except ValueError:
+        return default
+
 def isTrue(value):
     return (isinstance(value, bool) and value) or (isinstance(value, str) and value.lower() == 'true')
 
@@ -13,14 +20,80 @@ def colored_print(info):
 
 MAX_LOG_FILE_SIZE = 25 * 1024 * 1024
 LOG_BACKUP_COUNT = 50
+LOG_FORMAT = '%(asctime)s,%(msecs)d %(levelname)-5s [%(threadName)s | %(filename)s:%(lineno)d] %(message)s'
+LOG_DATE_FORMAT = '%Y-%m-%d:%H:%M:%S'
+DEFAULT_LOG_LEVEL = 'DEBUG'
+LOG_QUEUE_ENABLED = True
+STATUS_REPORT_INTERVAL = 5
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PARSE_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+STAGE_TIMING_ENABLED = False
+PROFILE_SAMPLE_INTERVAL = 0.005
+MAX_PROFILE_SECONDS = 120
+MAX_SHARD_COUNT = 64
 MAX_GAME_INFO_PER_OPT_FILE = 25000
 MAX_RECORD_SIZE_PER_PAGE = 120
+MAX_COLLECTION_START = 500
 NO_RECORD_FOUND = object()
 EXECUTOR_THREAD_PREFIX = 'scraper'
 EXECUTOR_POOL_SIZE = 10
-OPT_FILE_REGEX = r'.*\.json(\.\d+)?$'
+DEFAULT_WORKER_COUNT = 32
+MAX_WORKER_COUNT = 256
+MAX_FRONTIER_SIZE = 10000
+DEPTH_DISCOUNT = 0.5
+YIELD_WINDOW = 1000
+TASK_TERMINATION_TIMEOUT = 10
+DEDUPE_CAPACITY = 10000000
+DEDUPE_ERROR_RATE = 0.001
+OPT_FILE_REGEX = r'.*\.json(l|\.\d+)?$'
+SQLITE_STORE_FILENAME = 'play_store.sqlite3'
+SQLITE_FLUSH_THRESHOLD = 500
+CACHE_ENABLED = False
+CACHE_DIR = 'cache'
+CACHE_MAX_SIZE = 1 << 30
+CACHE_TTLS = dict(
+    details=24 * 60 * 60,
+    similar=6 * 60 * 60,
+    collection=60 * 60,
+    search=60 * 60
+)
+CONNECTION_LIMIT = 100
+CONNECTION_LIMIT_PER_HOST = 30
+KEEPALIVE_TIMEOUT = 30
+DNS_CACHE_TTL = 300
+RATE_LIMIT_PER_SECOND = 10.0
+RATE_LIMIT_BURST = 20
+MIN_RATE_LIMIT_PER_SECOND = 0.5
+THROTTLE_STATUSES = (429, 503)
+THROTTLE_BACKOFF_FACTOR = 0.5
+THROTTLE_RECOVERY_STEP = 0.05
+THROTTLE_COOLDOWN = 5.0
+MAX_RETRY_AFTER = 300.0
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30.0
+RETRY_BUDGETS = dict(
+    NETWORK=4,
+    THROTTLED=5,
+    SERVER=3,
+    PARSE=1,
+    UNKNOWN=2,
+    PERMANENT=0
+)
+CIRCUIT_FAILURE_THRESHOLD = 20
+CIRCUIT_RESET_TIMEOUT = 30.0
+DEFAULT_CARD_PARSER = 'lxml'
+PARSE_POOL_SIZE = os.cpu_count() or 1
+LOAD_POOL_SIZE = PARSE_POOL_SIZE
 SERVER_HOST = 'localhost'
 SERVER_PORT = 8384
+SERVER_CONNECTION_LIMIT = 200
+SERVER_CONNECTION_LIMIT_PER_HOST = 50
+DETAIL_BATCH_CONCURRENCY = 16
+MAX_DETAIL_BATCH_CONCURRENCY = SERVER_CONNECTION_LIMIT_PER_HOST
+MAX_DETAIL_BATCH_SIZE = 50000
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+RECORD_PAGE_SIZE = 10000
+MAX_RECORD_PAGE_SIZE = 100000
 
 COLLECTIONS = [
     'NEW_FREE',
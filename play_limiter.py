@@ -0,0 +1,172 @@
+"""
+Contains the process wide rate limiter shared by every PlayFetch instance.
+"""
+import asyncio
+import threading
+import time
+import logging
+from email.utils import parsedate_to_datetime
+
+from play_helper import (
+    RATE_LIMIT_PER_SECOND,
+    RATE_LIMIT_BURST,
+    MIN_RATE_LIMIT_PER_SECOND,
+    THROTTLE_STATUSES,
+    THROTTLE_BACKOFF_FACTOR,
+    THROTTLE_RECOVERY_STEP,
+    THROTTLE_COOLDOWN,
+    MAX_RETRY_AFTER
+)
+
+log = logging.getLogger(__name__)
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        delay = int(value)
+    else:
+        try:
+            delay = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            log.warning('### unparseable Retry-After header: {} ###'.format(value))
+            return None
+    return min(max(delay, 0), MAX_RETRY_AFTER)
+
+class TokenBucket():
+    """
+    Token bucket that hands out reservations instead of blocking.
+
+    Tokens are accounted as of `self._last`, which is pushed into the future
+    while throttled, so reservations made during a cooldown are spaced at the
+    current rate starting from the end of the cooldown rather than released
+    as one burst. The rate is halved on throttling responses (at most once
+    per cooldown) and recovers additively on successful ones.
+    """
+    def __init__(self, rate=RATE_LIMIT_PER_SECOND, burst=RATE_LIMIT_BURST):
+        self._lock = threading.Lock()
+        self._target_rate = rate
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._last_throttled = None
+        self.requests = 0
+        self.delayed_requests = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.throttled_responses = 0
+
+    def configure(self, rate=None, burst=None):
+        with self._lock:
+            if rate:
+                self._target_rate = rate
+                self._rate = min(self._rate, rate) if self._last_throttled else rate
+            if burst:
+                self._burst = burst
+                self._tokens = min(self._tokens, burst)
+
+    def _refill(self, now):
+        if now > self._last:
+            self._tokens = min(self._burst, self._tokens + (now - self._last) * self._rate)
+            self._last = now
+
+    def reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            wait = (self._last - now) + max(0, -self._tokens) / self._rate
+            self.requests += 1
+            if wait > 0:
+                self.delayed_requests += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            return wait
+
+    def throttle(self, retry_after=None):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.throttled_responses += 1
+            cooldown = THROTTLE_COOLDOWN if retry_after is None else retry_after
+            if self._last_throttled is None or now - self._last_throttled >= THROTTLE_COOLDOWN:
+                self._rate = max(MIN_RATE_LIMIT_PER_SECOND, self._rate * THROTTLE_BACKOFF_FACTOR)
+                self._last_throttled = now
+            if now + cooldown > self._last:
+                self._tokens = min(self._tokens, 0)
+                self._last = now + cooldown
+            return self._rate
+
+    def recover(self):
+        if self._rate >= self._target_rate:
+            return
+        with self._lock:
+            self._rate = min(self._target_rate, self._rate + THROTTLE_RECOVERY_STEP)
+            if self._rate >= self._target_rate:
+                self._last_throttled = None
+
+    def stats(self):
+        return dict(
+            rate=self._rate,
+            target_rate=self._target_rate,
+            burst=self._burst,
+            requests=self.requests,
+            delayed_requests=self.delayed_requests,
+            total_wait=self.total_wait,
+            max_wait=self.max_wait,
+            throttled_responses=self.throttled_responses
+        )
+
+class PlayRateLimiter():
+    """
+    Keeps one TokenBucket per host; safe to share between the manager threads.
+    """
+    def __init__(self, rate=RATE_LIMIT_PER_SECOND, burst=RATE_LIMIT_BURST):
+        self._lock = threading.Lock()
+        self._rate = rate
+        self._burst = burst
+        self._buckets = dict()
+
+    def _bucket(self, host):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.setdefault(host, TokenBucket(self._rate, self._burst))
+        return bucket
+
+    def configure(self, rate=None, burst=None):
+        with self._lock:
+            self._rate = rate or self._rate
+            self._burst = burst or self._burst
+            buckets = list(self._buckets.values())
+        for bucket in buckets:
+            bucket.configure(rate=rate, burst=burst)
+
+    async def acquire(self, host):
+        wait = self._bucket(host).reserve()
+        if wait > 0:
+            log.debug('*** rate limiter delaying request to %s by %.3fs ***', host, wait)
+            await asyncio.sleep(wait)
+        return wait
+
+    def record_response(self, host, status, retry_after=None):
+        bucket = self._bucket(host)
+        if status in THROTTLE_STATUSES:
+            delay = parse_retry_after(retry_after)
+            rate = bucket.throttle(delay)
+            log.warning('### throttled by {} with status: {}; retry_after: {}; rate lowered to: {:.2f}/s ###'.format(
+                host, status, delay, rate
+            ))
+        else:
+            bucket.recover()
+
+    def stats(self):
+        return dict(
+            rate=self._rate,
+            burst=self._burst,
+            hosts={host: bucket.stats() for host, bucket in list(self._buckets.items())}
+        )
+
+rate_limiter = PlayRateLimiter()
@@ -0,0 +1,82 @@
+"""
+Contains the paging of the record listings of `/peek`, `/stop` and `/flush`.
+
+App ids are paged out of the ids a manager lists once its records are dumped, full
+records straight out of the files it wrote them to (numbered json opt files, jsonl
+checkpoint or sqlite store) with the resumable readers used for loading, so a page
+never holds more than `limit` records in memory. The position of the next page is
+handed to clients as an opaque cursor: urlsafe base64 of its json.
+"""
+import base64
+import json
+import os
+
+from play_checkpoint import CHECKPOINT_EXTENSION
+from play_helper import SQLITE_STORE_FILENAME
+from play_loader import read_record_batch
+from play_store import read_store_batch
+
+def encode_cursor(position):
+    if position is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(position, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """
+    Position encoded in `cursor` (None without one), raises ValueError for anything `encode_cursor` did not return.
+    """
+    if not cursor:
+        return None
+    return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+
+def _is_store(file_path):
+    return os.path.basename(file_path) == SQLITE_STORE_FILENAME
+
+def output_files(output_path):
+    """
+    Files holding the records written so far to the checkpoint, store or opt files at `output_path`.
+    """
+    if not output_path:
+        return []
+    if output_path.endswith(CHECKPOINT_EXTENSION) or _is_store(output_path):
+        return [output_path] if os.path.exists(output_path) else []
+    files = []
+    while os.path.exists('{}.{}'.format(output_path, len(files))):
+        files.append('{}.{}'.format(output_path, len(files)))
+    return files
+
+def page_ids(id_lists, position, limit):
+    """
+    `(ids, position)` of the `limit` ids after `position` over `id_lists` one after the other,
+    the position being None once they are exhausted.
+    """
+    offset = position or 0
+    if not isinstance(offset, int) or offset < 0:
+        raise ValueError('INVALID_POSITION: {}'.format(position))
+    total = 0
+    ids = []
+    for id_list in id_lists:
+        start = max(offset - total, 0)
+        total += len(id_list)
+        if len(ids) < limit and start < len(id_list):
+            ids.extend(id_list[start:start + limit - len(ids)])
+    end = offset + len(ids)
+    return ids, (end if end < total else None)
+
+def page_records(file_paths, position, limit):
+    """
+    `(records, position)` of the `limit` records after `position` over `file_paths` one after
+    the other, the position (file index and cursor within the file) being None once they are exhausted.
+    """
+    file_idx, cursor = position or (0, None)
+    if not isinstance(file_idx, int) or file_idx < 0:
+        raise ValueError('INVALID_POSITION: {}'.format(position))
+    records = []
+    while file_idx < len(file_paths) and len(records) < limit:
+        file_path = file_paths[file_idx]
+        read_batch = read_store_batch if _is_store(file_path) else read_record_batch
+        batch, cursor = read_batch(file_path, cursor, limit - len(records))
+        records.extend(batch)
+        if cursor is None:
+            file_idx += 1
+    return records, ([file_idx, cursor] if file_idx < len(file_paths) else None)
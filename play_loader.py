@@ -0,0 +1,123 @@
+"""
+Contains the streaming reader used for loading previous results in batches.
+
+`read_record_batch` is picklable and resumable: it returns the records of one batch
+along with a cursor to pass back for the next one, so that the shards can be read
+a batch at a time in the parse pool without ever holding a whole shard in memory.
+"""
+import codecs
+import json
+import logging
+
+from play_checkpoint import CHECKPOINT_EXTENSION
+
+log = logging.getLogger(__name__)
+
+LOAD_BATCH_SIZE = 1000
+LOAD_CHUNK_SIZE = 1 << 20
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\r\n'
+
+class _ChunkedText():
+    """
+    Text window over a binary file which keeps count of the bytes consumed,
+    as the json offsets are in characters while the file can only be seeked in bytes.
+    """
+    def __init__(self, file, offset):
+        self._file = file
+        self._file.seek(offset)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self.offset = offset
+        self.text = ''
+        self.pos = 0
+        self.is_eof = False
+
+    def read_more(self):
+        if self.is_eof:
+            return False
+        chunk = self._file.read(LOAD_CHUNK_SIZE)
+        self.is_eof = not chunk
+        self.text = self.text[self.pos:] + self._decoder.decode(chunk, final=self.is_eof)
+        self.pos = 0
+        return not self.is_eof or bool(self.text)
+
+    def consume(self, end):
+        self.offset += len(self.text[self.pos:end].encode('utf-8'))
+        self.pos = end
+
+    def skip(self, chars):
+        while True:
+            end = self.pos
+            while end < len(self.text) and self.text[end] in chars:
+                end += 1
+            self.consume(end)
+            if self.pos < len(self.text) or not self.read_more():
+                return self.peek()
+
+    def peek(self):
+        return self.text[self.pos] if self.pos < len(self.text) else None
+
+    def decode(self):
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except ValueError:
+                # most likely the value spans past the window, anything else fails at eof
+                if self.is_eof or not self.read_more():
+                    raise
+            else:
+                self.consume(end)
+                return value
+
+def _read_json_batch(file, cursor, batch_size):
+    offset, container = cursor if cursor else (0, None)
+    text = _ChunkedText(file, offset)
+    if container is None:
+        container = text.skip(_WHITESPACE)
+        if container not in ('[', '{'):
+            raise ValueError('UNKNOWN_FILE_FORMAT: {}'.format(container))
+        text.consume(text.pos + 1)
+
+    records = []
+    while len(records) < batch_size:
+        char = text.skip(_WHITESPACE + ',')
+        if char is None:
+            raise ValueError('UNEXPECTED_END_OF_FILE')
+        elif char in (']', '}'):
+            return records, None
+        if container == '{':
+            text.decode()
+            if text.skip(_WHITESPACE) != ':':
+                raise ValueError('MISSING_KEY_SEPARATOR at: {}'.format(text.offset))
+            text.consume(text.pos + 1)
+            text.skip(_WHITESPACE)
+        records.append(text.decode())
+    return records, (text.offset, container)
+
+def _read_jsonl_batch(file, cursor, batch_size):
+    file.seek(cursor or 0)
+    records = []
+    while len(records) < batch_size:
+        cursor = file.tell()
+        line = file.readline()
+        if not line:
+            return records, None
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            records.append(json.loads(line.decode('utf-8')))
+        except ValueError:
+            # see JsonlCheckpointWriter
+            log.warning('### skipping corrupt line at: {} in checkpoint: {} ###'.format(cursor, file.name))
+    return records, file.tell()
+
+def read_record_batch(file_path, cursor=None, batch_size=LOAD_BATCH_SIZE):
+    """
+    Returns `(records, cursor)` for the next batch of `file_path`, cursor is None once the file is exhausted.
+    Json files can either hold a list of records or a dict of app_id to record.
+    """
+    read_batch = _read_jsonl_batch if file_path.endswith(CHECKPOINT_EXTENSION) else _read_json_batch
+    with open(file_path, 'rb') as file:
+        return read_batch(file, cursor, batch_size)
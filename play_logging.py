@@ -0,0 +1,135 @@
+"""
+Contains the logging setup shared by the server and the worker processes.
+
+Every module logs through a logger of its own (named after the module), whose
+level can be changed at runtime (see `/logging`) without touching the others.
+In the queued mode the loggers only put their records on an in-memory queue,
+which a listener thread formats and writes to the rotating log file, so no file
+I/O happens on the threads running the managers' loops. The log calls on the
+hot path pass their arguments instead of a formatted message, so a record
+dropped by its logger's level is never formatted. The processes of the parse
+pool send their records back over a queue of their own, written to the log file
+of the process which started them.
+"""
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from play_helper import (
+    MAX_LOG_FILE_SIZE,
+    LOG_BACKUP_COUNT,
+    LOG_FORMAT,
+    LOG_DATE_FORMAT,
+    DEFAULT_LOG_LEVEL,
+    LOG_QUEUE_ENABLED
+)
+
+ROOT_LOGGER = 'root'
+MODULE_LOGGER_PREFIX = 'play_'
+LOG_LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+# resets a logger to the level it inherits, the root logger to DEFAULT_LOG_LEVEL
+RESET_LOG_LEVEL = 'DEFAULT'
+
+_listener = None
+_file_handler = None
+_child_queue = None
+_child_listener = None
+
+class LocalQueueHandler(QueueHandler):
+    """
+    QueueHandler for a queue which never leaves this process: the message is merged with its
+    arguments on the logging thread (they may change afterwards), everything else, the exception
+    text included, is left to the listener thread.
+    """
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+def setup_logging(log_file_path, queued=LOG_QUEUE_ENABLED, level=DEFAULT_LOG_LEVEL, levels=None):
+    global _listener, _file_handler
+    _file_handler = file_handler = RotatingFileHandler(
+        log_file_path,
+        maxBytes=MAX_LOG_FILE_SIZE,
+        backupCount=LOG_BACKUP_COUNT
+    )
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
+    root_logger = logging.getLogger()
+    root_logger.setLevel(level)
+    if queued:
+        log_queue = queue.SimpleQueue()
+        _listener = QueueListener(log_queue, file_handler)
+        _listener.start()
+        root_logger.addHandler(LocalQueueHandler(log_queue))
+        atexit.register(stop_logging)
+    else:
+        root_logger.addHandler(file_handler)
+    if levels:
+        configure_log_levels(levels)
+
+def stop_logging():
+    """
+    Writes the records still queued, worker processes must call it as they exit without running atexit.
+    """
+    global _listener, _child_queue, _child_listener
+    if _child_listener is not None:
+        _child_listener.stop()
+        _child_listener = None
+        _child_queue = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def child_log_queue(context):
+    """
+    Queue of `context` for the records of the child processes (see `setup_child_logging`), which a
+    listener thread writes to the log file of this process; None unless `setup_logging` ran.
+    """
+    global _child_queue, _child_listener
+    if _file_handler is None:
+        return None
+    if _child_queue is None:
+        _child_queue = context.Queue()
+        _child_listener = QueueListener(_child_queue, _file_handler)
+        _child_listener.start()
+    return _child_queue
+
+def setup_child_logging(log_queue, levels):
+    """
+    Initializer of the child processes, which neither run a listener nor may write to the rotating log file.
+    """
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    if log_queue is not None:
+        root_logger.addHandler(QueueHandler(log_queue))
+    configure_log_levels(levels)
+
+def log_settings():
+    return dict(queued=_listener is not None, levels=log_levels())
+
+def log_levels():
+    """
+    Level of the root logger and of every module's logger (None when inheriting the root's),
+    and of any other logger given a level of its own.
+    """
+    levels = {ROOT_LOGGER: logging.getLevelName(logging.getLogger().level)}
+    for name, logger in sorted(logging.Logger.manager.loggerDict.items()):
+        if not isinstance(logger, logging.Logger):
+            continue
+        if name.startswith(MODULE_LOGGER_PREFIX) or logger.level != logging.NOTSET:
+            levels[name] = logging.getLevelName(logger.level) if logger.level != logging.NOTSET else None
+    return levels
+
+def configure_log_levels(levels):
+    """
+    `levels` maps logger names (ROOT_LOGGER for the root logger) to level names, None resetting a
+    logger to inherit the root's level.
+    """
+    for name, level in levels.items():
+        if name == ROOT_LOGGER:
+            logging.getLogger().setLevel(level or DEFAULT_LOG_LEVEL)
+        else:
+            logging.getLogger(name).setLevel(level or logging.NOTSET)
+    return log_levels()
@@ -1,24 +1,92 @@
 import asyncio
 import functools
 import time
-import logging as log
+import logging
 import json
 import concurrent
 import threading
 import os
 import re
+from collections import deque
+from itertools import islice
 
 from play_fetch import PlayFetch as pf
+from play_parser import get_parse_pool, spawn_pool
+from play_record import RecordStore
+from play_shard import ShardRouter
+from play_profile import (
+    sample_thread,
+    DEDUPE_STAGE,
+    FLUSH_STAGE,
+    DUMP_STAGE,
+    SNAPSHOT_STAGE
+)
+from play_loader import read_record_batch
+from play_store import (
+    SqliteStoreWriter,
+    store_path_for,
+    read_store_batch,
+    import_file,
+    JSON_STORE,
+    SQLITE_STORE
+)
+from play_snapshot import (
+    snapshot_path_for,
+    write_snapshot,
+    iter_snapshot,
+    FRONTIER_LINE
+)
+from play_dedupe import (
+    create_visited_set,
+    EXACT_DEDUPE
+)
+from play_checkpoint import (
+    JsonlCheckpointWriter,
+    checkpoint_path_for
+)
+from play_listing import output_files, page_ids, page_records
+from play_retry import (
+    RetryPolicy,
+    CircuitBreaker,
+    classify_error
+)
+from play_frontier import (
+    create_frontier,
+    similar_entry,
+    FIFO_FRONTIER,
+    COLLECTION_ENTRY,
+    SIMILAR_ENTRY,
+    DETAILS_ENTRY
+)
 
 from play_helper import(
     COLLECTIONS,
     CATEGORIES,
     NO_RECORD_FOUND,
     MAX_RECORD_SIZE_PER_PAGE,
+    MAX_COLLECTION_START,
     MAX_GAME_INFO_PER_OPT_FILE,
-    OPT_FILE_REGEX
+    OPT_FILE_REGEX,
+    DEFAULT_WORKER_COUNT,
+    MAX_FRONTIER_SIZE,
+    YIELD_WINDOW,
+    DEFAULT_CARD_PARSER,
+    TASK_TERMINATION_TIMEOUT,
+    DEDUPE_CAPACITY,
+    DEDUPE_ERROR_RATE,
+    SQLITE_FLUSH_THRESHOLD,
+    RECORD_PAGE_SIZE,
+    LOAD_POOL_SIZE
 )
 
+log = logging.getLogger(__name__)
+
+FETCHED_AT_KEY = 'fetched_at'
+DETAILED_OPT_FILE_SUFFIX = '_detailed'
+
+def is_detailed(app_info):
+    return bool(app_info.get('developer_email') or app_info.get(FETCHED_AT_KEY))
+
 CANCELLED_STATUSES = [
     'SHUTDOWN_INITIATED', 'TERMINATED', 'CORRUPTED'
 ]
@@ -52,19 +120,45 @@ def delegate_manager(context):
 
 class InitiatedPlayManager():
     def __init__(self, manager_id, process_type='DISCOVER', read_dir='opt',
-            opt_path_prefix='default', opt_path=None, status='INITIATED'):
+            opt_path_prefix='default', opt_path=None, status='INITIATED',
+            workers=DEFAULT_WORKER_COUNT, frontier_size=MAX_FRONTIER_SIZE,
+            card_parser=DEFAULT_CARD_PARSER, offload_parsing=False,
+            flush_interval=0, flush_threshold=0, resume_path=None,
+            dedupe=EXACT_DEDUPE, dedupe_capacity=DEDUPE_CAPACITY, dedupe_error_rate=DEDUPE_ERROR_RATE,
+            store=JSON_STORE, max_age=0, max_requests=0, concurrent_pages=False,
+            shard_index=0, shard_count=1, frontier=FIFO_FRONTIER, max_depth=0, min_yield=0.0):
         self.id = manager_id
         self.process_type = process_type
         self.read_dir = read_dir
+        self.workers = workers
+        self.frontier_size = frontier_size
+        self.card_parser = card_parser
+        self.offload_parsing = offload_parsing
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.resume_path = resume_path
+        self.dedupe = dedupe
+        self.dedupe_capacity = dedupe_capacity
+        self.dedupe_error_rate = dedupe_error_rate
+        self.store = store
+        self.max_age = max_age
+        self.max_requests = max_requests
+        self.concurrent_pages = concurrent_pages
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.frontier = frontier
+        self.max_depth = max_depth
+        self.min_yield = min_yield
         self.opt_path = opt_path if opt_path else self._determine_opt_file_path(opt_path_prefix)
         self.status = status
         self.failures = []
 
     def _determine_opt_file_path(self, opt_path_prefix):
         if self.process_type == 'DETAILS':
-            return '{}_{}_detailed.json'.format(
+            return '{}_{}{}.json'.format(
                 opt_path_prefix,
-                self.id
+                self.id,
+                DETAILED_OPT_FILE_SUFFIX
             )
         else:
             return '{}_{}.json'.format(
@@ -72,38 +166,93 @@ class InitiatedPlayManager():
                 self.id
             )
         
-    def peek(self):
+    def settings(self):
+        return dict(
+            process_type=self.process_type,
+            read_dir=self.read_dir,
+            opt_path=self.opt_path,
+            workers=self.workers,
+            frontier_size=self.frontier_size,
+            card_parser=self.card_parser,
+            offload_parsing=self.offload_parsing,
+            flush_interval=self.flush_interval,
+            flush_threshold=self.flush_threshold,
+            resume_path=self.resume_path,
+            dedupe=self.dedupe,
+            dedupe_capacity=self.dedupe_capacity,
+            dedupe_error_rate=self.dedupe_error_rate,
+            store=self.store,
+            max_age=self.max_age,
+            max_requests=self.max_requests,
+            concurrent_pages=self.concurrent_pages,
+            shard_index=self.shard_index,
+            shard_count=self.shard_count,
+            frontier=self.frontier,
+            max_depth=self.max_depth,
+            min_yield=self.min_yield
+        )
+
+    def peek(self, show_records=False):
         return dict(
             process_id=self.id,
             status=self.status
         )
-    async def activate(self, manager_info_map):
-        async with pf(persist=True) as play:
-            manager = PlayManager(self, play, is_delegated=True)
+    async def activate(self, manager_info_map, shard_transport=None):
+        parse_executor = get_parse_pool() if self.offload_parsing else None
+        async with pf(persist=True, card_parser=self.card_parser, parse_executor=parse_executor) as play:
+            manager = PlayManager(self, play, is_delegated=True, shard_transport=shard_transport)
             manager_info_map[self.id] = manager
             if self.process_type == 'DETAILS':
                 await manager.fetch_detailed_info_for_apps()
             else:
                 await manager.discover_apps()
 
+    async def collect_metrics(self):
+        return []
+
+    def list_records(self, position=None, limit=RECORD_PAGE_SIZE, full_records=False):
+        # nothing is written until the manager is activated
+        return [], None
+
     def fail_to_initialize(self, cause):
         self.status = 'CORRUPTED'
         self.failures.append('INITIALIZATION_FAILURE')
         log.error('@@@ failed to initialize the manager: {}, cause is: {} @@@'.format(self.id, cause))
 
 class PlayManager(InitiatedPlayManager):
-    def __init__(self, parent_manager, play, is_delegated=False):
+    def __init__(self, parent_manager, play, is_delegated=False, shard_transport=None):
         log.info('*** inside PlayManager.__init__ ***')
         super().__init__(parent_manager.id, 
-            process_type=parent_manager.process_type, 
-            read_dir=parent_manager.read_dir,
-            opt_path=parent_manager.opt_path,
-            status='RUNNING'
+            status='RUNNING',
+            **parent_manager.settings()
         )
         self._loop = asyncio.get_event_loop()
+        self._thread_id = threading.get_ident()
         self._play = play
-        self.info_map = dict()
-        self.detailed_info_map = dict()
+        self._timer = play.timer
+        self.info_map = RecordStore()
+        self.detailed_info_map = RecordStore()
+        self._frontier = create_frontier(self.frontier, max_size=self.frontier_size)
+        self._visited = create_visited_set(
+            self.dedupe,
+            capacity=self.dedupe_capacity,
+            error_rate=self.dedupe_error_rate
+        )
+        self._retry_policy = RetryPolicy()
+        self._circuit_breaker = CircuitBreaker()
+        self.errors = dict()
+        if self.store == SQLITE_STORE:
+            # the store is written incrementally, records are upserted every flush_threshold records at the latest
+            self._checkpoint = SqliteStoreWriter(store_path_for(os.path.dirname(self.opt_path)))
+            self.flush_threshold = self.flush_threshold or SQLITE_FLUSH_THRESHOLD
+        else:
+            self._checkpoint = JsonlCheckpointWriter(checkpoint_path_for(self.opt_path))
+        self._unflushed_ids = []
+        self._snapshot_lock = asyncio.Lock()
+        self._load_pool = None
+        self.records_flushed = 0
+        self._snapshot_path = snapshot_path_for(self.opt_path)
+        self.records_resumed = 0
         self._tasks = []
         self._shielded_tasks = []
         self.start_datetime = time.ctime()
@@ -111,8 +260,27 @@ class PlayManager(InitiatedPlayManager):
         self._start_time = time.time()
         self.time_taken = 0
         self.records_found = 0
+        self.dedupe_lookups = 0
+        self.dedupe_hits = 0
         self.records_processed = 0
         self.records_failed = 0
+        self.records_refreshed = 0
+        self.records_deferred = 0
+        self.detail_requests = 0
+        self._stale_ids = []
+        self._collection_ends = dict()
+        self._page_requests = dict()
+        self.pages_cancelled = 0
+        self.discovery_requests = 0
+        self.max_depth_reached = 0
+        self.records_beyond_depth = 0
+        self._records_found_window = deque(maxlen=YIELD_WINDOW)
+        self.is_exhausted = False
+        self._pruned_entries = []
+        self.entries_pruned = 0
+        self._router = None
+        if shard_transport is not None and self.shard_count > 1:
+            self._router = ShardRouter(shard_transport, self.shard_index, self.shard_count)
         self.records = []
         self.is_successfully_dumped = None
         self._shutdown_tasks = []
@@ -129,38 +297,109 @@ class PlayManager(InitiatedPlayManager):
             started_at=self.start_datetime,
             stopped_at=self.stop_datetime,
             failures=self.failures,
-            records_collected=self.records_found
+            records_collected=self.records_found,
+            records_flushed=self.records_flushed,
+            records_resumed=self.records_resumed,
+            dedupe=self.dedupe,
+            store=self.store,
+            records_visited=len(self._visited),
+            rate_limit_wait=self._play.rate_limit_wait,
+            errors=self.errors,
+            circuit=self._circuit_breaker.state,
+            workers=self.workers,
+            pending_entries=len(self._frontier),
+            spilled_entries=self._frontier.spilled,
+            active_entries=self._frontier.in_progress
         )
         if self.process_type == 'DETAILS':
             opt.update(dict(
                 records_processed=self.records_processed,
-                records_failed=self.records_failed
+                records_failed=self.records_failed,
+                records_refreshed=self.records_refreshed,
+                records_deferred=self.records_deferred,
+                detail_requests=self.detail_requests,
+                max_age=self.max_age,
+                max_requests=self.max_requests
             ))
             if self.status in CLOSED_STATUSES:
                 opt.update(dict(
                     time_taken=self.time_taken,
-                    optfile=self.opt_path
+                    optfile=self._output_path()
                 ))
             else:
                 opt.update(dict(
                     time_elapsed=self.time_taken
                 ))
         else:
+            opt.update(dict(
+                frontier=self.frontier,
+                discovery_requests=self.discovery_requests,
+                records_per_thousand_requests=round(
+                    1000 * self.records_found / self.discovery_requests, 1
+                ) if self.discovery_requests else None,
+                recent_yield=self._recent_yield(),
+                max_depth=self.max_depth,
+                max_depth_reached=self.max_depth_reached,
+                records_beyond_depth=self.records_beyond_depth,
+                min_yield=self.min_yield,
+                is_exhausted=self.is_exhausted,
+                entries_pruned=self.entries_pruned
+            ))
+            if self.concurrent_pages:
+                opt['pages_cancelled'] = self.pages_cancelled
+            if self._router is not None:
+                opt.update(self._router.stats())
             if self.status in CLOSED_STATUSES:
                 opt.update(dict(
                     time_taken=self.time_taken,
-                    optfile=self.opt_path
+                    optfile=self._output_path()
                 ))
             else:
                 opt.update(dict(
                     time_elapsed=time.time() - self._start_time
                 ))
         
+        if self._checkpoint.records_written:
+            opt['checkpoint'] = self._checkpoint.file_path
         if show_records:
             opt['records'] = self.records
         log.info('*** peek results for manager [{}]: {}'.format(self.id, opt))
         return opt
     
+    def list_records(self, position=None, limit=RECORD_PAGE_SIZE, full_records=False):
+        """
+        Next page of the ids listed by `peek(show_records=True)`, or of the records written to
+        the output files so far, see `play_listing`. Only reads files, so any thread can page.
+        """
+        if full_records:
+            return page_records(output_files(self._output_path()), position, limit)
+        return page_ids([self.records], position, limit)
+
+    def metrics_snapshot(self):
+        return dict(
+            labels=dict(manager=self.id, process_type=self.process_type),
+            endpoints=self._play.metrics.snapshot(),
+            pending_entries=len(self._frontier),
+            active_entries=self._frontier.in_progress,
+            records_found=self.records_found,
+            dedupe_lookups=self.dedupe_lookups,
+            dedupe_hits=self.dedupe_hits,
+            up=int(self.status == 'RUNNING')
+        )
+
+    async def collect_metrics(self):
+        return [await self.run_in_loop(self.metrics_snapshot)]
+
+    async def configure_timing(self, enabled=None, reset=False):
+        return await self.run_in_loop(functools.partial(self._timer.configure, enabled=enabled, reset=reset))
+
+    async def profile(self, seconds):
+        """
+        Samples the thread running the manager's loop for `seconds`, see `play_profile.sample_thread`.
+        """
+        log.info('*** profiling manager: {} for {}s ***'.format(self.id, seconds))
+        return await asyncio.get_event_loop().run_in_executor(None, sample_thread, self._thread_id, seconds)
+
     def _register_task(self, coro, shield=False):
         if not self.is_cancelled():
             task = self._loop.create_task(coro)
@@ -173,16 +412,21 @@ class PlayManager(InitiatedPlayManager):
         log.info('*** terminating tasks for manager: {} ***'.format(self.id))
         # TODO: All tasks are not getting properly terminated
         # $ref: Exception #3 @ observed_error.log
+        self._frontier.close()
 
         for task in self._tasks:
             if not task.done():
                 try:
                     task.cancel()
-                    log.info('*** task successfully cancelled ***')
+                    log.debug('*** task successfully cancelled ***')
                 except asyncio.CancelledError:
                     log.warning('### task already cancelled ###')
                 except:
                     log.exception('@@@ unkown exception while cancelling task @@@')
+        pending_tasks = [task for task in self._tasks if not task.done()]
+        if pending_tasks:
+            # let the cancelled workers unwind so their records are in place before the dump
+            await asyncio.wait(pending_tasks, timeout=TASK_TERMINATION_TIMEOUT)
         if self._shielded_tasks:
             try:
                 log.info('*** waiting for shielded tasks to complete ***')
@@ -195,11 +439,143 @@ class PlayManager(InitiatedPlayManager):
                 log.info('$$$ printing shielded tasks $$$')
                 log.info(self._shielded_tasks)
 
+    async def run_in_loop(self, func, *args):
+        """
+        Runs `func` on the manager's own loop and awaits its result from the caller's loop,
+        as the records must only be touched from the thread running the manager.
+        """
+        if not self._loop.is_running():
+            return func(*args)
+        future = concurrent.futures.Future()
+        def run():
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+        self._loop.call_soon_threadsafe(run)
+        return await asyncio.wrap_future(future)
+
+    async def request_checkpoint(self):
+        if not self._loop.is_running():
+            return await self.checkpoint()
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self.checkpoint(), self._loop))
+
+    def _result_source(self):
+        return self.detailed_info_map if self.process_type == 'DETAILS' else self.info_map
+
+    def _record_ids(self):
+        visited_ids = self._visited.ids()
+        return list(self._result_source().keys()) if visited_ids is None else visited_ids
+
+    def _is_checkpointed(self):
+        return self.store == SQLITE_STORE or self._checkpoint.records_written
+
+    def _output_path(self):
+        return self._checkpoint.file_path if self._is_checkpointed() else self.opt_path
+
+    def _track_unflushed(self, app_id):
+        self._unflushed_ids.append(app_id)
+        if self.flush_threshold and len(self._unflushed_ids) >= self.flush_threshold:
+            self.flush()
+
+    def flush(self):
+        app_ids = self._unflushed_ids
+        if not app_ids:
+            return []
+        start_time = self._timer.start()
+        result_source = self._result_source()
+        log.info('*** flushing [{}] records for manager: {} ***'.format(len(app_ids), self.id))
+        if not self._checkpoint.write([result_source[app_id] for app_id in app_ids]):
+            log.warning('### failed to flush records for manager: {} ###'.format(self.id))
+            if 'CHECKPOINT_FAILURE' not in self.failures:
+                self.failures.append('CHECKPOINT_FAILURE')
+            return []
+        self._unflushed_ids = []
+        for app_id in app_ids:
+            # the visited set keeps deduping, the records themselves now live on disk
+            del result_source[app_id]
+            if self.process_type == 'DETAILS':
+                self.info_map[app_id] = None
+        self.records_flushed += len(app_ids)
+        self._timer.stop(FLUSH_STAGE, start_time)
+        return app_ids
+
+    def _frontier_snapshot_reader(self):
+        read_frontier = self._frontier.snapshot_reader()
+        # pruned entries are kept for a resume with a lower min_yield
+        pruned_entries = list(self._pruned_entries)
+        return lambda: read_frontier() + pruned_entries
+
+    async def _write_snapshot(self, read_frontier):
+        """
+        Takes the visited lines on the loop, then compresses and writes them along with the frontier
+        (read by `read_frontier`) on the default executor, so that the loop keeps running meanwhile.
+        """
+        async with self._snapshot_lock:
+            start_time = self._timer.start()
+            visited_lines = list(self._visited.snapshot_lines())
+            header = dict(
+                manager_id=self.id,
+                process_type=self.process_type
+            )
+            is_written = await self._loop.run_in_executor(
+                None,
+                lambda: write_snapshot(self._snapshot_path, header, visited_lines, read_frontier())
+            )
+            self._timer.stop(SNAPSHOT_STAGE, start_time)
+            return is_written
+
+    async def checkpoint(self):
+        """
+        Flushes the records and snapshots the visited ids along with the frontier for resuming.
+        """
+        flushed_ids = self.flush()
+        await self._write_snapshot(self._frontier_snapshot_reader())
+        return flushed_ids
+
+    def _resume_from_snapshot(self):
+        log.info('*** resuming manager: {} from snapshot: {} ***'.format(self.id, self.resume_path))
+        frontier_entries = 0
+        visited_count = len(self._visited)
+        unknown_lines = set()
+        for line_type, value in iter_snapshot(self.resume_path):
+            if line_type == FRONTIER_LINE:
+                if self.process_type != 'DETAILS':
+                    self._frontier.put_nowait(value)
+                    frontier_entries += 1
+            # records of the previous run stay in its own output files, only their ids are visited
+            elif self._visited.load_line(line_type, value):
+                continue
+            elif line_type not in unknown_lines:
+                unknown_lines.add(line_type)
+                log.error('@@@ {} dedupe cannot resume from snapshot lines of type: {} @@@'.format(
+                    self.dedupe,
+                    line_type
+                ))
+        self.records_resumed = len(self._visited) - visited_count
+        log.info('*** resumed [{}] visited apps and [{}] frontier entries for manager: {} ***'.format(
+            self.records_resumed,
+            frontier_entries,
+            self.id
+        ))
+
+    async def _flush_periodically(self):
+        while not self.is_cancelled():
+            await asyncio.sleep(self.flush_interval)
+            if not self.is_cancelled():
+                await self.checkpoint()
+
+    def _start_periodic_flush(self):
+        if self.flush_interval:
+            log.info('*** flushing records every {}s for manager: {} ***'.format(self.flush_interval, self.id))
+            self._register_task(self._flush_periodically())
+
     def _stop_loop(self):
         log.info('*** terminating loop for manager: {} ***'.format(self.id))
         try:
             if self._loop.is_running():
-                self._loop.stop()
+                # stop on the next iteration so that tasks awaiting the shutdown can finish
+                self._loop.call_soon(self._loop.stop)
         except:
             log.exception('@@@ failed to stop loop for manager: {} @@@'.format(self.id))
         else:
@@ -220,19 +596,35 @@ class PlayManager(InitiatedPlayManager):
             return True
 
     def _dump_data(self):
+        start_time = self._timer.start()
+        self._dump_records()
+        self._timer.stop(DUMP_STAGE, start_time)
+
+    def _dump_records(self):
         log.info('*** dumping data for manager: {} ***'.format(self.id))
-        result_source = self.detailed_info_map if self.process_type == 'DETAILS' else self.info_map
-        
+        result_source = self._result_source()
+
+        if self._is_checkpointed():
+            self.flush()
+            self._checkpoint.close()
+            self.is_successfully_dumped = not self._unflushed_ids
+            if not self.is_successfully_dumped:
+                self.failures.append('DATA_DUMP_FAILURE')
+            self.records = self._record_ids()
+            return
+
         if not result_source:
             log.warning('### no records found ###')
             return
         
-        games = list(result_source.values())
+        # records are materialised one opt file at a time instead of all at once
+        games = (game for game in result_source.values() if game is not None)
         file_idx = 0
-        selected_games = games[
-            file_idx * MAX_GAME_INFO_PER_OPT_FILE:
-            (file_idx + 1) * MAX_GAME_INFO_PER_OPT_FILE
-        ]
+        selected_games = list(islice(games, MAX_GAME_INFO_PER_OPT_FILE))
+        if not selected_games:
+            log.warning('### no new records found ###')
+            self.records = self._record_ids()
+            return
         while selected_games:
             log.info('*** dumping data for manager: {}, file_idx: {}, selected_games: {} ***'.format(
                 self.id,
@@ -244,30 +636,31 @@ class PlayManager(InitiatedPlayManager):
                 dump_result and self.is_successfully_dumped
             )
             file_idx += 1
-            selected_games = games[
-                file_idx * MAX_GAME_INFO_PER_OPT_FILE:
-                (file_idx + 1) * MAX_GAME_INFO_PER_OPT_FILE
-            ]
+            selected_games = list(islice(games, MAX_GAME_INFO_PER_OPT_FILE))
         
         if self.is_successfully_dumped:
             log.info('*** successfully dumped data for manager: {} ***'.format(self.id))
         else:
             self.failures.append('DATA_DUMP_FAILURE')
             log.warning('### failed to properly dump data for manager: {} ###'.format(self.id))
-        self.records = list(result_source.keys())
+        self.records = self._record_ids()
 
     def _release_heavy_objects(self):
         if self.is_delegated:
-            self.info_map = {}
+            self.info_map = RecordStore()
+            self._frontier.clear()
+            self._pruned_entries = []
             self._tasks = []
             self._shielded_tasks = []
             self._shutdown_tasks = []
 
     async def _shutdown(self, is_completed=False, callback=None):
+        read_frontier = self._frontier_snapshot_reader()
         await self._terminate_tasks()
         await self._play.force_close()
         self.time_taken = time.time() - self._start_time
         self._dump_data()
+        await self._write_snapshot(read_frontier)
         log.info('*** manager: {}; records_found: {}; time_taken: {} ***'.format(
             self.id,
             self.records_found,
@@ -301,80 +694,276 @@ class PlayManager(InitiatedPlayManager):
     def _has_more_records(records, page_size):
         return records and len(records) == page_size
 
-    def _filter_unique_and_update_map(self, game):
+    def _filter_unique_and_update_map(self, game, depth=0):
         app_id = game.get('app_id')
-        app_info = self.info_map.get(app_id, NO_RECORD_FOUND)
-        if app_info != NO_RECORD_FOUND:
+        if self._router is not None and not self._router.owns(app_id):
+            # only the owning shard dedupes and explores an app
+            self._router.forward(game, depth)
+            return False
+        self.dedupe_lookups += 1
+        if not self._visited.add(app_id):
+            self.dedupe_hits += 1
             return False
         self.info_map[app_id] = game
         self.records_found += 1
+        self._track_unflushed(app_id)
         return True
 
-    def _persist_and_determine_recent_apps(self, games):
-        return [] if games is None else list(filter(
-            self._filter_unique_and_update_map,
-            games
-        ))
+    def _persist_and_determine_recent_apps(self, games, depth=0):
+        if games is None:
+            return []
+        start_time = self._timer.start()
+        unique_games = [game for game in games if self._filter_unique_and_update_map(game, depth)]
+        if self._router is not None:
+            self._router.flush()
+        self._timer.stop(DEDUPE_STAGE, start_time)
+        return unique_games
+
+    async def _retriable_request(self, task, shield=False):
+        attempts = dict()
+        # the PlayFetch method name, i.e. the endpoint
+        endpoint = getattr(task, 'func', task).__name__
+        while shield or not self.is_cancelled():
+            try:
+                await self._circuit_breaker.guard()
+                opt = await task()
+            except (asyncio.CancelledError, concurrent.futures.CancelledError):
+                # not a failed request: the caller must not count it, and its task must end cancelled
+                log.warning('### request cancelled for endpoint: %s ###', endpoint)
+                raise
+            except Exception as e:
+                error_class = classify_error(e)
+                self.errors[error_class] = self.errors.get(error_class, 0) + 1
+                self._circuit_breaker.record_failure(error_class)
+                attempts[error_class] = attempts.get(error_class, 0) + 1
+                is_retried = self._retry_policy.should_retry(error_class, attempts[error_class])
+                self._play.metrics.record_error(endpoint, error_class, is_retried)
+                if not is_retried:
+                    log.info('*** giving up on %s error after %s attempts: %s ***', error_class, attempts[error_class], e)
+                    return None
+                delay = self._retry_policy.backoff(sum(attempts.values()) - 1)
+                log.info('*** retrying in %.2fs on %s error: %r ***', delay, error_class, e)
+                await asyncio.sleep(delay)
+            else:
+                self._circuit_breaker.record_success()
+                return opt
+        return None
+
+    def _start_frontier_workers(self):
+        log.info('*** starting [{}] frontier workers for manager: {} ***'.format(self.workers, self.id))
+        for worker_idx in range(self.workers):
+            self._register_task(self._frontier_worker(worker_idx))
+
+    async def _frontier_worker(self, worker_idx):
+        while not self.is_cancelled():
+            entry = await self._frontier.get()
+            if entry is None:
+                break
+            try:
+                await self._process_frontier_entry(entry)
+            except asyncio.CancelledError:
+                raise
+            except:
+                log.exception('@@@ worker: {} failed to process entry: {} @@@'.format(worker_idx, entry))
+            finally:
+                self._frontier.task_done(entry)
+        log.debug('*** frontier worker: %s exited for manager: %s ***', worker_idx, self.id)
+
+    async def _process_frontier_entry(self, entry):
+        entry_type = entry[0]
+        if self.is_exhausted and entry_type in (SIMILAR_ENTRY, COLLECTION_ENTRY):
+            self._pruned_entries.append(entry)
+            self.entries_pruned += 1
+            return
+        if entry_type == SIMILAR_ENTRY:
+            await self.fetch_apps_by_similarity(*entry[1:])
+        elif entry_type == COLLECTION_ENTRY:
+            await self.fetch_apps_by_collection(*entry[1:])
+        elif entry_type == DETAILS_ENTRY:
+            await self.fetch_app_details(*entry[1:])
+        else:
+            log.error('@@@ unknown frontier entry: {} @@@'.format(entry))
 
-    async def _retriable_request(self, task, retry_limit=3, shield=False):
-        if retry_limit <= 0 or (self.is_cancelled() and not shield):
+    async def _complete_on_drained_frontier(self):
+        await self._frontier.join()
+        if self.is_cancelled():
+            return
+        log.info('*** frontier drained for manager: {} ***'.format(self.id))
+        await self.shutdown(is_completed=True, wait=True)
+
+    def _queue_unique_games(self, games, depth=0):
+        """
+        Records the new apps among `games`, found at `depth` similar hops from the seed collections,
+        and queues them for exploring unless they are as deep as `max_depth`.
+        """
+        unique_games = self._persist_and_determine_recent_apps(games, depth)
+        if not unique_games:
+            return
+        log.info('*** %s unique games recently added ***', len(unique_games))
+        self.max_depth_reached = max(self.max_depth_reached, depth)
+        if self.max_depth and depth >= self.max_depth:
+            self.records_beyond_depth += len(unique_games)
+            return
+        # the share of new apps of a page hints at how much exploring them will find
+        parent_yield = round(len(unique_games) / len(games), 3)
+        for game in unique_games:
+            self._frontier.put_nowait(similar_entry(game.get('app_id'), depth, parent_yield))
+
+    def _recent_yield(self):
+        """
+        New apps per discovery request over the last YIELD_WINDOW requests.
+        """
+        if len(self._records_found_window) < 2:
             return None
-        try:
-            opt = await task()
-        except ValueError:
-            log.info('*** pagination exception encountered ***')
-            opt = None
-        except concurrent.futures._base.CancelledError:
-            log.warning('### failed due to cancellation ###')
-            opt = None
-        except:
-            log.exception('@@@ retrying on unknown exception @@@')
-            opt = await self._retriable_request(task, retry_limit-1, shield=shield)
-        return opt
+        window = self._records_found_window
+        return round((window[-1] - window[0]) / (len(window) - 1), 3)
+
+    def _track_yield(self):
+        self.discovery_requests += 1
+        self._records_found_window.append(self.records_found)
+        if not self.min_yield or self.is_exhausted or len(self._records_found_window) < YIELD_WINDOW:
+            return
+        recent_yield = self._recent_yield()
+        if recent_yield < self.min_yield:
+            log.warning('### yield of {} apps per request below {}, manager: {} stops exploring ###'.format(
+                recent_yield,
+                self.min_yield,
+                self.id
+            ))
+            self.is_exhausted = True
 
-    async def _play_gatherer(self, task):
+    async def _play_gatherer(self, task, depth=0):
         games = await self._retriable_request(task)
-        unique_games = self._persist_and_determine_recent_apps(games)
-        if unique_games:
-            log.info('*** {} unique games recently added ***'.format(len(unique_games)))
-            for game in unique_games:
-                self._register_task(
-                    self.fetch_apps_by_similarity(game.get('app_id'))
-                )
+        self._queue_unique_games(games, depth)
+        self._track_yield()
         return games
 
+    async def _receive_routed_games(self):
+        log.info('*** receiving apps routed to shard: {} of manager: {} ***'.format(self.shard_index, self.id))
+        try:
+            while not self.is_cancelled():
+                routed = await self._loop.run_in_executor(None, self._router.receive)
+                if routed:
+                    depth, games = routed
+                    self._queue_unique_games(games, depth)
+                    # acknowledged only once queued, so that the shard is never seen idle in between
+                    self._router.acknowledge(games)
+        finally:
+            self._router.close()
+
+    def _store_detailed_info(self, app_id, app_info):
+        self._visited.add(app_id)
+        self.detailed_info_map[app_id] = app_info
+        self.records_processed += 1
+        self._track_unflushed(app_id)
+
+    def _is_fresh(self, app_info):
+        if not is_detailed(app_info):
+            return False
+        # records detailed before fetched_at existed count as fetched at the epoch
+        return not self.max_age or time.time() - app_info.get(FETCHED_AT_KEY, 0) < self.max_age
+
+    def _keep_previous_info(self, app_id, app_info):
+        # not visited, so that a resumed or later run still refreshes it
+        self.detailed_info_map[app_id] = app_info
+        self._track_unflushed(app_id)
+
     async def fetch_app_details(self, app_id):
-        log.info('*** fetching app details for: {} ***'.format(app_id))
-        app_info = self.info_map.get(app_id)
+        log.info('*** fetching app details for: %s ***', app_id)
+        previous_info = self.info_map.get(app_id)
+        if previous_info is None:
+            log.warning('### no record left to detail for: %s ###', app_id)
+            return
 
-        if app_info.get('developer_email'):
-            log.info('*** app detailed info already exists for: {} ***'.format(app_info))
-            self.detailed_info_map[app_id] = app_info
-            self.records_processed += 1
+        if self._is_fresh(previous_info):
+            log.info('*** app detailed info already exists for: %s ***', app_id)
+            self._store_detailed_info(app_id, previous_info)
             return
 
-        app_info = await self._retriable_request(functools.partial(
-            self._play.details,
-            app_id
-        ), shield=True)
+        if self.max_requests and self.detail_requests >= self.max_requests:
+            log.info('*** request cap reached, deferring app details for: %s ***', app_id)
+            self.records_deferred += 1
+            self._keep_previous_info(app_id, previous_info)
+            return
+
+        self.detail_requests += 1
+        try:
+            app_info = await self._retriable_request(functools.partial(
+                self._play.details,
+                app_id
+            ), shield=True)
+        except (asyncio.CancelledError, concurrent.futures.CancelledError):
+            # dumped with its previous record, the entry stays in the snapshot to be fetched on resume
+            if is_detailed(previous_info):
+                self._keep_previous_info(app_id, previous_info)
+            raise
         if app_info is None:
-            log.warning('### unable to fetch app details for: {} ###'.format(app_id))
+            log.warning('### unable to fetch app details for: %s ###', app_id)
             self.records_failed += 1
+            if is_detailed(previous_info):
+                self._keep_previous_info(app_id, previous_info)
             return
-        
-        self.detailed_info_map[app_id] = app_info
-        self.records_processed += 1
-        log.info('*** successfully fetched app details for: {} ***'.format(app_id))
 
-    async def fetch_apps_by_similarity(self, app_id):
-        log.info('*** fetching apps similar to: {} ***'.format(app_id))
+        app_info[FETCHED_AT_KEY] = int(time.time())
+        if is_detailed(previous_info):
+            self.records_refreshed += 1
+        self._store_detailed_info(app_id, app_info)
+        log.info('*** successfully fetched app details for: %s ***', app_id)
+
+    async def fetch_apps_by_similarity(self, app_id, depth=0, parent_yield=None):
+        log.info('*** fetching apps similar to: %s at depth: %s ***', app_id, depth)
         await self._play_gatherer(functools.partial(
             self._play.similar,
             app_id
-        ))
+        ), depth=depth+1)
+
+    def _is_past_collection_end(self, coln, catg, page):
+        end = self._collection_ends.get((coln, catg))
+        return end is not None and page > end
+
+    def _end_collection(self, coln, catg, page):
+        """
+        Records the short `page` as the end of coln/catg and cancels the requests for the pages after it.
+        """
+        page = min(page, self._collection_ends.get((coln, catg), page))
+        self._collection_ends[(coln, catg)] = page
+        for (request_coln, request_catg, request_page), request in list(self._page_requests.items()):
+            if (request_coln, request_catg) == (coln, catg) and request_page > page:
+                log.info('*** cancelling page: %s of %s/%s past its end ***', request_page, coln, catg)
+                request.cancel()
+
+    async def _fetch_collection_page(self, coln, catg, page, results):
+        if self._is_past_collection_end(coln, catg, page):
+            log.info('*** skipping page: %s of %s/%s past its end ***', page, coln, catg)
+            self.pages_cancelled += 1
+            return
+        key = (coln, catg, page)
+        request = self._loop.create_task(self._play_gatherer(functools.partial(
+            self._play.collection,
+            coln, catg,
+            page=page,
+            results=results
+        )))
+        self._page_requests[key] = request
+        try:
+            # unlike awaiting the request, waiting for it does not raise when only the request was cancelled
+            await asyncio.wait([request])
+        except (asyncio.CancelledError, concurrent.futures.CancelledError):
+            request.cancel()
+            raise
+        finally:
+            self._page_requests.pop(key, None)
+        if request.cancelled() or self._is_past_collection_end(coln, catg, page):
+            self.pages_cancelled += 1
+            return
+        if not PlayManager._has_more_records(request.result(), results):
+            self._end_collection(coln, catg, page)
 
     async def fetch_apps_by_collection(self, coln, catg, page=0, results=MAX_RECORD_SIZE_PER_PAGE):
-        log.info('*** fetching page for: {}/{} ***'.format(coln, catg))
+        log.info('*** fetching page for: %s/%s ***', coln, catg)
+        if self.concurrent_pages:
+            await self._fetch_collection_page(coln, catg, page, results)
+            return
         games = await self._play_gatherer(functools.partial(
             self._play.collection,
             coln, catg, 
@@ -382,15 +971,28 @@ class PlayManager(InitiatedPlayManager):
             results=results
         ))
         if PlayManager._has_more_records(games, results):
-            log.info('*** fetching more pages for {}/{} ***'.format(coln, catg))
-            await self.fetch_apps_by_collection(coln, catg, page=page+1, results=results)
+            log.info('*** queueing more pages for %s/%s ***', coln, catg)
+            self._frontier.put_nowait((COLLECTION_ENTRY, coln, catg, page+1))
 
     async def discover_apps(self):
-        for coln in COLLECTIONS[:]:
-            for catg in CATEGORIES[:]:
-                self._register_task(
-                    self.fetch_apps_by_collection(coln, catg)
-                )
+        self._start_frontier_workers()
+        self._start_periodic_flush()
+        if self._router is not None:
+            self._register_task(self._receive_routed_games())
+        if self.resume_path:
+            self._resume_from_snapshot()
+        else:
+            # every page within the `page * results <= 500` bound of PlayFetch.collection is known upfront
+            pages = range(MAX_COLLECTION_START // MAX_RECORD_SIZE_PER_PAGE + 1) if self.concurrent_pages else [0]
+            # page by page, so that the later pages of a short collection/category are mostly skipped
+            for page in pages:
+                for coln in COLLECTIONS[:]:
+                    for catg in CATEGORIES[:]:
+                        if self._router is None or self._router.owns_collection(coln, catg):
+                            await self._frontier.put((COLLECTION_ENTRY, coln, catg, page))
+        # a drained shard can still receive apps, so the coordinator completes the shards together
+        if self._router is None:
+            self._loop.create_task(self._complete_on_drained_frontier())
 
     def _get_filenames_from_read_dir(self, retry=2):
         if retry <= 0:
@@ -409,52 +1011,124 @@ class PlayManager(InitiatedPlayManager):
         
         return files
 
-    def _load_file_and_update_info_map(self, file, retry=2):
-        if retry <= 0:
-            return
+    async def _merge_loaded_records(self, games, seed_details=False):
+        for game in games:
+            app_id = game.get('app_id')
+            game_info = self.info_map.get(app_id, NO_RECORD_FOUND)
+            if game_info == NO_RECORD_FOUND:
+                self.info_map[app_id] = game
+                self.records_found += 1
+                if seed_details and app_id not in self._visited and not self._frontier.is_closed():
+                    await self._seed_details(app_id, game)
+            elif game_info is not None:
+                game_info.update(game)
+                self.info_map[app_id] = game_info
+
+    async def _load_file_and_update_info_map(self, file, seed_details=False, read_batch=read_record_batch, retry=2):
+        log.info('*** loading data from file: {} ***'.format(file))
+        cursor = None
+        while not self.is_cancelled():
+            try:
+                games, next_cursor = await self._loop.run_in_executor(
+                    self._load_pool,
+                    read_batch,
+                    file,
+                    cursor
+                )
+            except (asyncio.CancelledError, concurrent.futures.CancelledError):
+                raise
+            except:
+                log.exception('@@@ failed to read data from file: {} @@@'.format(file))
+                retry -= 1
+                if retry <= 0:
+                    return
+                continue
+            await self._merge_loaded_records(games, seed_details=seed_details)
+            if next_cursor is None:
+                log.info('*** successfully loaded data from file: {} ***'.format(file))
+                return
+            cursor = next_cursor
+
+    async def _import_file_into_store(self, store_path, file):
         try:
-            log.info('*** loading data from file: {} ***'.format(file))
-            with open(file) as file_data:
-                file_content = json.load(file_data)
-                if isinstance(file_content, dict):
-                    games = file_content.values()
-                elif isinstance(file_content, list):
-                    games = file_content
-                else:
-                    games = None
-                    log.error('@@@ unknown file data format found in: {} @@@'.format(file))
-                
-                if games:
-                    for game in games:
-                        game_info = self.info_map.get(game.get('app_id'), NO_RECORD_FOUND)
-                        if game_info == NO_RECORD_FOUND:
-                            self.info_map[game.get('app_id')] = game
-                            self.records_found += 1
-                        else:
-                            game_info.update(game)
+            await self._loop.run_in_executor(self._load_pool, import_file, store_path, file)
+        except (asyncio.CancelledError, concurrent.futures.CancelledError):
+            raise
         except:
-            log.exception('@@@ failed to read data from file: {} @@@'.format(file))
-            self._load_file_and_update_info_map(file, retry=retry-1)
-        else:
-            log.info('*** successfully loaded data from file: {} ***'.format(file))
-            
-    def load_previous_results(self):
+            log.exception('@@@ failed to import file: {} into store: {} @@@'.format(file, store_path))
+
+    async def _load_from_store(self, files, seed_details=False):
+        """
+        Imports the opt files of the read_dir which are new or changed since their
+        last import into its store, then streams the merged records from the store.
+        """
+        store_path = store_path_for(self.read_dir)
+        await asyncio.gather(*[self._import_file_into_store(store_path, file) for file in files])
+        await self._load_file_and_update_info_map(
+            store_path,
+            seed_details=seed_details,
+            read_batch=read_store_batch
+        )
+
+    async def load_previous_results(self, seed_details=False):
+        """
+        Streams every file of the read_dir in batches in a process pool (the parse pool with
+        `offload_parsing`, a pool of its own shut down after loading otherwise), the files being
+        read in parallel; with `seed_details` new apps are queued for details as soon as their
+        batch is merged, instead of after the last file.
+        """
         files = self._get_filenames_from_read_dir()
         log.info('*** processing [{}] files to retrieve previous records ***'.format(len(files)))
         if not files:
             log.warning('### no previously discovered apps found in: {} ###'.format(self.read_dir))
-        for file in files:
-            self._load_file_and_update_info_map(file) 
+        if self.offload_parsing:
+            self._load_pool = get_parse_pool()
+            await self._load_files(files, seed_details=seed_details)
+            return
+        self._load_pool = spawn_pool(max(min(len(files), LOAD_POOL_SIZE), 1))
+        try:
+            await self._load_files(files, seed_details=seed_details)
+        finally:
+            load_pool, self._load_pool = self._load_pool, None
+            await self._loop.run_in_executor(None, load_pool.shutdown)
+
+    async def _load_files(self, files, seed_details=False):
+        if self.store == SQLITE_STORE:
+            await self._load_from_store(files, seed_details=seed_details)
+        else:
+            # detailed files go first, so that an app is not queued as never detailed
+            # before the batch holding its details is merged
+            detailed_files = [file for file in files if DETAILED_OPT_FILE_SUFFIX in os.path.basename(file)]
+            for file_group in [detailed_files, [file for file in files if file not in detailed_files]]:
+                await asyncio.gather(*[
+                    self._load_file_and_update_info_map(file, seed_details=seed_details)
+                    for file in file_group
+                ])
         log.info('*** loaded all available records in: {} ***'.format(self.read_dir))
 
-    async def fetch_detailed_info_on_done(self):
-        await asyncio.gather(*self._tasks)
-        log.info('*** successfully retrieved detailed info for apps by manager: {} ***'.format(self.id))
-        # TODO: rethink this logic as the manager is not getting terminated for fetch details case
-        await self.shutdown(is_completed=True, wait=True)
+    async def _seed_details(self, app_id, app_info):
+        """
+        Never detailed and still fresh apps are queued right away, stale ones only
+        once every record is loaded, so that they come after the never detailed ones.
+        """
+        if is_detailed(app_info) and not self._is_fresh(app_info):
+            self._stale_ids.append((app_info.get(FETCHED_AT_KEY, 0), app_id))
+        else:
+            await self._frontier.put((DETAILS_ENTRY, app_id))
+
+    async def _seed_stale_details(self):
+        stale_ids, self._stale_ids = sorted(self._stale_ids), []
+        log.info('*** queueing [{}] stale apps for refresh ***'.format(len(stale_ids)))
+        for _, app_id in stale_ids:
+            if self._frontier.is_closed():
+                break
+            await self._frontier.put((DETAILS_ENTRY, app_id))
 
     async def fetch_detailed_info_for_apps(self):
-        self.load_previous_results()
-        for app_id in self.info_map.keys():
-            self._register_task(self.fetch_app_details(app_id))
-        self._loop.create_task(self.fetch_detailed_info_on_done())
\ No newline at end of file
+        if self.resume_path:
+            self._resume_from_snapshot()
+        self._start_frontier_workers()
+        self._start_periodic_flush()
+        await self.load_previous_results(seed_details=True)
+        await self._seed_stale_details()
+        self._loop.create_task(self._complete_on_drained_frontier())
\ No newline at end of file
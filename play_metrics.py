@@ -0,0 +1,173 @@
+"""
+Contains the request metrics kept by every PlayFetch and their rendering in the
+Prometheus text exposition format for `/metrics`.
+
+Recording is a few integer increments and a bisect into fixed buckets, with no
+lock nor label formatting on the hot path; the counters are only copied into a
+plain (picklable) snapshot and rendered when `/metrics` is scraped.
+"""
+from bisect import bisect_left
+
+from play_helper import (
+    LATENCY_BUCKETS,
+    PARSE_TIME_BUCKETS
+)
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class Histogram():
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # the last count is the +Inf bucket
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def snapshot(self):
+        return dict(bounds=list(self.bounds), counts=list(self.counts), sum=self.sum)
+
+class EndpointMetrics():
+    __slots__ = ('requests', 'cached', 'bytes', 'latency', 'parse_time', 'errors', 'retries')
+
+    def __init__(self):
+        self.requests = 0
+        self.cached = 0
+        self.bytes = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.parse_time = Histogram(PARSE_TIME_BUCKETS)
+        self.errors = dict()
+        self.retries = dict()
+
+    def snapshot(self):
+        return dict(
+            requests=self.requests,
+            cached=self.cached,
+            bytes=self.bytes,
+            latency=self.latency.snapshot(),
+            parse_time=self.parse_time.snapshot(),
+            errors=dict(self.errors),
+            retries=dict(self.retries)
+        )
+
+class PlayMetrics():
+    """
+    Per endpoint (details, collection, similar, search) metrics of one PlayFetch,
+    the errors and retries being recorded by the manager retrying its requests.
+    """
+    def __init__(self):
+        self._endpoints = dict()
+
+    def endpoint(self, endpoint):
+        metrics = self._endpoints.get(endpoint)
+        if metrics is None:
+            metrics = self._endpoints[endpoint] = EndpointMetrics()
+        return metrics
+
+    def record_request(self, endpoint, latency, size):
+        metrics = self.endpoint(endpoint)
+        metrics.requests += 1
+        metrics.bytes += size
+        metrics.latency.observe(latency)
+
+    def record_cached(self, endpoint):
+        self.endpoint(endpoint).cached += 1
+
+    def record_parse(self, endpoint, parse_time):
+        self.endpoint(endpoint).parse_time.observe(parse_time)
+
+    def record_error(self, endpoint, error_class, is_retried):
+        metrics = self.endpoint(endpoint)
+        metrics.errors[error_class] = metrics.errors.get(error_class, 0) + 1
+        if is_retried:
+            metrics.retries[error_class] = metrics.retries.get(error_class, 0) + 1
+
+    def snapshot(self):
+        return {endpoint: metrics.snapshot() for endpoint, metrics in list(self._endpoints.items())}
+
+METRIC_FAMILIES = [
+    ('play_requests_total', 'counter', 'Requests sent to the play store.'),
+    ('play_cached_responses_total', 'counter', 'Requests served from the response cache.'),
+    ('play_response_bytes_total', 'counter', 'Bytes of response bodies received.'),
+    ('play_request_duration_seconds', 'histogram', 'Latency of the requests sent to the play store.'),
+    ('play_parse_duration_seconds', 'histogram', 'Time taken to parse the responses.'),
+    ('play_errors_total', 'counter', 'Failed requests by error class.'),
+    ('play_retries_total', 'counter', 'Retried requests by error class.'),
+    ('play_frontier_pending_entries', 'gauge', 'Entries waiting in the frontier.'),
+    ('play_frontier_active_entries', 'gauge', 'Entries being worked on.'),
+    ('play_records_found_total', 'counter', 'Unique records found.'),
+    ('play_dedupe_lookups_total', 'counter', 'Apps looked up in the visited set.'),
+    ('play_dedupe_hits_total', 'counter', 'Apps found already visited.'),
+    ('play_dedupe_hit_ratio', 'gauge', 'Share of the looked up apps found already visited.'),
+    ('play_manager_up', 'gauge', 'Whether the manager is running.')
+]
+
+def _format_labels(labels):
+    return ','.join('{}="{}"'.format(
+        key,
+        str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    ) for key, value in labels.items())
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _histogram_samples(name, labels, histogram):
+    cumulative = 0
+    for bound, count in zip(histogram.get('bounds') + ['+Inf'], histogram.get('counts')):
+        cumulative += count
+        yield '{}_bucket'.format(name), dict(labels, le=bound), cumulative
+    yield '{}_sum'.format(name), labels, histogram.get('sum')
+    yield '{}_count'.format(name), labels, cumulative
+
+def _manager_samples(snapshot):
+    """
+    Yields `(family, sample name, labels, value)` for a manager snapshot, see PlayManager.metrics_snapshot.
+    """
+    labels = snapshot.get('labels')
+    for endpoint, metrics in snapshot.get('endpoints', {}).items():
+        endpoint_labels = dict(labels, endpoint=endpoint)
+        yield 'play_requests_total', 'play_requests_total', endpoint_labels, metrics.get('requests')
+        yield 'play_cached_responses_total', 'play_cached_responses_total', endpoint_labels, metrics.get('cached')
+        yield 'play_response_bytes_total', 'play_response_bytes_total', endpoint_labels, metrics.get('bytes')
+        for family, key in [('play_request_duration_seconds', 'latency'), ('play_parse_duration_seconds', 'parse_time')]:
+            for name, sample_labels, value in _histogram_samples(family, endpoint_labels, metrics.get(key)):
+                yield family, name, sample_labels, value
+        for family, key in [('play_errors_total', 'errors'), ('play_retries_total', 'retries')]:
+            for error_class, count in metrics.get(key).items():
+                yield family, family, dict(endpoint_labels, error_class=error_class), count
+    for family, key in [
+        ('play_frontier_pending_entries', 'pending_entries'),
+        ('play_frontier_active_entries', 'active_entries'),
+        ('play_records_found_total', 'records_found'),
+        ('play_dedupe_lookups_total', 'dedupe_lookups'),
+        ('play_dedupe_hits_total', 'dedupe_hits'),
+        ('play_manager_up', 'up')
+    ]:
+        if snapshot.get(key) is not None:
+            yield family, family, labels, snapshot.get(key)
+    if snapshot.get('dedupe_lookups'):
+        yield 'play_dedupe_hit_ratio', 'play_dedupe_hit_ratio', labels, (
+            snapshot.get('dedupe_hits') / snapshot.get('dedupe_lookups')
+        )
+
+def render_metrics(snapshots):
+    """
+    Renders the snapshots of every manager (and of the server's own PlayFetch) grouped by metric family.
+    """
+    samples = dict()
+    for snapshot in snapshots:
+        for family, name, labels, value in _manager_samples(snapshot):
+            samples.setdefault(family, []).append((name, labels, value))
+    lines = []
+    for family, metric_type, description in METRIC_FAMILIES:
+        if family not in samples:
+            continue
+        lines.append('# HELP {} {}'.format(family, description))
+        lines.append('# TYPE {} {}'.format(family, metric_type))
+        for name, labels, value in samples[family]:
+            lines.append('{}{{{}}} {}'.format(name, _format_labels(labels), _format_value(value)))
+    return '\n'.join(lines) + '\n'
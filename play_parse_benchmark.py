@@ -0,0 +1,191 @@
+"""
+Contains the parser micro-benchmark and the regression check over the saved pages in fixtures/corpus.
+
+Every page listed in the corpus manifest is parsed with every parser backend (the
+card parsers for the card pages, the only details parser for the details pages),
+timing each stage: building the document tree, extracting the records from it and
+pruning them. The pruned output of every backend is also compared with the
+expected output kept next to the pages, which is written by the reference
+backend (play_scraper's own soup parsing) with `--update-expected`, e.g.
+
+    python play_parse_benchmark.py --repeat 50 --output parse_benchmark.json
+
+A page failing to parse is recorded as the class of the error raised, so a backend
+raising (or not raising) where the others do not is reported as a mismatch.
+"""
+import argparse
+import json
+import logging as log
+import os
+import sys
+
+from play_scraper import utils
+
+from play_parser import (
+    CARD_PARSER_STAGES,
+    DETAILS_PARSER_STAGES,
+    SOUP_PARSER,
+    prune_data
+)
+from play_profile import StageTimer, PRUNE_STAGE
+from play_stub import FIXTURES_DIR
+
+CORPUS_DIR = os.path.join(FIXTURES_DIR, 'corpus')
+MANIFEST_FILE = 'corpus.json'
+EXPECTED_DIR = 'expected'
+REFERENCE_PARSER = SOUP_PARSER
+DETAILS_PAGE = 'details'
+TREE_STAGE = 'tree'
+EXTRACT_STAGE = 'extract'
+
+def load_corpus(corpus_dir=CORPUS_DIR):
+    with open(os.path.join(corpus_dir, MANIFEST_FILE), encoding='utf-8') as manifest_file:
+        pages = json.load(manifest_file)
+    for page in pages:
+        with open(os.path.join(corpus_dir, page.get('page')), encoding='utf-8') as page_file:
+            page['body'] = page_file.read()
+    return pages
+
+def expected_path(corpus_dir, page):
+    return os.path.join(corpus_dir, EXPECTED_DIR, '{}.json'.format(os.path.splitext(page.get('page'))[0]))
+
+def parser_stages(page):
+    return DETAILS_PARSER_STAGES if page.get('type') == DETAILS_PAGE else CARD_PARSER_STAGES
+
+def parse_page(page, parser, timer):
+    build_document, extract = parser_stages(page)[parser]
+    extract_args = ()
+    if page.get('type') == DETAILS_PAGE:
+        extract_args = (page.get('app_id'), utils.build_url('details', page.get('app_id')))
+    start_time = timer.start()
+    document = build_document(page.get('body'))
+    timer.stop(TREE_STAGE, start_time)
+    start_time = timer.start()
+    data = extract(document, *extract_args)
+    timer.stop(EXTRACT_STAGE, start_time)
+    start_time = timer.start()
+    prune_data(data)
+    timer.stop(PRUNE_STAGE, start_time)
+    return data
+
+def parse_outcome(page, parser):
+    """
+    The pruned output of `parser` for `page` as it reads once stored as json, or the class of the error raised.
+    """
+    try:
+        data = parse_page(page, parser, StageTimer(enabled=False))
+    except Exception as e:
+        return dict(error=type(e).__name__)
+    return json.loads(json.dumps(data))
+
+def _describe_outcome(outcome):
+    if isinstance(outcome, dict) and 'error' in outcome:
+        return 'error: {}'.format(outcome.get('error'))
+    return 'records'
+
+def describe_difference(expected, actual):
+    if 'error' in (_describe_outcome(expected) + _describe_outcome(actual)):
+        return 'expected {} but got {}'.format(_describe_outcome(expected), _describe_outcome(actual))
+    if isinstance(expected, list) and isinstance(actual, list):
+        if len(expected) != len(actual):
+            return 'expected [{}] cards but got [{}]'.format(len(expected), len(actual))
+        for index, (expected_card, actual_card) in enumerate(zip(expected, actual)):
+            if expected_card != actual_card:
+                return 'card [{}]: {}'.format(index, describe_difference(expected_card, actual_card))
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        return '; '.join(
+            '{}: expected {!r} but got {!r}'.format(key, expected.get(key), actual.get(key))
+            for key in sorted(set(expected) | set(actual))
+            if expected.get(key) != actual.get(key)
+        )
+    return 'expected {!r} but got {!r}'.format(expected, actual)
+
+def check_corpus(pages, parsers, corpus_dir=CORPUS_DIR):
+    mismatches = []
+    for page in pages:
+        try:
+            with open(expected_path(corpus_dir, page), encoding='utf-8') as expected_file:
+                expected = json.load(expected_file)
+        except FileNotFoundError:
+            mismatches.append(dict(page=page.get('page'), parser=None, difference='no expected output'))
+            continue
+        for parser in parser_stages(page):
+            if parser not in parsers:
+                continue
+            actual = parse_outcome(page, parser)
+            if actual != expected:
+                mismatches.append(dict(
+                    page=page.get('page'),
+                    parser=parser,
+                    difference=describe_difference(expected, actual)
+                ))
+    return mismatches
+
+def update_expected(pages, corpus_dir=CORPUS_DIR):
+    os.makedirs(os.path.join(corpus_dir, EXPECTED_DIR), exist_ok=True)
+    for page in pages:
+        with open(expected_path(corpus_dir, page), 'w', encoding='utf-8') as expected_file:
+            json.dump(parse_outcome(page, REFERENCE_PARSER), expected_file, indent=2, sort_keys=True, ensure_ascii=False)
+            expected_file.write('\n')
+        log.info('*** updated expected output of page: {} ***'.format(page.get('page')))
+
+def time_corpus(pages, parsers, repeat):
+    """
+    Stage timings per page type and parser, over `repeat` parses of every page of that type.
+    """
+    timers = dict()
+    for page in pages:
+        for parser in parser_stages(page):
+            if parser not in parsers:
+                continue
+            timer = timers.setdefault((page.get('type'), parser), StageTimer(enabled=True))
+            for _ in range(repeat):
+                try:
+                    parse_page(page, parser, timer)
+                except Exception:
+                    # failing pages are reported by the check, the stages reached are still timed
+                    pass
+    timings = dict()
+    for (page_type, parser), timer in timers.items():
+        stages = timer.stats().get('stages')
+        parses = max((stage.get('count') for stage in stages.values()), default=0)
+        timings.setdefault(page_type, dict())[parser] = dict(
+            parses=parses,
+            ms_per_page=round(sum(stage.get('total') for stage in stages.values()) / parses * 1000, 3) if parses else None,
+            stages=stages
+        )
+    return timings
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Parser micro-benchmark and regression check over the saved page corpus')
+    parser.add_argument('--corpus', default=CORPUS_DIR, help='directory of the pages and of their manifest')
+    parser.add_argument('--parsers', default=','.join(CARD_PARSER_STAGES), help='comma separated card parsers to run')
+    parser.add_argument('--repeat', type=int, default=20, help='parses of every page per parser, 0 only checks')
+    parser.add_argument('--update-expected', action='store_true', help='rewrite the expected outputs with the reference parser')
+    parser.add_argument('--output', help='also write the report to this json file')
+    parser.add_argument('--log-level', default='WARNING')
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    log.basicConfig(level=args.log_level.upper())
+    parsers = [parser.strip() for parser in args.parsers.split(',') if parser.strip()]
+    unknown_parsers = [parser for parser in parsers if parser not in CARD_PARSER_STAGES]
+    if unknown_parsers:
+        print('unknown parsers: {}, must be among {}'.format(unknown_parsers, list(CARD_PARSER_STAGES)))
+        sys.exit(2)
+    # the details pages only have the reference parser
+    parsers.append(REFERENCE_PARSER)
+    pages = load_corpus(args.corpus)
+    if args.update_expected:
+        update_expected(pages, args.corpus)
+    report = dict(
+        pages=len(pages),
+        mismatches=check_corpus(pages, parsers, args.corpus),
+        timings=time_corpus(pages, parsers, args.repeat) if args.repeat > 0 else None
+    )
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    sys.exit(1 if report.get('mismatches') else 0)
@@ -0,0 +1,243 @@
+"""
+Contains the card list parsers used for collection, similar and search responses.
+"""
+import multiprocessing
+import threading
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup, SoupStrainer
+from lxml import etree, html
+from play_scraper import utils, settings
+
+from play_helper import PARSE_POOL_SIZE
+from play_logging import child_log_queue, setup_child_logging, log_levels
+
+log = logging.getLogger(__name__)
+
+UNWANTED_KEYS = [
+    'description_html',
+    'screenshots',
+    'video'
+]
+
+SOUP_PARSER = 'soup'
+STRAINER_PARSER = 'strainer'
+LXML_PARSER = 'lxml'
+
+CARD_SELECTOR = 'div[data-uitype="500"]'
+CARD_STRAINER = SoupStrainer('div', attrs={'data-uitype': '500'})
+
+def _first_with_class_xpath(tag, css_class):
+    return etree.XPath('(.//{tag}[contains(concat(" ", normalize-space(@class), " "), " {css_class} ")])[1]'.format(
+        tag=tag,
+        css_class=css_class
+    ))
+
+CARD_XPATH = etree.XPath('//div[@data-uitype="500"]')
+CLICK_TARGET_XPATH = _first_with_class_xpath('a', 'card-click-target')
+COVER_IMAGE_XPATH = _first_with_class_xpath('img', 'cover-image')
+TITLE_XPATH = _first_with_class_xpath('a', 'title')
+SUBTITLE_XPATH = _first_with_class_xpath('a', 'subtitle')
+DESCRIPTION_XPATH = _first_with_class_xpath('div', 'description')
+TINY_STAR_XPATH = _first_with_class_xpath('div', 'tiny-star')
+DISPLAY_PRICE_XPATH = _first_with_class_xpath('span', 'display-price')
+PRICE_XPATH = _first_with_class_xpath('a', 'price')
+FULL_PRICE_XPATH = _first_with_class_xpath('span', 'full-price')
+
+def _first(xpath, node):
+    matches = xpath(node)
+    return matches[0] if matches else None
+
+def parse_lxml_card_info(card):
+    """
+    Mirrors `play_scraper.utils.parse_card_info` on an lxml element,
+    including which missing nodes raise and which fall back to None.
+    """
+    app_id = card.attrib['data-docid']
+    url = urljoin(settings.BASE_URL, _first(CLICK_TARGET_XPATH, card).attrib['href'])
+    icon = urljoin(
+        settings.BASE_URL,
+        _first(COVER_IMAGE_XPATH, card).attrib['src'].split('=')[0])
+    title = _first(TITLE_XPATH, card).attrib['title']
+
+    dev_node = _first(SUBTITLE_XPATH, card)
+    developer = dev_node.attrib['title']
+    try:
+        developer_id = dev_node.attrib['href'].split('=')[1]
+    except IndexError:
+        developer_id = None
+
+    description = _first(DESCRIPTION_XPATH, card).text_content().strip()
+    score = _first(TINY_STAR_XPATH, card)
+    if score is not None:
+        score = score.attrib['aria-label'].strip().split(' ')[1]
+
+    price_node = _first(DISPLAY_PRICE_XPATH, card)
+    if price_node is None:
+        price_node = _first(PRICE_XPATH, card)
+    price = None if price_node is None else price_node.text_content()
+
+    full_price = None
+    if price is not None:
+        full_price_node = _first(FULL_PRICE_XPATH, card)
+        full_price = None if full_price_node is None else full_price_node.text_content()
+
+    free = (price is None)
+    if free is True:
+        price = '0'
+
+    return {
+        'app_id': app_id,
+        'url': url,
+        'icon': icon,
+        'title': title,
+        'developer': developer,
+        'developer_id': developer_id,
+        'description': description,
+        'score': score,
+        'full_price': full_price,
+        'price': price,
+        'free': free
+    }
+
+def _soup_document(response):
+    return BeautifulSoup(response, 'lxml')
+
+def _strained_document(response):
+    return BeautifulSoup(response, 'lxml', parse_only=CARD_STRAINER)
+
+def _extract_soup_cards(document):
+    return list(map(utils.parse_card_info, document.select(CARD_SELECTOR)))
+
+def _lxml_document(response):
+    if isinstance(response, str):
+        response = response.encode('utf-8')
+    if not response.strip():
+        return None
+    # a fresh parser per call, lxml parsers must not be shared between the manager threads
+    return html.document_fromstring(response, parser=html.HTMLParser(encoding='utf-8'))
+
+def _extract_lxml_cards(document):
+    if document is None:
+        return []
+    return list(map(parse_lxml_card_info, CARD_XPATH(document)))
+
+def _parse_soup_cards(response):
+    return _extract_soup_cards(_soup_document(response))
+
+def _parse_strained_cards(response):
+    return _extract_soup_cards(_strained_document(response))
+
+def _parse_lxml_cards(response):
+    return _extract_lxml_cards(_lxml_document(response))
+
+CARD_PARSERS = {
+    SOUP_PARSER: _parse_soup_cards,
+    STRAINER_PARSER: _parse_strained_cards,
+    LXML_PARSER: _parse_lxml_cards
+}
+
+# every card parser as its two stages: building the document tree, then extracting the cards from it
+CARD_PARSER_STAGES = {
+    SOUP_PARSER: (_soup_document, _extract_soup_cards),
+    STRAINER_PARSER: (_strained_document, _extract_soup_cards),
+    LXML_PARSER: (_lxml_document, _extract_lxml_cards)
+}
+
+def parse_cards(response, parser=LXML_PARSER):
+    card_parser = CARD_PARSERS.get(parser)
+    if card_parser is None:
+        raise ValueError('INVALID_CARD_PARSER: {parser}. Must be one of {parsers}'.format(
+            parser=parser,
+            parsers=list(CARD_PARSERS.keys())
+        ))
+    return card_parser(response)
+
+def prune_data(data):
+    """
+    Drops the UNWANTED_KEYS in place, the parsed dicts are never shared so there is no need to copy them.
+    """
+    if isinstance(data, dict):
+        for key in UNWANTED_KEYS:
+            data.pop(key, None)
+    elif isinstance(data, list):
+        for item in data:
+            prune_data(item)
+    return data
+
+def _extract_details(document, app_id, url):
+    app_json = utils.parse_app_details(document)
+    app_json.update({
+        'app_id': app_id,
+        'url': url
+    })
+    return app_json
+
+def _parse_unpruned_details(response, app_id, url):
+    return _extract_details(_soup_document(response), app_id, url)
+
+DETAILS_PARSER_STAGES = {
+    SOUP_PARSER: (_soup_document, _extract_details)
+}
+
+def parse_details(response, app_id, url):
+    return prune_data(_parse_unpruned_details(response, app_id, url))
+
+def parse_card_list(response, parser=LXML_PARSER):
+    return prune_data(parse_cards(response, parser))
+
+UNPRUNED_PARSERS = {
+    parse_details: _parse_unpruned_details,
+    parse_card_list: parse_cards
+}
+
+def run_timed(parse_function, *args):
+    """
+    Same as `parse_function(*args)`, also returning the seconds spent on parsing and on pruning;
+    picklable, so that the stages can be timed in the parse pool as well.
+    """
+    start_time = time.perf_counter()
+    data = UNPRUNED_PARSERS[parse_function](*args)
+    parsed_time = time.perf_counter()
+    prune_data(data)
+    return data, parsed_time - start_time, time.perf_counter() - parsed_time
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+def spawn_pool(size):
+    """
+    Process pool of `size` processes forwarding their log records to the server's log file. The
+    processes are spawned, as forking the server would copy the locks held by its other threads.
+    """
+    context = multiprocessing.get_context('spawn')
+    # the processes keep the log levels set at start
+    return ProcessPoolExecutor(
+        max_workers=size,
+        mp_context=context,
+        initializer=setup_child_logging,
+        initargs=(child_log_queue(context), log_levels())
+    )
+
+def get_parse_pool(size=PARSE_POOL_SIZE):
+    """
+    Process pool shared by every manager offloading its parsing, created on first use.
+    Only the raw html goes to the pool and only the pruned dicts come back.
+    """
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            log.info('*** starting parse pool with [{}] processes ***'.format(size))
+            _parse_pool = spawn_pool(size)
+        return _parse_pool
+
+def shutdown_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            log.info('*** shutting down parse pool ***')
+            _parse_pool.shutdown(wait=True)
+            _parse_pool = None
@@ -0,0 +1,547 @@
+"""
+Contains the process based execution of managers.
+
+Each manager runs on the event loop of its own (spawned) worker process, which
+reports its peek results back to the server every STATUS_REPORT_INTERVAL
+seconds and serves the peek / stop / flush commands sent over a pipe. The
+server keeps a ProcessPlayManager in place of the manager, which mirrors the
+parts of the PlayManager interface used by the REST API; a sharded DISCOVER
+manager is a ShardedPlayManager coordinating one ProcessPlayManager per shard.
+"""
+import asyncio
+import itertools
+import multiprocessing
+import os
+import threading
+import logging
+
+from play_helper import STATUS_REPORT_INTERVAL, RECORD_PAGE_SIZE
+from play_logging import setup_logging, stop_logging, log_settings, configure_log_levels
+from play_cache import response_cache
+from play_limiter import rate_limiter
+from play_parser import shutdown_parse_pool
+from play_shard import LocalShardTransport, shard_opt_path
+from play_listing import output_files, page_ids, page_records
+from play_manager import (
+    InitiatedPlayManager,
+    CANCELLED_STATUSES,
+    CLOSED_STATUSES
+)
+
+log = logging.getLogger(__name__)
+
+THREAD_EXECUTION = 'thread'
+PROCESS_EXECUTION = 'process'
+EXECUTIONS = [THREAD_EXECUTION, PROCESS_EXECUTION]
+
+STATUS_MESSAGE = 'STATUS'
+REPLY_MESSAGE = 'REPLY'
+
+PEEK_COMMAND = 'PEEK'
+STOP_COMMAND = 'STOP'
+FLUSH_COMMAND = 'FLUSH'
+METRICS_COMMAND = 'METRICS'
+TIMING_COMMAND = 'TIMING'
+PROFILE_COMMAND = 'PROFILE'
+LOG_LEVELS_COMMAND = 'LOG_LEVELS'
+LIMITER_COMMAND = 'LIMITER'
+
+class ManagerProcessError(RuntimeError):
+    pass
+
+def process_log_file_path(log_file_path, manager_id):
+    return '{}_{}.log'.format(os.path.splitext(log_file_path)[0], manager_id)
+
+class ManagerChannel():
+    """
+    Worker process side of the pipe: commands are read on a thread and run on the
+    manager's loop, which is the only thread sending messages back.
+    """
+    def __init__(self, connection, loop, manager_info_map, manager_id):
+        self._connection = connection
+        self._loop = loop
+        self._manager_info_map = manager_info_map
+        self._manager_id = manager_id
+
+    def _manager(self):
+        return self._manager_info_map.get(self._manager_id)
+
+    def send(self, message):
+        try:
+            self._connection.send(message)
+        except (OSError, ValueError):
+            log.warning('### failed to report to server for manager: {} ###'.format(self._manager_id))
+
+    async def report_status(self):
+        while True:
+            self.send((STATUS_MESSAGE, self._manager().peek()))
+            await asyncio.sleep(STATUS_REPORT_INTERVAL)
+
+    async def _handle(self, request_id, command, kwargs):
+        manager = self._manager()
+        try:
+            if command == LOG_LEVELS_COMMAND:
+                # the loggers belong to the process, not to the manager
+                result = configure_log_levels(**kwargs)
+            elif command == LIMITER_COMMAND:
+                # so does the rate limiter
+                rate_limiter.configure(**kwargs)
+                result = rate_limiter.stats()
+            elif manager.status == 'INITIATED':
+                raise ManagerProcessError('MANAGER_NOT_FULLY_INITIATED')
+            elif command == PEEK_COMMAND:
+                result = manager.peek(**kwargs)
+            elif command == STOP_COMMAND:
+                result = await manager.shutdown(**kwargs) if not manager.is_cancelled() else manager.peek()
+            elif command == FLUSH_COMMAND:
+                result = (await manager.checkpoint(), manager.peek())
+            elif command == METRICS_COMMAND:
+                result = manager.metrics_snapshot()
+            elif command == TIMING_COMMAND:
+                result = await manager.configure_timing(**kwargs)
+            elif command == PROFILE_COMMAND:
+                result = await manager.profile(**kwargs)
+            else:
+                raise ManagerProcessError('UNKNOWN_COMMAND: {}'.format(command))
+        except Exception as e:
+            log.exception('@@@ failed to handle command: {} for manager: {} @@@'.format(command, self._manager_id))
+            self.send((REPLY_MESSAGE, request_id, repr(e), None))
+        else:
+            self.send((REPLY_MESSAGE, request_id, None, result))
+
+    async def _stop_orphaned_manager(self):
+        manager = self._manager()
+        if manager.status != 'INITIATED' and not manager.is_cancelled():
+            await manager.shutdown()
+
+    def serve(self):
+        while True:
+            try:
+                request_id, command, kwargs = self._connection.recv()
+            except (EOFError, OSError):
+                log.warning('### lost server connection, stopping manager: {} ###'.format(self._manager_id))
+                asyncio.run_coroutine_threadsafe(self._stop_orphaned_manager(), self._loop)
+                return
+            asyncio.run_coroutine_threadsafe(self._handle(request_id, command, kwargs), self._loop)
+
+def run_manager_process(manager_id, settings, connection, log_file_path, limiter_settings, cache_settings,
+        logging_settings, shard_transport=None):
+    """
+    Entry point of a worker process, returns once the manager is shut down and its data dumped.
+    """
+    setup_logging(log_file_path, **logging_settings)
+    log.info('*** starting worker process: {} for manager: {} ***'.format(os.getpid(), manager_id))
+    rate_limiter.configure(**limiter_settings)
+    response_cache.configure(**cache_settings)
+
+    manager_info_map = {manager_id: InitiatedPlayManager(manager_id, **settings)}
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    channel = ManagerChannel(connection, loop, manager_info_map, manager_id)
+    loop.create_task(manager_info_map[manager_id].activate(manager_info_map, shard_transport=shard_transport))
+    status_task = loop.create_task(channel.report_status())
+    threading.Thread(target=channel.serve, name='manager-channel', daemon=True).start()
+    # the manager stops the loop once it is shut down
+    loop.run_forever()
+
+    status_task.cancel()
+    channel.send((STATUS_MESSAGE, manager_info_map[manager_id].peek(show_records=True)))
+    try:
+        loop.close()
+    except:
+        log.exception('@@@ failed to close loop for manager: {} @@@'.format(manager_id))
+    shutdown_parse_pool()
+    connection.close()
+    log.info('*** worker process: {} for manager: {} exited ***'.format(os.getpid(), manager_id))
+    # atexit does not run in worker processes
+    stop_logging()
+
+def limiter_share(worker_count):
+    """
+    Rate limit settings of one of `worker_count` worker processes sharing the rate limit configured on the server.
+    """
+    limiter_settings = rate_limiter.stats()
+    return dict(
+        rate=limiter_settings.get('rate') / worker_count,
+        burst=max(limiter_settings.get('burst') // worker_count, 1)
+    )
+
+class ProcessPlayManager():
+    """
+    Server side handle of a manager running in a worker process.
+    `peek` answers from the latest status reported by the process.
+    """
+    is_delegated = True
+
+    def __init__(self, initiated_manager, log_file_path, shard_transport=None):
+        self.id = initiated_manager.id
+        self.status = initiated_manager.status
+        self.store = initiated_manager.store
+        self.logfile = process_log_file_path(log_file_path, self.id)
+        self._settings = initiated_manager.settings()
+        self._shard_transport = shard_transport
+        self._status = initiated_manager.peek()
+        self._pending = dict()
+        self._request_ids = itertools.count()
+        self._process = None
+        self._connection = None
+        self._loop = None
+        self._metrics = None
+
+    worker_count = 1
+
+    def start(self, limiter_settings=None):
+        context = multiprocessing.get_context('spawn')
+        self._connection, child_connection = context.Pipe()
+        self._loop = asyncio.get_event_loop()
+        self._process = context.Process(
+            target=run_manager_process,
+            name='manager-{}'.format(self.id),
+            args=(
+                self.id,
+                self._settings,
+                child_connection,
+                self.logfile,
+                limiter_settings or limiter_share(1),
+                dict(enabled=response_cache.enabled, max_size=response_cache.max_size, ttls=response_cache.ttls),
+                log_settings(),
+                self._shard_transport
+            )
+        )
+        self._process.start()
+        child_connection.close()
+        threading.Thread(
+            target=self._read_messages,
+            name='manager-{}-reader'.format(self.id),
+            daemon=True
+        ).start()
+        log.info('*** started worker process: {} for manager: {} ***'.format(self._process.pid, self.id))
+        return self
+
+    def is_cancelled(self):
+        return self.status in CANCELLED_STATUSES
+
+    def is_alive(self):
+        return self._process is not None and self._process.is_alive()
+
+    def _update_status(self, status):
+        self._status = status
+        self.status = status.get('status', self.status)
+
+    def _resolve(self, request_id, error, result):
+        future = self._pending.pop(request_id, None)
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(ManagerProcessError(error))
+        else:
+            future.set_result(result)
+
+    def _read_messages(self):
+        while True:
+            try:
+                message = self._connection.recv()
+            except (EOFError, OSError):
+                break
+            if message[0] == STATUS_MESSAGE:
+                self._update_status(message[1])
+            elif message[0] == REPLY_MESSAGE:
+                self._loop.call_soon_threadsafe(self._resolve, *message[1:])
+        self._process.join()
+        if self.status not in CLOSED_STATUSES:
+            log.error('@@@ worker process of manager: {} exited with code: {} @@@'.format(
+                self.id,
+                self._process.exitcode
+            ))
+            self._update_status(dict(
+                self._status,
+                status='CORRUPTED',
+                failures=self._status.get('failures', []) + ['PROCESS_EXITED']
+            ))
+        for request_id in list(self._pending.keys()):
+            self._loop.call_soon_threadsafe(self._resolve, request_id, 'PROCESS_EXITED', None)
+
+    async def _request(self, command, **kwargs):
+        if not self.is_alive():
+            raise ManagerProcessError('PROCESS_EXITED')
+        request_id = next(self._request_ids)
+        future = self._loop.create_future()
+        self._pending[request_id] = future
+        try:
+            self._connection.send((request_id, command, kwargs))
+        except (OSError, ValueError):
+            # the worker exited after its last status, before is_alive noticed
+            self._pending.pop(request_id, None)
+            raise ManagerProcessError('PROCESS_EXITED')
+        return await future
+
+    def peek(self, show_records=False):
+        opt = dict(self._status)
+        records = opt.pop('records', None)
+        if show_records:
+            opt['records'] = records or []
+        opt.update(dict(
+            execution=PROCESS_EXECUTION,
+            worker_pid=self._process.pid if self._process else None,
+            worker_logfile=self.logfile
+        ))
+        return opt
+
+    def record_ids(self):
+        # only the last status of the worker, sent once its records are dumped, lists them
+        return self._status.get('records') or []
+
+    def record_files(self):
+        return output_files(self._status.get('optfile') or self._status.get('checkpoint'))
+
+    def list_records(self, position=None, limit=RECORD_PAGE_SIZE, full_records=False):
+        """
+        Same as `PlayManager.list_records`, the output files being read by the server itself.
+        """
+        if full_records:
+            return page_records(self.record_files(), position, limit)
+        return page_ids([self.record_ids()], position, limit)
+
+    async def shutdown(self, is_completed=False, wait=False, callback=None):
+        if not self.is_cancelled() and self.is_alive():
+            log.info('*** stopping worker process of manager: {} ***'.format(self.id))
+            self._update_status(await self._request(STOP_COMMAND, is_completed=is_completed))
+        if wait:
+            await self.join()
+        return self.peek()
+
+    async def refresh_status(self, show_records=False):
+        self._update_status(await self._request(PEEK_COMMAND, show_records=show_records))
+        return self.peek(show_records=show_records)
+
+    async def request_checkpoint(self):
+        flushed_ids, status = await self._request(FLUSH_COMMAND)
+        self._update_status(status)
+        return flushed_ids
+
+    async def collect_metrics(self):
+        """
+        Metrics of the worker process; once it exited, the last collected ones (if any) marked down.
+        """
+        try:
+            self._metrics = await self._request(METRICS_COMMAND)
+        except ManagerProcessError:
+            if self._metrics is None:
+                return []
+            self._metrics['up'] = int(self.is_alive() and self.status == 'RUNNING')
+        return [self._metrics]
+
+    async def configure_timing(self, enabled=None, reset=False):
+        return await self._request(TIMING_COMMAND, enabled=enabled, reset=reset)
+
+    async def profile(self, seconds):
+        return await self._request(PROFILE_COMMAND, seconds=seconds)
+
+    async def configure_log_levels(self, levels):
+        return await self._request(LOG_LEVELS_COMMAND, levels=levels)
+
+    async def configure_limiter(self, rate=None, burst=None):
+        return await self._request(LIMITER_COMMAND, rate=rate, burst=burst)
+
+    async def join(self):
+        if self._process is not None:
+            await self._loop.run_in_executor(None, self._process.join)
+
+class ShardedPlayManager():
+    """
+    Coordinator of a DISCOVER manager split into `shard_count` worker processes, each
+    owning the apps (and collections) hashing into its partition. Every shard reports
+    the apps it routed and received; the crawl is complete once every shard is idle,
+    the totals match and they did not change since the previous round.
+    """
+    is_delegated = True
+
+    def __init__(self, initiated_manager, log_file_path, shard_count):
+        self.id = initiated_manager.id
+        self.process_type = initiated_manager.process_type
+        self.store = initiated_manager.store
+        self.shard_count = shard_count
+        self._initiated_manager = initiated_manager
+        self._log_file_path = log_file_path
+        self._is_stopping = False
+        self._monitor_task = None
+        self.shards = []
+        self.logfile = []
+
+    @property
+    def worker_count(self):
+        return self.shard_count
+
+    def start(self, limiter_settings=None):
+        """
+        Starts every shard with `limiter_settings` (by default, its share of the configured rate limit).
+        """
+        limiter_settings = limiter_settings or limiter_share(self.shard_count)
+        context = multiprocessing.get_context('spawn')
+        queues = [context.Queue() for _ in range(self.shard_count)]
+        settings = self._initiated_manager.settings()
+        for shard_index in range(self.shard_count):
+            shard_manager = InitiatedPlayManager(
+                '{}-{}'.format(self.id, shard_index),
+                **dict(
+                    settings,
+                    opt_path=shard_opt_path(settings.get('opt_path'), shard_index),
+                    shard_index=shard_index,
+                    shard_count=self.shard_count
+                )
+            )
+            shard = ProcessPlayManager(
+                shard_manager,
+                self._log_file_path,
+                shard_transport=LocalShardTransport(queues, shard_index)
+            )
+            self.shards.append(shard.start(limiter_settings=limiter_settings))
+        self.logfile = [shard.logfile for shard in self.shards]
+        self._monitor_task = asyncio.get_event_loop().create_task(self._monitor())
+        log.info('*** started [{}] shards for manager: {} ***'.format(self.shard_count, self.id))
+        return self
+
+    @property
+    def status(self):
+        statuses = [shard.status for shard in self.shards]
+        if not statuses:
+            return 'INITIATED'
+        if all(status in CLOSED_STATUSES for status in statuses):
+            for status in ['CORRUPTED', 'TERMINATED']:
+                if status in statuses:
+                    return status
+            return 'COMPLETED'
+        if self._is_stopping or any(status in CANCELLED_STATUSES for status in statuses):
+            return 'SHUTDOWN_INITIATED'
+        return 'INITIATED' if 'INITIATED' in statuses else 'RUNNING'
+
+    def is_cancelled(self):
+        return self.status in CANCELLED_STATUSES
+
+    def is_alive(self):
+        return any(shard.is_alive() for shard in self.shards)
+
+    @staticmethod
+    def _routing_counts(statuses):
+        """
+        Per shard routing counters when every shard is idle with nothing in flight, None otherwise.
+        """
+        if any(status.get('pending_entries') or status.get('active_entries') for status in statuses):
+            return None
+        counts = tuple((status.get('shard_sent', 0), status.get('shard_received', 0)) for status in statuses)
+        if sum(sent for sent, _ in counts) != sum(received for _, received in counts):
+            return None
+        return counts
+
+    async def _monitor(self):
+        previous_counts = None
+        while not self.is_cancelled():
+            await asyncio.sleep(STATUS_REPORT_INTERVAL)
+            if self.is_cancelled():
+                break
+            if any(shard.status == 'CORRUPTED' for shard in self.shards):
+                log.error('@@@ a shard of manager: {} failed, stopping the others @@@'.format(self.id))
+                await self.shutdown()
+                break
+            try:
+                statuses = await asyncio.gather(*[shard.refresh_status() for shard in self.shards])
+            except ManagerProcessError:
+                previous_counts = None
+                continue
+            counts = self._routing_counts(statuses)
+            if counts is not None and counts == previous_counts:
+                log.info('*** every shard of manager: {} is drained ***'.format(self.id))
+                await self.shutdown(is_completed=True)
+                break
+            previous_counts = counts
+
+    def peek(self, show_records=False):
+        shard_statuses = [shard.peek(show_records=show_records) for shard in self.shards]
+        sum_of = lambda key: sum(status.get(key) or 0 for status in shard_statuses)
+        opt = dict(
+            process_id=self.id,
+            process_type=self.process_type,
+            status=self.status,
+            execution=PROCESS_EXECUTION,
+            shard_count=self.shard_count,
+            records_collected=sum_of('records_collected'),
+            records_flushed=sum_of('records_flushed'),
+            records_visited=sum_of('records_visited'),
+            records_routed=sum_of('shard_sent'),
+            shards=[
+                {key: value for key, value in status.items() if key != 'records'}
+                for status in shard_statuses
+            ]
+        )
+        if show_records:
+            opt['records'] = list(itertools.chain.from_iterable(
+                status.get('records') or [] for status in shard_statuses
+            ))
+        return opt
+
+    def list_records(self, position=None, limit=RECORD_PAGE_SIZE, full_records=False):
+        """
+        Pages over the records of every shard, one shard after the other.
+        """
+        if full_records:
+            # the shards of a sqlite manager share their store
+            files = dict.fromkeys(itertools.chain.from_iterable(shard.record_files() for shard in self.shards))
+            return page_records(list(files), position, limit)
+        return page_ids([shard.record_ids() for shard in self.shards], position, limit)
+
+    async def shutdown(self, is_completed=False, wait=False, callback=None):
+        self._is_stopping = True
+        results = await asyncio.gather(*[
+            shard.shutdown(is_completed=is_completed, wait=wait)
+            for shard in self.shards
+        ], return_exceptions=True)
+        for shard, result in zip(self.shards, results):
+            if isinstance(result, Exception):
+                log.error('@@@ failed to stop shard: {}, cause is: {!r} @@@'.format(shard.id, result))
+        return self.peek()
+
+    async def refresh_status(self, show_records=False):
+        await asyncio.gather(*[
+            shard.refresh_status(show_records=show_records)
+            for shard in self.shards
+            if shard.is_alive()
+        ])
+        return self.peek(show_records=show_records)
+
+    async def request_checkpoint(self):
+        flushed_ids = await asyncio.gather(*[shard.request_checkpoint() for shard in self.shards])
+        return list(itertools.chain.from_iterable(flushed_ids))
+
+    async def collect_metrics(self):
+        metrics = await asyncio.gather(*[shard.collect_metrics() for shard in self.shards])
+        return list(itertools.chain.from_iterable(metrics))
+
+    async def configure_timing(self, enabled=None, reset=False):
+        stats = await asyncio.gather(*[
+            shard.configure_timing(enabled=enabled, reset=reset)
+            for shard in self.shards
+        ])
+        return dict(shards={shard.id: shard_stats for shard, shard_stats in zip(self.shards, stats)})
+
+    async def configure_log_levels(self, levels):
+        shard_levels = await asyncio.gather(*[shard.configure_log_levels(levels) for shard in self.shards])
+        return dict(shards={shard.id: levels_of_shard for shard, levels_of_shard in zip(self.shards, shard_levels)})
+
+    async def configure_limiter(self, rate=None, burst=None):
+        shards = [shard for shard in self.shards if shard.is_alive()]
+        shard_limiters = await asyncio.gather(*[shard.configure_limiter(rate=rate, burst=burst) for shard in shards])
+        return dict(shards={shard.id: shard_limiter for shard, shard_limiter in zip(shards, shard_limiters)})
+
+    async def profile(self, seconds):
+        """
+        Profiles every shard at once, the stacks of each shard being rooted at its id.
+        """
+        shard_counts = await asyncio.gather(*[shard.profile(seconds) for shard in self.shards])
+        return {
+            '{};{}'.format(shard.id, stack): count
+            for shard, stack_counts in zip(self.shards, shard_counts)
+            for stack, count in stack_counts.items()
+        }
+
+    async def join(self):
+        await asyncio.gather(*[shard.join() for shard in self.shards])
@@ -0,0 +1,108 @@
+"""
+Contains the stage timer and the sampling profiler used for finding where a manager spends its time.
+
+The StageTimer of a manager (kept by its PlayFetch) accumulates the time spent in
+each stage of the hot path: rate limiting, network, parsing, pruning, the parse
+pool round trip, dedupe, flushing, dumping and snapshotting. It is off by default
+and can be switched on and off at runtime; while off, a stage costs one attribute
+check. The profiler samples the stack of the thread running a manager's loop and
+returns it in the collapsed (folded) format read by flamegraph.pl and speedscope.
+"""
+import os
+import sys
+import time
+
+from play_helper import (
+    STAGE_TIMING_ENABLED,
+    PROFILE_SAMPLE_INTERVAL
+)
+
+RATE_LIMIT_STAGE = 'rate_limit'
+NETWORK_STAGE = 'network'
+PARSE_STAGE = 'parse'
+PRUNE_STAGE = 'prune'
+PARSE_POOL_STAGE = 'parse_pool'
+DEDUPE_STAGE = 'dedupe'
+FLUSH_STAGE = 'flush'
+DUMP_STAGE = 'dump'
+SNAPSHOT_STAGE = 'snapshot'
+
+class StageTimer():
+    def __init__(self, enabled=STAGE_TIMING_ENABLED):
+        self.enabled = enabled
+        self._stages = dict()
+        self._since = time.time()
+
+    def start(self):
+        return time.perf_counter() if self.enabled else None
+
+    def stop(self, stage, start_time):
+        if start_time is not None:
+            self.record(stage, time.perf_counter() - start_time)
+
+    def record(self, stage, elapsed):
+        stats = self._stages.get(stage)
+        if stats is None:
+            stats = self._stages[stage] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += elapsed
+        if elapsed > stats[2]:
+            stats[2] = elapsed
+
+    def configure(self, enabled=None, reset=False):
+        if reset or (enabled and not self.enabled):
+            self._stages = dict()
+            self._since = time.time()
+        if enabled is not None:
+            self.enabled = enabled
+        return self.stats()
+
+    def stats(self):
+        """
+        Count, total, mean and max seconds per stage; the stages of concurrent requests overlap,
+        so their totals can add up to more than the time elapsed.
+        """
+        return dict(
+            enabled=self.enabled,
+            since=self._since,
+            elapsed=time.time() - self._since,
+            stages={
+                stage: dict(
+                    count=count,
+                    total=round(total, 6),
+                    mean=round(total / count, 6),
+                    max=round(longest, 6)
+                )
+                for stage, (count, total, longest) in sorted(self._stages.items(), key=lambda item: -item[1][1])
+            }
+        )
+
+def _frame_name(frame):
+    code = frame.f_code
+    return '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+def sample_thread(thread_id, seconds, interval=PROFILE_SAMPLE_INTERVAL):
+    """
+    Samples the stack of `thread_id` every `interval` for `seconds`, returns the count of every stack seen.
+    Blocking, so it runs on a thread of its own.
+    """
+    stack_counts = dict()
+    end_time = time.monotonic() + seconds
+    while time.monotonic() < end_time:
+        frame = sys._current_frames().get(thread_id)
+        if frame is None:
+            break
+        stack = []
+        while frame is not None:
+            stack.append(_frame_name(frame))
+            frame = frame.f_back
+        stack = ';'.join(reversed(stack))
+        stack_counts[stack] = stack_counts.get(stack, 0) + 1
+        time.sleep(interval)
+    return stack_counts
+
+def folded_profile(stack_counts):
+    return ''.join('{} {}\n'.format(stack, count) for stack, count in sorted(
+        stack_counts.items(),
+        key=lambda item: -item[1]
+    ))
@@ -0,0 +1,141 @@
+"""
+Contains the columnar record store backing the info maps of the managers.
+"""
+import sys
+from array import array
+
+from play_scraper import settings
+
+INTERNED_FIELDS = frozenset([
+    'developer',
+    'developer_id',
+    'developer_email',
+    'developer_url',
+    'developer_address',
+    'price',
+    'full_price',
+    'score',
+    'installs',
+    'size',
+    'updated',
+    'current_version',
+    'required_android_version',
+    'iap_range',
+    'category'
+])
+
+DETAILS_URL_PREFIX = '{}/details?id='.format(settings.BASE_URL)
+NO_RECORD_SCHEMA = 0
+DERIVED_VALUE = object()
+
+class RecordStore():
+    """
+    Mapping of app_id to record which keeps the records by column instead of one dict each.
+
+    Every distinct key order is stored once as a schema, so records read back as dicts
+    with the same keys in the same order and serialise to the same json as the dicts
+    they were built from. Repeated values of INTERNED_FIELDS share one string and
+    `url`/`app_id` are not stored when they can be derived from the app_id.
+    Records are copies: mutate a record and assign it back to update the store.
+    """
+    def __init__(self, interned_fields=INTERNED_FIELDS):
+        self._interned_fields = interned_fields
+        self._index = dict()
+        self._schemas = [()]
+        self._schema_ids = dict()
+        self._row_schemas = array('H')
+        self._columns = dict()
+        self._free_rows = []
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, app_id):
+        return app_id in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def keys(self):
+        return self._index.keys()
+
+    def _schema_id(self, keys):
+        schema_id = self._schema_ids.get(keys)
+        if schema_id is None:
+            schema_id = len(self._schemas)
+            self._schemas.append(keys)
+            self._schema_ids[keys] = schema_id
+            for key in keys:
+                if key not in self._columns:
+                    self._columns[key] = [None] * len(self._row_schemas)
+        return schema_id
+
+    def _allocate_row(self):
+        if self._free_rows:
+            return self._free_rows.pop()
+        self._row_schemas.append(NO_RECORD_SCHEMA)
+        for column in self._columns.values():
+            column.append(None)
+        return len(self._row_schemas) - 1
+
+    def _clear_row(self, row):
+        for key in self._schemas[self._row_schemas[row]]:
+            self._columns[key][row] = None
+        self._row_schemas[row] = NO_RECORD_SCHEMA
+
+    def _compact_value(self, app_id, key, value):
+        if key == 'app_id' and value == app_id:
+            return DERIVED_VALUE
+        elif key == 'url' and isinstance(value, str) and value == DETAILS_URL_PREFIX + app_id:
+            return DERIVED_VALUE
+        elif key in self._interned_fields and isinstance(value, str):
+            return sys.intern(value)
+        return value
+
+    def _expand_value(self, app_id, key, value):
+        if value is not DERIVED_VALUE:
+            return value
+        return app_id if key == 'app_id' else DETAILS_URL_PREFIX + app_id
+
+    def __setitem__(self, app_id, record):
+        row = self._index.get(app_id)
+        if row is None:
+            row = self._allocate_row()
+            self._index[app_id] = row
+        else:
+            self._clear_row(row)
+        if record is None:
+            return
+        schema_id = self._schema_id(tuple(record.keys()))
+        self._row_schemas[row] = schema_id
+        for key, value in record.items():
+            self._columns[key][row] = self._compact_value(app_id, key, value)
+
+    def _materialize(self, app_id, row):
+        schema_id = self._row_schemas[row]
+        if schema_id == NO_RECORD_SCHEMA:
+            return None
+        return {
+            key: self._expand_value(app_id, key, self._columns[key][row])
+            for key in self._schemas[schema_id]
+        }
+
+    def __getitem__(self, app_id):
+        return self._materialize(app_id, self._index[app_id])
+
+    def get(self, app_id, default=None):
+        row = self._index.get(app_id)
+        return default if row is None else self._materialize(app_id, row)
+
+    def __delitem__(self, app_id):
+        row = self._index.pop(app_id)
+        self._clear_row(row)
+        self._free_rows.append(row)
+
+    def values(self):
+        for app_id, row in self._index.items():
+            yield self._materialize(app_id, row)
+
+    def items(self):
+        for app_id, row in self._index.items():
+            yield app_id, self._materialize(app_id, row)
@@ -0,0 +1,124 @@
+"""
+Contains the retry policy and circuit breaker used by the managers around PlayFetch calls.
+"""
+import asyncio
+import random
+import time
+import logging
+
+from aiohttp import (
+    ClientConnectionError,
+    ClientPayloadError
+)
+
+from play_fetch import (
+    PlayFetchError,
+    NETWORK_ERROR,
+    UNKNOWN_ERROR,
+    THROTTLED_ERROR,
+    SERVER_ERROR
+)
+from play_helper import (
+    RETRY_BUDGETS,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY,
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RESET_TIMEOUT
+)
+
+log = logging.getLogger(__name__)
+
+TRANSIENT_ERRORS = [
+    NETWORK_ERROR, THROTTLED_ERROR, SERVER_ERROR
+]
+
+CIRCUIT_CLOSED = 'CLOSED'
+CIRCUIT_OPEN = 'OPEN'
+CIRCUIT_HALF_OPEN = 'HALF_OPEN'
+
+def classify_error(error):
+    if isinstance(error, PlayFetchError):
+        return error.error_class
+    elif isinstance(error, (ClientConnectionError, ClientPayloadError, asyncio.TimeoutError)):
+        return NETWORK_ERROR
+    return UNKNOWN_ERROR
+
+class RetryPolicy():
+    """
+    Exponential backoff with full jitter and a retry budget per error class.
+    """
+    def __init__(self, budgets=RETRY_BUDGETS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+        self._budgets = budgets
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+
+    def should_retry(self, error_class, attempts):
+        return attempts <= self._budgets.get(error_class, 0)
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self._max_delay, self._base_delay * (2 ** attempt)))
+
+class CircuitBreaker():
+    """
+    Opens after `failure_threshold` consecutive transient failures; while open,
+    requests wait for `reset_timeout` and a single probe decides whether it closes:
+    any outcome but a transient failure closes it, as the host did answer.
+    """
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probe_started_at = None
+        self._closed = asyncio.Event()
+        self._closed.set()
+        self.state = CIRCUIT_CLOSED
+        self.times_opened = 0
+
+    async def guard(self):
+        while self.state != CIRCUIT_CLOSED:
+            now = time.monotonic()
+            if self.state == CIRCUIT_OPEN:
+                remaining = self._opened_at + self._reset_timeout - now
+                if remaining <= 0:
+                    self.state = CIRCUIT_HALF_OPEN
+                    self._probe_started_at = now
+                    return
+                await asyncio.sleep(remaining)
+            elif now - self._probe_started_at >= self._reset_timeout:
+                # previous probe never reported back, let this request probe instead
+                self._probe_started_at = now
+                return
+            else:
+                try:
+                    await asyncio.wait_for(self._closed.wait(), self._reset_timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _open(self):
+        self.state = CIRCUIT_OPEN
+        self._opened_at = time.monotonic()
+        self._closed.clear()
+        self.times_opened += 1
+        log.warning('### circuit opened after {} consecutive transient failures ###'.format(self._failures))
+
+    def _close(self, reason):
+        self._failures = 0
+        if self.state != CIRCUIT_CLOSED:
+            log.info('*** circuit closed after {} ***'.format(reason))
+            self.state = CIRCUIT_CLOSED
+            self._closed.set()
+
+    def record_success(self):
+        self._close('successful probe')
+
+    def record_failure(self, error_class):
+        if error_class not in TRANSIENT_ERRORS:
+            if self.state == CIRCUIT_HALF_OPEN:
+                # the host answered the probe, the failure is down to the request itself
+                self._close('probe failed with {} error'.format(error_class))
+            return
+        self._failures += 1
+        if self.state == CIRCUIT_HALF_OPEN or (
+                self.state == CIRCUIT_CLOSED and self._failures >= self._failure_threshold):
+            self._open()
@@ -1,19 +1,34 @@
 import logging as log
-from logging.handlers import RotatingFileHandler
 import calendar
 import time
 import os
 from play_helper import(
     parseInt,
+    parseFloat,
     isTrue,
     colored_print,
-    MAX_LOG_FILE_SIZE,
-    LOG_BACKUP_COUNT,
     EXECUTOR_POOL_SIZE,
     EXECUTOR_THREAD_PREFIX,
+    DEFAULT_WORKER_COUNT,
+    MAX_WORKER_COUNT,
+    MAX_FRONTIER_SIZE,
+    MAX_SHARD_COUNT,
+    MAX_PROFILE_SECONDS,
+    DEFAULT_CARD_PARSER,
+    DEDUPE_CAPACITY,
+    DEDUPE_ERROR_RATE,
+    SERVER_CONNECTION_LIMIT,
+    SERVER_CONNECTION_LIMIT_PER_HOST,
     SERVER_HOST,
-    SERVER_PORT
+    SERVER_PORT,
+    DETAIL_BATCH_CONCURRENCY,
+    MAX_DETAIL_BATCH_CONCURRENCY,
+    MAX_DETAIL_BATCH_SIZE,
+    NDJSON_CONTENT_TYPE,
+    RECORD_PAGE_SIZE,
+    MAX_RECORD_PAGE_SIZE
 )
+from play_logging import setup_logging, configure_log_levels, LOG_LEVELS, RESET_LOG_LEVEL
 
 def setup_logging_and_provide_file_paths():
     for folder in ['log/', 'opt/']:
@@ -30,33 +45,42 @@ def setup_logging_and_provide_file_paths():
         extension
     )
     log_file_path = get_file_name('log', 'log')
-    rotating_log_handler = RotatingFileHandler(
-        log_file_path,
-        maxBytes=MAX_LOG_FILE_SIZE,
-        backupCount=LOG_BACKUP_COUNT
-    )
-    log.basicConfig(
-        format='%(asctime)s,%(msecs)d %(levelname)-5s [%(threadName)s | %(filename)s:%(lineno)d] %(message)s',
-        datefmt='%Y-%m-%d:%H:%M:%S',
-        level=log.DEBUG,
-        handlers=[
-            rotating_log_handler
-        ]
-    )
+    setup_logging(log_file_path)
 
     opt_file_path_prefix = get_file_prefix('opt')
     return (log_file_path, opt_file_path_prefix)
 
 from aiohttp import web
 from play_fetch import PlayFetch as pf
+from play_limiter import rate_limiter
+from play_retry import RetryPolicy, classify_error
+from play_cache import response_cache
+from play_metrics import render_metrics, METRICS_CONTENT_TYPE
+from play_profile import folded_profile
+from play_parser import CARD_PARSERS, shutdown_parse_pool
+from play_snapshot import find_snapshot, read_snapshot_header
+from play_dedupe import VISITED_SETS, EXACT_DEDUPE
+from play_store import STORES, JSON_STORE, SQLITE_STORE
+from play_frontier import FRONTIERS, FIFO_FRONTIER
+from play_listing import encode_cursor, decode_cursor, page_ids
 from play_manager import (
     InitiatedPlayManager as ipm,
     PlayManager as pm,
     delegate_manager,
     CANCELLED_STATUSES,
 )
+from play_process import (
+    ProcessPlayManager,
+    ShardedPlayManager,
+    ManagerProcessError,
+    limiter_share,
+    EXECUTIONS,
+    THREAD_EXECUTION,
+    PROCESS_EXECUTION
+)
 import json
 import asyncio
+import functools
 from uuid import uuid1 as uid
 from concurrent.futures import ThreadPoolExecutor
 
@@ -67,6 +91,16 @@ executor_pool = ThreadPoolExecutor(
 
 routes = web.RouteTableDef()
 
+def invalid_card_parser_response(parser, field='parser'):
+    if parser is None or parser in CARD_PARSERS:
+        return None
+    return web.json_response(dict(
+        message='INVALID_PARAMETER',
+        location='query',
+        field=field,
+        details='Card parser must be one of {}'.format(list(CARD_PARSERS.keys()))
+    ), status=400)
+
 @routes.get('/detail')
 async def detail(request):
     app_id = request.query.get('app_id')
@@ -77,9 +111,104 @@ async def detail(request):
             location='query',
             field='app_id'
         ), status=400)
-    async with pf() as play:
-        opt = await play.details(app_id)
-        return web.json_response(opt)
+    opt = await request.app['play'].details(app_id)
+    return web.json_response(opt)
+
+async def fetch_detail_for_batch(play, app_id, retry_policy):
+    """
+    Details of `app_id`, or its error once the retries allowed by `retry_policy` are exhausted.
+    """
+    attempts = dict()
+    while True:
+        try:
+            return dict(app_id=app_id, details=await play.details(app_id))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error_class = classify_error(e)
+            attempts[error_class] = attempts.get(error_class, 0) + 1
+            if not retry_policy.should_retry(error_class, attempts[error_class]):
+                return dict(
+                    app_id=app_id,
+                    error=str(e) or repr(e),
+                    error_class=error_class,
+                    attempts=sum(attempts.values())
+                )
+            await asyncio.sleep(retry_policy.backoff(sum(attempts.values()) - 1))
+
+async def fetch_details_for_batch(play, pending_app_ids, results, retry_policy):
+    # the workers share the iterator, so each app is fetched once
+    for app_id in pending_app_ids:
+        await results.put(await fetch_detail_for_batch(play, app_id, retry_policy))
+
+@routes.post('/detail/batch')
+async def detail_batch(request):
+    concurrency = parseInt(request.query.get('concurrency'), default=DETAIL_BATCH_CONCURRENCY)
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    app_ids = body.get('app_ids') if isinstance(body, dict) else body
+    log.info('*** fetching batch of [{}] details with concurrency: {} ***'.format(
+        len(app_ids) if isinstance(app_ids, list) else None,
+        concurrency
+    ))
+    if not app_ids:
+        return web.json_response(dict(
+            message='MISSING_REQUIRED_PARAMETER',
+            location='body',
+            field='app_ids'
+        ), status=400)
+    if not isinstance(app_ids, list) or not all(isinstance(app_id, str) and app_id for app_id in app_ids):
+        return web.json_response(dict(
+            message='INVALID_PARAMETER',
+            location='body',
+            field='app_ids',
+            details='Body must be a json list of app ids, or an object with such a list as app_ids'
+        ), status=400)
+    if len(app_ids) > MAX_DETAIL_BATCH_SIZE:
+        return web.json_response(dict(
+            message='INVALID_PARAMETER',
+            location='body',
+            field='app_ids',
+            details='Batch cannot have more than {} app ids'.format(MAX_DETAIL_BATCH_SIZE)
+        ), status=400)
+    if not 0 < concurrency <= MAX_DETAIL_BATCH_CONCURRENCY:
+        return web.json_response(dict(
+            message='INVALID_PARAMETER',
+            location='query',
+            field='concurrency',
+            details='Concurrency must be between 1 and {}'.format(MAX_DETAIL_BATCH_CONCURRENCY)
+        ), status=400)
+
+    app_ids = list(dict.fromkeys(app_ids))
+    # bounded, so that a slow reader holds the workers back instead of buffering every result
+    results = asyncio.Queue(maxsize=concurrency)
+    pending_app_ids = iter(app_ids)
+    retry_policy = RetryPolicy()
+    workers = [
+        asyncio.ensure_future(fetch_details_for_batch(request.app['play'], pending_app_ids, results, retry_policy))
+        for _ in range(min(concurrency, len(app_ids)))
+    ]
+    response = web.StreamResponse(headers={'Content-Type': NDJSON_CONTENT_TYPE})
+    response.enable_chunked_encoding()
+    failed = 0
+    try:
+        await response.prepare(request)
+        for _ in range(len(app_ids)):
+            result = await results.get()
+            if 'error' in result:
+                failed += 1
+            await response.write((json.dumps(result) + '\n').encode('utf-8'))
+        await response.write_eof()
+    except ConnectionResetError:
+        log.warning('### client left, cancelling batch of [{}] details ###'.format(len(app_ids)))
+        return response
+    finally:
+        for worker in workers:
+            worker.cancel()
+    log.info('*** fetched batch of [{}] details with [{}] failures ***'.format(len(app_ids), failed))
+    return response
 
 @routes.get('/collection')
 async def collection(request):
@@ -87,6 +216,7 @@ async def collection(request):
     catg_id = request.query.get('catg_id')
     page = parseInt(request.query.get('page'), default=0)
     results = parseInt(request.query.get('results'), default=120)
+    parser = request.query.get('parser')
     log.info('*** fetching collection for coln: {}; catg: {}; page: {}; results: {} ***'.format(coln_id, catg_id, page, results))
     if coln_id is None or catg_id is None:
         return web.json_response(dict(
@@ -94,13 +224,16 @@ async def collection(request):
             location='query',
             field=['coln_id', 'catg_id']
         ), status=400)
-    async with pf() as play:
-        opt = await play.collection(coln_id, catg_id, page=page, results=results)
-        return web.json_response(opt)
+    invalid_response = invalid_card_parser_response(parser)
+    if invalid_response is not None:
+        return invalid_response
+    opt = await request.app['play'].collection(coln_id, catg_id, page=page, results=results, parser=parser)
+    return web.json_response(opt)
 
 @routes.get('/similar')
 async def similar(request):
     app_id = request.query.get('app_id')
+    parser = request.query.get('parser')
     log.info('*** fetching similar for: {} ***'.format(app_id))
     if app_id is None:
         return web.json_response(dict(
@@ -108,15 +241,18 @@ async def similar(request):
             location='query',
             field='app_id'
         ), status=400)
-    async with pf() as play:
-        opt = await play.similar(app_id)
-        return web.json_response(opt)
+    invalid_response = invalid_card_parser_response(parser)
+    if invalid_response is not None:
+        return invalid_response
+    opt = await request.app['play'].similar(app_id, parser=parser)
+    return web.json_response(opt)
 
 @routes.get('/search')
 async def search(request):
     token = request.query.get('token')
     page = parseInt(request.query.get('page'), default=0)
     results = parseInt(request.query.get('results'), default=120)
+    parser = request.query.get('parser')
     log.info('*** fetching search result for token: {}; page: {}; results: {} ***'.format(token, page, results))
     if token is None:
         return web.json_response(dict(
@@ -124,9 +260,11 @@ async def search(request):
             location='query',
             field='token'
         ), status=400)
-    async with pf() as play:
-        opt = await play.search(token, page=page, results=results)
-        return web.json_response(opt)
+    invalid_response = invalid_card_parser_response(parser)
+    if invalid_response is not None:
+        return invalid_response
+    opt = await request.app['play'].search(token, page=page, results=results, parser=parser)
+    return web.json_response(opt)
 
 @routes.get('/view')
 async def view(request):
@@ -146,32 +284,288 @@ async def view(request):
         logfile=app['log_file_path']
     ))
 
+def running_process_managers():
+    return [
+        manager for manager in app['managers'].values()
+        if isinstance(manager, (ProcessPlayManager, ShardedPlayManager)) and manager.is_alive()
+    ]
+
+async def share_rate_limit(process_managers, worker_count):
+    """
+    Hands each worker process its share of the configured rate limit, out of `worker_count` worker processes.
+    """
+    if not process_managers:
+        return
+    limiter_settings = limiter_share(worker_count)
+    results = await asyncio.gather(
+        *[manager.configure_limiter(**limiter_settings) for manager in process_managers],
+        return_exceptions=True
+    )
+    for manager, result in zip(process_managers, results):
+        if isinstance(result, Exception):
+            log.warning('### failed to configure rate limiter of manager: {}, cause is: {!r} ###'.format(manager.id, result))
+
 @routes.post('/start')
 async def start(request):
     log.info('*** starting new process manager ***')
     process_type = request.query.get('type')
     read_dir = request.query.get('read_dir') or 'opt'
+    workers = parseInt(request.query.get('workers'), default=DEFAULT_WORKER_COUNT)
+    frontier_size = parseInt(request.query.get('frontier_size'), default=MAX_FRONTIER_SIZE)
+    card_parser = request.query.get('card_parser') or DEFAULT_CARD_PARSER
+    offload_parsing = isTrue(request.query.get('offload_parsing'))
+    flush_interval = parseInt(request.query.get('flush_interval'), default=0)
+    flush_threshold = parseInt(request.query.get('flush_threshold'), default=0)
+    resume = request.query.get('resume')
+    dedupe = request.query.get('dedupe') or EXACT_DEDUPE
+    dedupe_capacity = parseInt(request.query.get('dedupe_capacity'), default=DEDUPE_CAPACITY)
+    dedupe_error_rate = parseFloat(request.query.get('dedupe_error_rate'), default=DEDUPE_ERROR_RATE)
+    store = request.query.get('store') or JSON_STORE
+    max_age = parseInt(request.query.get('max_age'), default=0)
+    max_requests = parseInt(request.query.get('max_requests'), default=0)
+    concurrent_pages = isTrue(request.query.get('concurrent_pages'))
+    execution = request.query.get('execution') or THREAD_EXECUTION
+    shards = parseInt(request.query.get('shards'), default=1)
+    frontier = request.query.get('frontier') or FIFO_FRONTIER
+    max_depth = parseInt(request.query.get('max_depth'), default=0)
+    min_yield = parseFloat(request.query.get('min_yield'), default=0.0)
+    if not 0 < workers <= MAX_WORKER_COUNT:
+        return web.json_response(dict(
+            message='INVALID_PARAMETER',
+            location='query',
+            field='workers',
+            details='Number of workers must be between 1 and {}'.format(MAX_WORKER_COUNT)
+        ), status=400)
+    if frontier_size <= 0:
+        return web.json_response(dict(
+            message='INVALID_PARAMETER',
+            location='query',
+            field='frontier_size',
+            details='Frontier size must be a positive integer'
+        ), status=400)
+    invalid_response = invalid_card_parser_response(card_parser, field='card_parser')
+    if invalid_response is not None:
+        return invalid_response
+    if dedupe not in VISITED_SETS or dedupe_capacity <= 0 or not 0 < dedupe_error_rate < 1:
+        return web.json_response(dict(
+            message='INVALID_PARAMETER',
+            location='query',
+            field=['dedupe', 'dedupe_capacity', 'dedupe_error_rate'],
+            details='Dedupe must be one of {} with a positive capacity and an error rate between 0 and 1'.format(
+                list(VISITED_SETS.keys())
+            )
+        ), status=400)
+    if store not in STORES:
+        return web.json_response(dict(
+            message='INVALID_PARAMETER',
+            location='query',
+            field='store',
+            details='Store must be one of {}'.format(STORES)
+        ), status=400)
+    if execution not in EXECUTIONS:
+        return web.json_response(dict(
+            message='INVALID_PARAMETER',
+            location='query',
+            field='execution',
+            details='Execution must be one of {}'.format(EXECUTIONS)
+        ), status=400)
+    if frontier not in FRONTIERS:
+        return web.json_response(dict(
+            message='INVALID_PARAMETER',
+            location='query',
+            field='frontier',
+            details='Frontier must be one of {}'.format(list(FRONTIERS.keys()))
+        ), status=400)
+    if max_depth < 0 or min_yield < 0:
+        return web.json_response(dict(
+            message='INVALID_PARAMETER',
+            location='query',
+            field=['max_depth', 'min_yield'],
+            details='Max depth and min yield (in new apps per request) cannot be negative'
+        ), status=400)
+    if not 0 < shards <= MAX_SHARD_COUNT:
+        return web.json_response(dict(
+            message='INVALID_PARAMETER',
+            location='query',
+            field='shards',
+            details='Number of shards must be between 1 and {}'.format(MAX_SHARD_COUNT)
+        ), status=400)
+    if shards > 1 and (process_type == 'DETAILS' or resume):
+        return web.json_response(dict(
+            message='INVALID_PARAMETER',
+            location='query',
+            field=['shards', 'type', 'resume'],
+            details='Only new DISCOVER managers can be sharded'
+        ), status=422)
+    if max_age < 0 or max_requests < 0:
+        return web.json_response(dict(
+            message='INVALID_PARAMETER',
+            location='query',
+            field=['max_age', 'max_requests'],
+            details='Max age (in seconds) and max requests cannot be negative'
+        ), status=400)
+    resume_path = None
+    if resume:
+        resume_path = find_snapshot(os.path.dirname(app['opt_file_path_prefix']), resume)
+        if resume_path is None:
+            return web.json_response(dict(
+                message='NOT_FOUND',
+                details='No snapshot found to resume for: {}'.format(resume)
+            ), status=404)
+        snapshot_type = read_snapshot_header(resume_path).get('process_type')
+        if (snapshot_type == 'DETAILS') != (process_type == 'DETAILS'):
+            return web.json_response(dict(
+                message='INVALID_PARAMETER',
+                location='query',
+                field='resume',
+                details='Snapshot {} belongs to a {} manager'.format(resume_path, snapshot_type)
+            ), status=422)
     manager_id = str(uid())
-    app['managers'][manager_id] = ipm(
+    initiated_manager = ipm(
         manager_id, 
         process_type=process_type,
         read_dir=read_dir,
-        opt_path_prefix=app['opt_file_path_prefix']
-    )
-    context = dict(
-        manager_info_map=app['managers'],
-        manager_id=manager_id
+        opt_path_prefix=app['opt_file_path_prefix'],
+        workers=workers,
+        frontier_size=frontier_size,
+        card_parser=card_parser,
+        offload_parsing=offload_parsing,
+        flush_interval=flush_interval,
+        flush_threshold=flush_threshold,
+        resume_path=resume_path,
+        dedupe=dedupe,
+        dedupe_capacity=dedupe_capacity,
+        dedupe_error_rate=dedupe_error_rate,
+        store=store,
+        max_age=max_age,
+        max_requests=max_requests,
+        concurrent_pages=concurrent_pages,
+        frontier=frontier,
+        max_depth=max_depth,
+        min_yield=min_yield
     )
-    executor_pool.map(delegate_manager, [context])
+    if shards > 1 or execution == PROCESS_EXECUTION:
+        # every shard runs on its own worker process, the worker processes running at a time share the configured rate limit
+        process_managers = running_process_managers()
+        if shards > 1:
+            execution = PROCESS_EXECUTION
+            manager = ShardedPlayManager(initiated_manager, app['log_file_path'], shards)
+        else:
+            manager = ProcessPlayManager(initiated_manager, app['log_file_path'])
+        worker_count = sum(process_manager.worker_count for process_manager in process_managers) + manager.worker_count
+        app['managers'][manager_id] = manager
+        manager.start(limiter_settings=limiter_share(worker_count))
+        await share_rate_limit(process_managers, worker_count)
+        logfile = manager.logfile
+    else:
+        app['managers'][manager_id] = initiated_manager
+        context = dict(
+            manager_info_map=app['managers'],
+            manager_id=manager_id
+        )
+        executor_pool.map(delegate_manager, [context])
+        logfile = app['log_file_path']
     return web.json_response(dict(
         message='PROCESS_INITIATED',
         process_id=manager_id,
-        logfile=app['log_file_path']
+        execution=execution,
+        logfile=logfile
     ))
 
+def process_unavailable_response(manager, error):
+    return web.json_response(dict(
+        message='PROCESS_UNAVAILABLE',
+        details='Worker process of manager {} cannot be reached: {}'.format(manager.id, error)
+    ), status=422)
+
+def invalid_cursor_response():
+    return web.json_response(dict(
+        message='INVALID_PARAMETER',
+        location='query',
+        field='cursor',
+        details='Cursor must be the next_cursor of a previous page of the same listing'
+    ), status=400)
+
+def shared_store_response():
+    return web.json_response(dict(
+        message='INVALID_PARAMETER',
+        location='query',
+        field='full_records',
+        details='Records of a manager with store {} cannot be listed, its store being shared by every manager of the directory'.format(SQLITE_STORE)
+    ), status=400)
+
+def record_listing(request):
+    """
+    Returns `(listing, None)` with the paging options of a record listing, or `(None, response)` for invalid ones.
+    """
+    limit = parseInt(request.query.get('limit'), default=RECORD_PAGE_SIZE)
+    if not 0 < limit <= MAX_RECORD_PAGE_SIZE:
+        return None, web.json_response(dict(
+            message='INVALID_PARAMETER',
+            location='query',
+            field='limit',
+            details='Limit must be between 1 and {}'.format(MAX_RECORD_PAGE_SIZE)
+        ), status=400)
+    try:
+        position = decode_cursor(request.query.get('cursor'))
+    except ValueError:
+        return None, invalid_cursor_response()
+    return dict(
+        position=position,
+        limit=limit,
+        full_records=isTrue(request.query.get('full_records')),
+        stream=isTrue(request.query.get('stream'))
+    ), None
+
+async def records_response(request, opt, listing, list_records):
+    """
+    `opt` along with the page of records at the listing's cursor and the cursor of the next page;
+    streamed as NDJSON instead, `opt` then every record from the cursor on one line each, read a page at a time.
+    """
+    loop = asyncio.get_event_loop()
+    # the pages are read from disk, off the server loop
+    read_page = lambda position: loop.run_in_executor(None, functools.partial(
+        list_records,
+        position=position,
+        limit=listing.get('limit'),
+        full_records=listing.get('full_records')
+    ))
+    try:
+        records, position = await read_page(listing.get('position'))
+    except (TypeError, ValueError):
+        log.exception('@@@ failed to read records at cursor: {} @@@'.format(listing.get('position')))
+        return invalid_cursor_response()
+    if not listing.get('stream'):
+        return web.json_response(dict(
+            opt,
+            records=records,
+            next_cursor=encode_cursor(position)
+        ))
+
+    response = web.StreamResponse(headers={'Content-Type': NDJSON_CONTENT_TYPE})
+    response.enable_chunked_encoding()
+    streamed = 0
+    try:
+        await response.prepare(request)
+        await response.write((json.dumps(opt) + '\n').encode('utf-8'))
+        while True:
+            if records:
+                await response.write(''.join(json.dumps(record) + '\n' for record in records).encode('utf-8'))
+                streamed += len(records)
+            if position is None:
+                break
+            records, position = await read_page(position)
+        await response.write_eof()
+    except ConnectionResetError:
+        log.warning('### client left after [{}] streamed records ###'.format(streamed))
+        return response
+    log.info('*** streamed [{}] records ***'.format(streamed))
+    return response
+
 @routes.post('/stop')
 async def stop(request):
     pid = request.query.get('pid')
+    show_records = isTrue(request.query.get('show_records'))
     log.info('*** stopping process manager: {} ***'.format(pid))
     if pid is None:
         return web.json_response(dict(
@@ -179,12 +573,17 @@ async def stop(request):
             location='query',
             field='pid'
         ), status=400)
+    listing, error_response = record_listing(request)
+    if error_response is not None:
+        return error_response
     manager = app['managers'].get(pid)
     if manager is None:
         return web.json_response(dict(
             message='NOT_FOUND',
             details='Process not found or already killed'
         ), status=404)
+    elif show_records and listing.get('full_records') and manager.store == SQLITE_STORE:
+        return shared_store_response()
     elif manager.status == 'INITIATED':
         return web.json_response(dict(
             message='CANNOT_KILL_MANAGER_UNTIL_FULLY_INITIATED',
@@ -193,7 +592,10 @@ async def stop(request):
 
     if manager.is_delegated:
         if not manager.is_cancelled():
-            opt = await manager.shutdown()
+            try:
+                opt = await manager.shutdown()
+            except ManagerProcessError as e:
+                return process_unavailable_response(manager, e)
             message='STOP_INITIATED'
         else:
             opt = manager.peek()
@@ -203,17 +605,17 @@ async def stop(request):
         message='PROCESS_STOPPED'
         app['managers'].pop(manager.id, None)
 
-    return web.json_response(dict(
+    opt = dict(
         opt,
         message=message,
         logfile=app['log_file_path']
-    ))
+    )
+    if show_records:
+        return await records_response(request, opt, listing, manager.list_records)
+    return web.json_response(opt)
 
 @routes.post('/flush')
 async def flush(request):
-    """
-    Not yet implemented
-    """
     pid = request.query.get('pid')
     show_records = isTrue(request.query.get('show_records'))
     log.info('*** flushing process manager: {} ***'.format(pid))
@@ -240,10 +642,23 @@ async def flush(request):
             details='Cannot flush a manager in Cancelled {} status'.format(CANCELLED_STATUSES)
         ), status=422)
 
-    return web.json_response(dict(
-        message='METHOD_NOT_ALLOWED',
-        details='Implementation pending'
-    ), status=405)
+    try:
+        flushed_ids = await manager.request_checkpoint()
+    except ManagerProcessError as e:
+        return process_unavailable_response(manager, e)
+    opt = dict(
+        manager.peek(),
+        message='PROCESS_FLUSHED',
+        records_flushed_now=len(flushed_ids),
+        logfile=app['log_file_path']
+    )
+    if show_records and isTrue(request.query.get('stream')):
+        # the ids flushed now are gone once listed, the flushed records are paged by /peek?full_records=true
+        list_flushed_ids = lambda position, limit, full_records: page_ids([flushed_ids], position, limit)
+        return await records_response(request, opt, dict(limit=RECORD_PAGE_SIZE, stream=True), list_flushed_ids)
+    if show_records:
+        opt['records'] = flushed_ids
+    return web.json_response(opt)
 
 @routes.get('/peek')
 async def peek(request):
@@ -256,23 +671,263 @@ async def peek(request):
             location='query',
             field='pid'
         ), status=400)
+    listing, error_response = record_listing(request)
+    if error_response is not None:
+        return error_response
     manager = app['managers'].get(pid)
     if manager is None:
         return web.json_response(dict(
             message='NOT_FOUND',
             details='Process not found or already killed'
         ), status=422)
-    opt = manager.peek(
-        show_records=show_records
-    )
-    return web.json_response(dict(
+    elif show_records and listing.get('full_records') and manager.store == SQLITE_STORE:
+        return shared_store_response()
+    if isinstance(manager, (ProcessPlayManager, ShardedPlayManager)) and manager.is_alive():
+        try:
+            opt = await manager.refresh_status()
+        except ManagerProcessError:
+            log.warning('### falling back to last reported status of manager: {} ###'.format(pid))
+            opt = manager.peek()
+    else:
+        opt = manager.peek()
+    opt = dict(
         opt,
         message='PROCESS_PEEKED',
         logfile=app['log_file_path']
+    )
+    if show_records:
+        return await records_response(request, opt, listing, manager.list_records)
+    return web.json_response(opt)
+
+@routes.get('/limiter')
+async def limiter(request):
+    log.info('*** collecting rate limiter stats ***')
+    return web.json_response(dict(
+        rate_limiter.stats(),
+        message='RATE_LIMITER_STATS'
     ))
 
+@routes.post('/limiter')
+async def configure_limiter(request):
+    rate = parseFloat(request.query.get('rate'), default=None)
+    burst = parseInt(request.query.get('burst'), default=None)
+    log.info('*** configuring rate limiter with rate: {}; burst: {} ***'.format(rate, burst))
+    if rate is None and burst is None:
+        return web.json_response(dict(
+            message='MISSING_REQUIRED_PARAMETER',
+            location='query',
+            field=['rate', 'burst']
+        ), status=400)
+    if (rate is not None and rate <= 0) or burst == 0:
+        return web.json_response(dict(
+            message='INVALID_PARAMETER',
+            location='query',
+            field=['rate', 'burst'],
+            details='Rate and burst must be positive'
+        ), status=400)
+    rate_limiter.configure(rate=rate, burst=burst)
+    process_managers = running_process_managers()
+    await share_rate_limit(process_managers, sum(manager.worker_count for manager in process_managers))
+    return web.json_response(dict(
+        rate_limiter.stats(),
+        message='RATE_LIMITER_CONFIGURED'
+    ))
+
+@routes.get('/cache')
+async def cache(request):
+    log.info('*** collecting response cache stats ***')
+    return web.json_response(dict(
+        await response_cache.run(response_cache.stats),
+        message='RESPONSE_CACHE_STATS'
+    ))
+
+@routes.post('/cache')
+async def configure_cache(request):
+    enabled = request.query.get('enabled')
+    enabled = None if enabled is None else isTrue(enabled)
+    max_size = parseInt(request.query.get('max_size'), default=None)
+    ttls = {
+        endpoint: parseInt(request.query.get('{}_ttl'.format(endpoint)), default=None)
+        for endpoint in response_cache.ttls.keys()
+    }
+    ttls = {endpoint: ttl for endpoint, ttl in ttls.items() if ttl is not None}
+    log.info('*** configuring response cache with enabled: {}; max_size: {}; ttls: {} ***'.format(
+        enabled,
+        max_size,
+        ttls
+    ))
+    if (max_size is not None and max_size <= 0) or any(ttl < 0 for ttl in ttls.values()):
+        return web.json_response(dict(
+            message='INVALID_PARAMETER',
+            location='query',
+            field=['max_size'] + ['{}_ttl'.format(endpoint) for endpoint in ttls.keys()],
+            details='Size must be positive and ttls (in seconds) cannot be negative'
+        ), status=400)
+    if isTrue(request.query.get('clear')):
+        await response_cache.run(response_cache.clear)
+    await response_cache.run(response_cache.configure, enabled=enabled, max_size=max_size, ttls=ttls)
+    return web.json_response(dict(
+        await response_cache.run(response_cache.stats),
+        message='RESPONSE_CACHE_CONFIGURED'
+    ))
+
+@routes.get('/metrics')
+async def metrics(request):
+    log.debug('*** collecting metrics ***')
+    snapshots = [dict(
+        labels=dict(manager='server', process_type='SERVER'),
+        endpoints=app['play'].metrics.snapshot()
+    )]
+    managers = list(app['managers'].values())
+    manager_metrics = await asyncio.gather(
+        *[manager.collect_metrics() for manager in managers],
+        return_exceptions=True
+    )
+    for manager, result in zip(managers, manager_metrics):
+        if isinstance(result, Exception):
+            log.warning('### failed to collect metrics of manager: {}, cause is: {!r} ###'.format(manager.id, result))
+        else:
+            snapshots.extend(result)
+    return web.Response(
+        body=render_metrics(snapshots).encode('utf-8'),
+        headers={'Content-Type': METRICS_CONTENT_TYPE}
+    )
+
+def managers_for_pid(pid):
+    if pid is None:
+        return list(app['managers'].values())
+    manager = app['managers'].get(pid)
+    return [] if manager is None else [manager]
+
+@routes.get('/timing')
+@routes.post('/timing')
+async def timing(request):
+    pid = request.query.get('pid')
+    enabled = request.query.get('enabled') if request.method == 'POST' else None
+    enabled = None if enabled is None else isTrue(enabled)
+    reset = request.method == 'POST' and isTrue(request.query.get('reset'))
+    log.info('*** configuring stage timing of: {} with enabled: {}; reset: {} ***'.format(pid or 'all', enabled, reset))
+    managers = managers_for_pid(pid)
+    if pid is not None and not managers:
+        return web.json_response(dict(
+            message='NOT_FOUND',
+            details='Process not found or already killed'
+        ), status=404)
+    managers = [manager for manager in managers if manager.status != 'INITIATED']
+    stats = await asyncio.gather(
+        *[manager.configure_timing(enabled=enabled, reset=reset) for manager in managers],
+        return_exceptions=True
+    )
+    timings = dict()
+    for manager, result in zip(managers, stats):
+        if isinstance(result, Exception):
+            log.warning('### failed to configure timing of manager: {}, cause is: {!r} ###'.format(manager.id, result))
+        else:
+            timings[manager.id] = result
+    if pid is None:
+        timings['server'] = app['play'].timer.configure(enabled=enabled, reset=reset)
+    return web.json_response(dict(
+        message='STAGE_TIMINGS',
+        timings=timings
+    ))
+
+@routes.get('/logging')
+@routes.post('/logging')
+async def logging_levels(request):
+    pid = request.query.get('pid')
+    levels = dict()
+    if request.method == 'POST':
+        logger = request.query.get('logger')
+        level = request.query.get('level', '').upper()
+        log.info('*** setting level of logger: {} to: {} for: {} ***'.format(logger, level, pid or 'all'))
+        if logger is None:
+            return web.json_response(dict(
+                message='MISSING_REQUIRED_PARAMETER',
+                location='query',
+                field='logger'
+            ), status=400)
+        if level not in LOG_LEVELS + [RESET_LOG_LEVEL]:
+            return web.json_response(dict(
+                message='INVALID_PARAMETER',
+                location='query',
+                field='level',
+                details='Level must be one of {}'.format(LOG_LEVELS + [RESET_LOG_LEVEL])
+            ), status=400)
+        levels[logger] = None if level == RESET_LOG_LEVEL else level
+    managers = managers_for_pid(pid)
+    if pid is not None and not managers:
+        return web.json_response(dict(
+            message='NOT_FOUND',
+            details='Process not found or already killed'
+        ), status=404)
+    process_managers = [
+        manager for manager in managers
+        if isinstance(manager, (ProcessPlayManager, ShardedPlayManager)) and manager.is_alive()
+    ]
+    results = await asyncio.gather(
+        *[manager.configure_log_levels(levels) for manager in process_managers],
+        return_exceptions=True
+    )
+    process_levels = dict()
+    for manager, result in zip(process_managers, results):
+        if isinstance(result, Exception):
+            log.warning('### failed to configure log levels of manager: {}, cause is: {!r} ###'.format(manager.id, result))
+        else:
+            process_levels[manager.id] = result
+    # thread managers log through the loggers of the server
+    if pid is None or not process_managers:
+        process_levels['server'] = configure_log_levels(levels)
+    return web.json_response(dict(
+        message='LOG_LEVELS',
+        levels=process_levels
+    ))
+
+@routes.get('/profile')
+async def profile(request):
+    pid = request.query.get('pid')
+    seconds = parseFloat(request.query.get('seconds'), default=10.0)
+    log.info('*** profiling process manager: {} for {}s ***'.format(pid, seconds))
+    if pid is None:
+        return web.json_response(dict(
+            message='MISSING_REQUIRED_PARAMETER',
+            location='query',
+            field='pid'
+        ), status=400)
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        return web.json_response(dict(
+            message='INVALID_PARAMETER',
+            location='query',
+            field='seconds',
+            details='Seconds must be between 0 and {}'.format(MAX_PROFILE_SECONDS)
+        ), status=400)
+    manager = app['managers'].get(pid)
+    if manager is None:
+        return web.json_response(dict(
+            message='NOT_FOUND',
+            details='Process not found or already killed'
+        ), status=404)
+    elif manager.status != 'RUNNING':
+        return web.json_response(dict(
+            message='CANNOT_PROFILE_MANAGER_UNLESS_RUNNING',
+            details='Cannot profile a manager in {} status'.format(manager.status)
+        ), status=422)
+    try:
+        stack_counts = await manager.profile(seconds)
+    except ManagerProcessError as e:
+        return process_unavailable_response(manager, e)
+    return web.Response(
+        text=folded_profile(stack_counts),
+        content_type='text/plain',
+        headers={'Content-Disposition': 'attachment; filename="profile_{}.folded"'.format(pid)}
+    )
+
 async def on_startup(app):
     print('========   Starting Google Play Crawler   ========')
+    app['play'] = await pf(
+        persist=True,
+        connection_limit=SERVER_CONNECTION_LIMIT,
+        connection_limit_per_host=SERVER_CONNECTION_LIMIT_PER_HOST
+    ).open()
     colored_print('(Press CTRL+C only ONCE for quitting otherwise data dump will fail)\n')
 
 async def on_shutdown(app):
@@ -282,8 +937,18 @@ async def on_shutdown(app):
     print('\n======== Shutting down [{}] active managers ========'.format(len(active_managers)))
     colored_print('(DON\'T press CTRL+C again)')
     for manager in active_managers:
-        await manager.shutdown()
+        try:
+            await manager.shutdown()
+        except ManagerProcessError:
+            log.exception('@@@ failed to stop worker process of manager: {} @@@'.format(manager.id))
     executor_pool.shutdown(wait=True)
+    await asyncio.gather(*[
+        manager.join()
+        for manager in app['managers'].values()
+        if isinstance(manager, (ProcessPlayManager, ShardedPlayManager))
+    ])
+    shutdown_parse_pool()
+    await app['play'].force_close()
     print('======== Application gracefully terminated ========')
 
 if __name__ == '__main__':
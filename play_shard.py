@@ -0,0 +1,101 @@
+"""
+Contains the partitioning used by sharded DISCOVER managers.
+
+Every shard owns the app ids hashing into its partition: it alone keeps them in its
+visited set and queues their similar apps, so dedupe stays exact without any lock
+shared between shards. Apps found by a shard but owned by another one are routed
+to their owner in `(depth, apps)` batches, through a transport which only has to
+`send` a batch to a shard and `receive` the batches addressed to its own shard. The local transport
+uses one multiprocessing queue per shard; shards on other nodes only need a
+transport with the same two methods.
+"""
+import queue
+import logging
+
+from play_dedupe import hash_app_id
+
+log = logging.getLogger(__name__)
+
+SHARD_RECEIVE_TIMEOUT = 1.0
+
+def shard_for(app_id, shard_count):
+    return hash_app_id(app_id) % shard_count
+
+def shard_for_collection(coln, catg, shard_count):
+    return shard_for('{}/{}'.format(coln, catg), shard_count)
+
+def shard_opt_path(opt_path, shard_index):
+    root, extension = opt_path.rsplit('.', 1)
+    return '{}_{}.{}'.format(root, shard_index, extension)
+
+class LocalShardTransport():
+    """
+    Queues of every shard of this machine, created by the coordinator and handed to the shards on spawn.
+    """
+    def __init__(self, queues, shard_index):
+        self._queues = queues
+        self.shard_index = shard_index
+
+    def send(self, shard_index, games):
+        self._queues[shard_index].put(games)
+
+    def receive(self, timeout=SHARD_RECEIVE_TIMEOUT):
+        try:
+            return self._queues[self.shard_index].get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        # batches still buffered for stopped shards must not keep this process from exiting
+        for shard_queue in self._queues:
+            shard_queue.cancel_join_thread()
+
+class ShardRouter():
+    """
+    Splits the apps found by a shard into its own ones and the ones to route to other shards.
+    `sent` and `received` count the routed apps, the coordinator takes the crawl as
+    complete once every shard is idle and the totals match (nothing is in flight).
+    """
+    def __init__(self, transport, shard_index, shard_count):
+        self._transport = transport
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self._outbox = dict()
+        self.sent = 0
+        self.received = 0
+
+    def owns(self, app_id):
+        return shard_for(app_id, self.shard_count) == self.shard_index
+
+    def owns_collection(self, coln, catg):
+        return shard_for_collection(coln, catg, self.shard_count) == self.shard_index
+
+    def forward(self, game, depth=0):
+        self._outbox.setdefault((shard_for(game.get('app_id'), self.shard_count), depth), []).append(game)
+
+    def flush(self):
+        outbox, self._outbox = self._outbox, dict()
+        for (shard_index, depth), games in outbox.items():
+            try:
+                self._transport.send(shard_index, (depth, games))
+            except:
+                log.exception('@@@ failed to route [{}] apps to shard: {} @@@'.format(len(games), shard_index))
+            else:
+                self.sent += len(games)
+
+    def receive(self):
+        return self._transport.receive()
+
+    def acknowledge(self, games):
+        self.received += len(games)
+
+    def close(self):
+        self._transport.close()
+
+    def stats(self):
+        return dict(
+            shard_index=self.shard_index,
+            shard_count=self.shard_count,
+            shard_sent=self.sent,
+            shard_received=self.received
+        )
@@ -0,0 +1,78 @@
+"""
+Contains the on-disk snapshot of a manager's visited ids and pending frontier used for resuming crawls.
+
+The snapshot is a gzipped text file: a json header on the first line followed by
+`<type><TAB><value>` lines for the visited set (see play_dedupe) and one
+`F<TAB><json entry>` line per pending frontier entry, so that it can be written
+and read back as a stream.
+"""
+import gzip
+import json
+import os
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_EXTENSION = '.snapshot.gz'
+FRONTIER_LINE = 'F'
+
+def snapshot_path_for(opt_path):
+    return '{}{}'.format(os.path.splitext(opt_path)[0], SNAPSHOT_EXTENSION)
+
+def find_snapshot(read_dir, resume):
+    """
+    Returns the latest snapshot in `read_dir` whose name contains `resume`,
+    which can either be a previous process id or an opt file prefix.
+    """
+    try:
+        candidates = [
+            os.path.join(read_dir, filename)
+            for filename in os.listdir(read_dir)
+            if filename.endswith(SNAPSHOT_EXTENSION) and resume in filename
+        ]
+    except OSError:
+        log.exception('@@@ failed to list snapshots in: {} @@@'.format(read_dir))
+        return None
+    return max(candidates, key=os.path.getmtime) if candidates else None
+
+def write_snapshot(file_path, header, visited_lines, frontier_entries):
+    temp_path = '{}.tmp'.format(file_path)
+    try:
+        with open(temp_path, 'wb') as raw_file:
+            with gzip.open(raw_file, 'wt') as snapshot_file:
+                snapshot_file.write('{}\n'.format(json.dumps(dict(
+                    header,
+                    created_at=time.time()
+                ))))
+                for line_type, value in visited_lines:
+                    snapshot_file.write('{}\t{}\n'.format(line_type, value))
+                for entry in frontier_entries:
+                    snapshot_file.write('{}\t{}\n'.format(FRONTIER_LINE, json.dumps(entry)))
+            # on disk before the replace, so that a crash never leaves a truncated snapshot in place
+            raw_file.flush()
+            os.fsync(raw_file.fileno())
+        os.replace(temp_path, file_path)
+    except:
+        log.exception('@@@ failed to write snapshot: {} @@@'.format(file_path))
+        return False
+    else:
+        log.info('*** successfully wrote snapshot: {} ***'.format(file_path))
+        return True
+
+def read_snapshot_header(file_path):
+    with gzip.open(file_path, 'rt') as snapshot_file:
+        return json.loads(snapshot_file.readline())
+
+def iter_snapshot(file_path):
+    """
+    Yields `(line_type, value)` pairs, skipping the header; frontier entries are decoded to tuples.
+    """
+    with gzip.open(file_path, 'rt') as snapshot_file:
+        snapshot_file.readline()
+        for line in snapshot_file:
+            line_type, _, value = line.rstrip('\n').partition('\t')
+            if line_type == FRONTIER_LINE:
+                yield line_type, tuple(json.loads(value))
+            else:
+                yield line_type, value
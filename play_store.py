@@ -0,0 +1,191 @@
+"""
+Contains the sqlite store which can replace the json opt files of the managers.
+
+Records live in a single `records` table keyed (and indexed) by app_id, so merging
+a run into previous ones is an upsert and loading them is a keyset scan. The
+database runs in WAL mode, so that a DETAILS manager can read it while others write.
+"""
+import json
+import os
+import sqlite3
+import time
+import logging
+
+from play_helper import SQLITE_STORE_FILENAME
+from play_loader import read_record_batch, LOAD_BATCH_SIZE
+
+log = logging.getLogger(__name__)
+
+JSON_STORE = 'json'
+SQLITE_STORE = 'sqlite'
+STORES = [JSON_STORE, SQLITE_STORE]
+
+SQLITE_BUSY_TIMEOUT = 30.0
+# stays below the default SQLITE_MAX_VARIABLE_NUMBER of older sqlite builds
+SQLITE_MAX_VARIABLES = 900
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS records (
+        app_id TEXT PRIMARY KEY NOT NULL,
+        record TEXT NOT NULL,
+        last_fetched REAL NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS records_last_fetched ON records (last_fetched)',
+    '''CREATE TABLE IF NOT EXISTS imports (
+        file_path TEXT PRIMARY KEY NOT NULL,
+        size INTEGER NOT NULL,
+        mtime REAL NOT NULL,
+        records INTEGER NOT NULL,
+        imported_at REAL NOT NULL
+    )'''
+]
+
+def store_path_for(dir_path):
+    return os.path.join(dir_path or '.', SQLITE_STORE_FILENAME)
+
+def connect(file_path):
+    connection = sqlite3.connect(
+        file_path,
+        timeout=SQLITE_BUSY_TIMEOUT,
+        isolation_level=None,
+        check_same_thread=False
+    )
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    for statement in SCHEMA:
+        connection.execute(statement)
+    return connection
+
+def upsert_records(connection, records, fetched_at=None):
+    """
+    Merges `records` into the store in one transaction; like loading the json opt files,
+    a record already present is updated with the new one instead of being replaced.
+    `last_fetched` is the `fetched_at` of detailed records and `fetched_at` otherwise.
+    """
+    fetched_at = time.time() if fetched_at is None else fetched_at
+    records = [record for record in records if record and record.get('app_id')]
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        for offset in range(0, len(records), SQLITE_MAX_VARIABLES):
+            batch = records[offset:offset + SQLITE_MAX_VARIABLES]
+            app_ids = [record.get('app_id') for record in batch]
+            existing = dict(connection.execute(
+                'SELECT app_id, record FROM records WHERE app_id IN ({})'.format(','.join('?' * len(app_ids))),
+                app_ids
+            ))
+            rows = []
+            for record in batch:
+                app_id = record.get('app_id')
+                if app_id in existing:
+                    merged = json.loads(existing[app_id])
+                    merged.update(record)
+                    record = merged
+                existing[app_id] = json.dumps(record)
+                rows.append((app_id, existing[app_id], record.get('fetched_at', fetched_at)))
+            connection.executemany(
+                'INSERT INTO records (app_id, record, last_fetched) VALUES (?, ?, ?) '
+                'ON CONFLICT (app_id) DO UPDATE SET record = excluded.record, last_fetched = excluded.last_fetched',
+                rows
+            )
+    except:
+        connection.execute('ROLLBACK')
+        raise
+    else:
+        connection.execute('COMMIT')
+    return len(records)
+
+def read_store_batch(file_path, cursor=None, batch_size=LOAD_BATCH_SIZE):
+    """
+    Same contract as `play_loader.read_record_batch`, the cursor being the last app_id read.
+    """
+    connection = connect(file_path)
+    try:
+        rows = connection.execute(
+            'SELECT app_id, record FROM records WHERE app_id > ? ORDER BY app_id LIMIT ?',
+            (cursor or '', batch_size)
+        ).fetchall()
+    finally:
+        connection.close()
+    records = [json.loads(record) for _, record in rows]
+    return records, (rows[-1][0] if len(rows) == batch_size else None)
+
+def import_file(store_file_path, file_path):
+    """
+    Imports a json opt file or jsonl checkpoint into the store, unless the same
+    (unchanged) file was already imported. Returns the number of records imported.
+    """
+    stat = os.stat(file_path)
+    connection = connect(store_file_path)
+    try:
+        previous = connection.execute(
+            'SELECT size, mtime FROM imports WHERE file_path = ?',
+            (os.path.abspath(file_path),)
+        ).fetchone()
+        if previous == (stat.st_size, stat.st_mtime):
+            log.info('*** skipping already imported file: {} ***'.format(file_path))
+            return 0
+        log.info('*** importing file: {} into store: {} ***'.format(file_path, store_file_path))
+        imported, cursor = 0, None
+        while True:
+            records, cursor = read_record_batch(file_path, cursor)
+            imported += upsert_records(connection, records, fetched_at=stat.st_mtime)
+            if cursor is None:
+                break
+        connection.execute(
+            'INSERT OR REPLACE INTO imports (file_path, size, mtime, records, imported_at) VALUES (?, ?, ?, ?, ?)',
+            (os.path.abspath(file_path), stat.st_size, stat.st_mtime, imported, time.time())
+        )
+    finally:
+        connection.close()
+    log.info('*** imported [{}] records from file: {} ***'.format(imported, file_path))
+    return imported
+
+class SqliteStoreWriter():
+    """
+    Drop-in for the JsonlCheckpointWriter: every flush of the manager upserts its records into the store.
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.records_written = 0
+        self.flushes = 0
+        self._connection = None
+
+    def _upsert_with_retry(self, records, retry=2):
+        if retry <= 0:
+            return False
+        try:
+            if self._connection is None:
+                self._connection = connect(self.file_path)
+            upsert_records(self._connection, records)
+        except:
+            log.exception('@@@ failed to write to store: {} @@@'.format(self.file_path))
+            self.close()
+            return self._upsert_with_retry(records, retry=retry-1)
+        else:
+            return True
+
+    def write(self, records):
+        if not records:
+            return True
+        is_written = self._upsert_with_retry(records)
+        if is_written:
+            self.records_written += len(records)
+            self.flushes += 1
+            log.info('*** upserted [{}] records into store: {} ***'.format(len(records), self.file_path))
+        return is_written
+
+    def close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except:
+                log.exception('@@@ failed to close store: {} @@@'.format(self.file_path))
+            self._connection = None
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) < 3:
+        print('usage: python play_store.py <store_file> <opt_file> [<opt_file> ...]')
+        sys.exit(1)
+    for opt_file in sys.argv[2:]:
+        print('{}: {} records imported'.format(opt_file, import_file(sys.argv[1], opt_file)))
@@ -0,0 +1,177 @@
+"""
+Contains a local stub of the play store used by the offline benchmark.
+
+It serves the details, similar, collection and search pages rendered from the
+html fixtures in FIXTURES_DIR over a synthetic similarity graph of `apps` apps:
+the apps are grouped in clusters of `cluster_size`, and each `similar` page links
+to `similar` apps, a `locality` share of which are from the same cluster. Every
+response is delayed by `latency` seconds (+/- `jitter` of it) and fails with
+`error_status` at `error_rate`. The graph, the pages and the failures are seeded,
+so that runs with the same options are repeatable.
+"""
+import asyncio
+import os
+import random
+import socket
+from html import escape
+from string import Template
+
+from aiohttp import web
+
+from play_helper import CATEGORIES
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+STUB_HOST = '127.0.0.1'
+APP_ID_PREFIX = 'com.benchmark.app'
+MAX_COLLECTION_SIZE = 600
+SEARCH_RESULT_SIZE = 48
+
+def load_fixture(filename, fixtures_dir=FIXTURES_DIR):
+    with open(os.path.join(fixtures_dir, filename), encoding='utf-8') as fixture_file:
+        return Template(fixture_file.read())
+
+class SyntheticGraph():
+    def __init__(self, apps=5000, similar=20, locality=0.8, cluster_size=250, seed=0):
+        self.apps = apps
+        self.similar_count = similar
+        self.locality = locality
+        self.cluster_size = cluster_size
+        self.seed = seed
+
+    def app_id(self, index):
+        return '{}{}'.format(APP_ID_PREFIX, index)
+
+    def index_of(self, app_id):
+        try:
+            index = int(app_id[len(APP_ID_PREFIX):]) if app_id.startswith(APP_ID_PREFIX) else -1
+        except ValueError:
+            return None
+        return index if 0 <= index < self.apps else None
+
+    def _random(self, *key):
+        return random.Random('{}/{}'.format(self.seed, '/'.join(map(str, key))))
+
+    def similar(self, index):
+        rng = self._random('similar', index)
+        cluster_start = index - index % self.cluster_size
+        cluster_size = min(self.cluster_size, self.apps - cluster_start)
+        return [
+            cluster_start + rng.randrange(cluster_size) if rng.random() < self.locality else rng.randrange(self.apps)
+            for _ in range(self.similar_count)
+        ]
+
+    def collection(self, coln, catg, start, num):
+        rng = self._random('collection', coln, catg)
+        size = rng.randrange(MAX_COLLECTION_SIZE)
+        return [rng.randrange(self.apps) for _ in range(size)][start:start + num]
+
+    def search(self, token):
+        rng = self._random('search', token)
+        return [rng.randrange(self.apps) for _ in range(SEARCH_RESULT_SIZE)]
+
+    def app_info(self, index):
+        rng = self._random('app', index)
+        developer_id = 'Benchmark+Developer+{}'.format(index % 97)
+        price = '0' if rng.random() < 0.8 else '${:.2f}'.format(rng.choice([0.99, 1.99, 4.99]))
+        score = round(rng.uniform(1, 5), 1)
+        return dict(
+            app_id=self.app_id(index),
+            title='Benchmark App {}'.format(index),
+            developer='Benchmark Developer {}'.format(index % 97),
+            developer_id=developer_id,
+            developer_email='developer{}@example.com'.format(index % 97),
+            developer_address='{} Example Street'.format(index % 97),
+            category=rng.choice(CATEGORIES),
+            category_name=rng.choice(CATEGORIES).title(),
+            description=' '.join(rng.choice(['fast', 'simple', 'free', 'offline', 'fun', 'secure']) for _ in range(30)),
+            price=price,
+            price_html='' if price == '0' else '<span class="display-price">{}</span>'.format(price),
+            score=score,
+            score_width=int(score * 20),
+            reviews='{:,}'.format(rng.randrange(10, 10 ** 6)),
+            ratings_5=rng.randrange(10 ** 5),
+            ratings_4=rng.randrange(10 ** 4),
+            ratings_3=rng.randrange(10 ** 3),
+            ratings_2=rng.randrange(10 ** 3),
+            ratings_1=rng.randrange(10 ** 3),
+            updated='June {}, 2019'.format(index % 28 + 1),
+            size='{}M'.format(rng.randrange(1, 100)),
+            installs='{:,}+'.format(10 ** rng.randrange(2, 8)),
+            version='{}.{}.{}'.format(rng.randrange(10), rng.randrange(10), rng.randrange(100))
+        )
+
+class PlayStub():
+    def __init__(self, graph, latency=0.02, jitter=0.5, error_rate=0.0, error_status=500,
+            fixtures_dir=FIXTURES_DIR, seed=0):
+        self.graph = graph
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self._details = load_fixture('details.html', fixtures_dir)
+        self._card = load_fixture('card.html', fixtures_dir)
+        self._card_list = load_fixture('card_list.html', fixtures_dir)
+        self.requests = 0
+
+    def _render_info(self, template, index):
+        return template.substitute({key: escape(str(value), quote=True) if key != 'price_html' else value
+            for key, value in self.graph.app_info(index).items()})
+
+    def _render_cards(self, indices):
+        return self._card_list.substitute(cards='\n'.join(self._render_info(self._card, index) for index in indices))
+
+    async def _respond(self, render):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * self._random.uniform(1 - self.jitter, 1 + self.jitter))
+        if self._random.random() < self.error_rate:
+            return web.Response(status=self.error_status)
+        body = render()
+        if body is None:
+            return web.Response(status=404)
+        return web.Response(text=body, content_type='text/html')
+
+    async def details(self, request):
+        index = self.graph.index_of(request.query.get('id', ''))
+        return await self._respond(lambda: None if index is None else self._render_info(self._details, index))
+
+    async def similar(self, request):
+        index = self.graph.index_of(request.query.get('id', ''))
+        return await self._respond(lambda: None if index is None else self._render_cards(self.graph.similar(index)))
+
+    async def collection(self, request):
+        data = await request.post()
+        coln = request.match_info.get('coln')
+        catg = request.match_info.get('catg', '')
+        start, num = int(data.get('start', 0)), int(data.get('num', 60))
+        return await self._respond(lambda: self._render_cards(self.graph.collection(coln, catg, start, num)))
+
+    async def search(self, request):
+        token = request.query.get('q', '')
+        return await self._respond(lambda: self._render_cards(self.graph.search(token)))
+
+    def application(self):
+        app = web.Application()
+        app.router.add_get('/store/apps/details', self.details)
+        app.router.add_get('/store/apps/similar', self.similar)
+        app.router.add_post('/store/apps/collection/{coln}', self.collection)
+        app.router.add_post('/store/apps/category/{catg}/collection/{coln}', self.collection)
+        app.router.add_post('/store/search', self.search)
+        return app
+
+def run_stub(connection, graph_options, stub_options):
+    """
+    Entry point of the stub process: serves on an ephemeral port, which is sent back over `connection`.
+    """
+    stub = PlayStub(SyntheticGraph(**graph_options), **stub_options)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind((STUB_HOST, 0))
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    runner = web.AppRunner(stub.application(), access_log=None)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.SockSite(runner, sock).start())
+    connection.send(sock.getsockname()[1])
+    connection.close()
+    loop.run_forever()